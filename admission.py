@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+""" Admission of connections to reticulum servers, paced to avoid join storms """
+import asyncio
+import heapq
+import itertools
+import random
+from typing import Iterable, List, Optional, Set, Tuple
+
+# Connections connecting and joining their rooms at the same time.
+MAX_PENDING = 8
+
+# Connections started per second, on average.
+CONNECT_RATE = 10.0
+
+# Seconds after which a connection gives back its slot even if its joins are not answered.
+ADMISSION_TIMEOUT = 10.0
+
+class Ticket:
+    """
+    A class represents the slot of an admitted connection, held until every
+    room of the connection received its first presence_state or was given up
+    after its joins were rejected, or until the admission timeout.
+    """
+    __slots__ = ('admission', 'pending', 'timer')
+
+    def __init__(self, admission: "Admission", hub_ids: Iterable[str]) -> None:
+        self.admission = admission
+        self.pending = set(hub_ids)  # type: Set[str]
+        self.timer = None  # type: Optional[asyncio.TimerHandle]
+
+    def done(self, hub_id: str) -> None:
+        """
+        Marks a room as joined or given up, and gives back the slot after the last one.
+
+        Args:
+            hub_id(str): hub_id
+        """
+        self.pending.discard(hub_id)
+        if not self.pending:
+            self.release()
+
+    def release(self) -> None:
+        """
+        Gives back the slot, if not done yet.
+        """
+        if self.admission is not None:
+            self.timer.cancel()
+            self.admission.release()
+            self.admission = None
+            self.pending.clear()
+
+class Admission:
+    """
+    A class admits connections in priority order: at most max_pending of
+    them connect and join at the same time, and they start at a jittered
+    pace of rate per second, so that hundreds of rooms do not open their
+    TLS handshakes and send their joins all at once.
+    """
+
+    def __init__(self,
+                 max_pending: int = MAX_PENDING,
+                 rate: float = CONNECT_RATE,
+                 timeout: float = ADMISSION_TIMEOUT) -> None:
+        """
+        Args:
+            max_pending(int): connections connecting and joining at the same time
+            rate(float): connections started per second, unlimited if 0
+            timeout(float): seconds after which a slot is given back anyway
+        """
+        self.max_pending = max(1, max_pending)
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.timeout = timeout
+        self.active = 0
+        self.next_start = 0.0
+        # (priority, sequence, future resolved with the start time)
+        self.waiting = []  # type: List[Tuple[tuple, int, asyncio.Future]]
+        self.sequence = itertools.count()
+
+    async def acquire(self,
+                      hub_ids: Iterable[str],
+                      priority: tuple,
+                      stop: "asyncio.Future[None]"
+                     ) -> Optional[Ticket]:
+        """
+        Waits for the turn of a connection.
+
+        Args:
+            hub_ids: rooms joined on the connection
+            priority(tuple): lower values are admitted first
+            stop: stop condition
+
+        Returns:
+            Ticket: slot to be released once the rooms are joined, None if stopped first
+        """
+        loop = asyncio.get_event_loop()
+        turn = loop.create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), turn))
+        self.__grant()
+        await asyncio.wait([turn, stop], return_when=asyncio.FIRST_COMPLETED)
+        if not turn.done():
+            # Skipped by __grant().
+            turn.cancel()
+            return None
+
+        ticket = Ticket(self, hub_ids)
+        ticket.timer = loop.call_later(self.timeout, ticket.release)
+        delay = turn.result() - loop.time()
+        if delay > 0:
+            await asyncio.wait([stop], timeout=delay)
+        if stop.done():
+            ticket.release()
+            return None
+        return ticket
+
+    def release(self) -> None:
+        """
+        Gives back a slot, called by Ticket.
+        """
+        self.active -= 1
+        self.__grant()
+
+    def __grant(self) -> None:
+        """
+        Gives the free slots to the first waiting connections, with their start times.
+        """
+        now = asyncio.get_event_loop().time()
+        while self.active < self.max_pending and self.waiting:
+            _, _, turn = heapq.heappop(self.waiting)
+            if turn.done():
+                continue
+            self.active += 1
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval * random.uniform(0.5, 1.5)
+            turn.set_result(start)
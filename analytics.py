@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+""" A program to reconstruct sessions from the csv logs of hubsmon and report dwell times,
+concurrency and lobby to room conversion """
+import argparse
+import csv
+import gc
+import glob
+import os
+import time
+from operator import itemgetter
+from typing import Dict, List, Tuple
+import numpy as np
+from csvwriter import SEGMENT_PATTERN, read_rows
+from roster import PLACES
+
+# Header of the <hub_id>.csv event logs written by hubsmon.
+LOG_HEADER = ['Timestamp', 'Display name', 'Event type', 'Room or lobby',
+              'Access from HMD', 'Access from Mobile']
+
+# Event types, as codes of the event column. Logs written with coalescing
+# also have 'moves' and 'rejoin' rows, expanded or dropped when loaded.
+EVENTS = ('in', 'joins', 'leaves', 'moves', 'rejoin')
+IN, JOINS, LEAVES, MOVES, REJOIN = range(len(EVENTS))
+
+# Default seconds of a concurrency bucket.
+CONCURRENCY_INTERVAL = 60
+# Default maximum seconds between leaving the lobby and entering the room.
+CONVERSION_WINDOW = 30
+# Upper bounds of the dwell time histogram in seconds.
+DWELL_BOUNDS = (60, 300, 900, 1800, 3600, 7200)
+
+class EventLog:
+    """
+    A class holds the rows of the event logs of all hubs as columns.
+
+    Display names and places are integer codes. Rows keep the order of
+    their files, one file after another. Only 'in', 'joins' and 'leaves'
+    events remain, see expand_coalesced().
+    """
+    __slots__ = ('hub_ids', 'names', 'hub', 'time', 'name', 'place', 'event')
+
+    def __init__(self, hub_ids: List[str], names: List[str],
+                 columns: Dict[str, np.ndarray]) -> None:
+        """
+        Args:
+            hub_ids: hub_id of each hub code
+            names: display name of each name code
+            columns: hub, time (epoch seconds), name, place and event codes
+        """
+        self.hub_ids = hub_ids
+        self.names = names
+        self.hub = columns['hub']
+        self.time = columns['time']
+        self.name = columns['name']
+        self.place = columns['place']
+        self.event = columns['event']
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+class Sessions:
+    """
+    A class holds the sessions paired from an EventLog as columns.
+
+    Sessions present when the monitor started ('in' rows) have an unknown
+    start, and those still present when the log ends have an unknown end:
+    they are flagged as censored and left out of dwell times.
+    """
+    __slots__ = ('hub', 'name', 'place', 'start', 'end', 'left_censored', 'right_censored')
+
+    def __init__(self, columns: Dict[str, np.ndarray]) -> None:
+        self.hub = columns['hub']
+        self.name = columns['name']
+        self.place = columns['place']
+        self.start = columns['start']
+        self.end = columns['end']
+        self.left_censored = columns['left_censored']
+        self.right_censored = columns['right_censored']
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def get_complete(self) -> np.ndarray:
+        """
+        Returns the mask of the sessions whose start and end are both known.
+        """
+        return ~(self.left_censored | self.right_censored)
+
+def find_logs(paths: List[str]) -> List[str]:
+    """
+    Returns the event logs among the given files and directories.
+
+    Args:
+        paths: csv files, or directories searched for *.csv
+
+    Returns:
+        list: csv files starting with the event log header, rotated segments excluded
+    """
+    logs = []
+    for path in paths:
+        candidates = sorted(glob.glob(os.path.join(path, '*.csv'))) \
+            if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            if SEGMENT_PATTERN.search(candidate):
+                continue
+            with open(candidate, newline='') as csv_file:
+                if next(csv.reader(csv_file), None) == LOG_HEADER:
+                    logs.append(candidate)
+    return logs
+
+def get_name(path: str) -> str:
+    """
+    Returns the hub_id of an event log, its file name without .csv.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+def load_logs(paths: List[str], start: str = None, end: str = None) -> EventLog:
+    """
+    Reads event logs, and their rotated segments, into columns.
+
+    Args:
+        paths: <hub_id>.csv event logs
+        start(str): first timestamp, e.g. '2020-11-13 14:00:00', from the beginning if omitted
+        end(str): last timestamp, to the end if omitted
+
+    Returns:
+        EventLog: rows of all logs
+    """
+    event_codes = {event: code for code, event in enumerate(EVENTS)}
+    name_codes = {}  # type: Dict[str, int]
+    hub_ids = []
+    columns = {field: [] for field in ('hub', 'time', 'name', 'place', 'event')}
+    for path in paths:
+        # Rows hold no reference cycles: collections would only rescan them.
+        gc.disable()
+        try:
+            rows = [row for row in read_rows(os.path.dirname(path), get_name(path), start, end)
+                    if len(row) >= 4]
+            timestamps, names, events, places = [list(map(itemgetter(index), rows))
+                                                 for index in range(4)]
+            del rows
+        finally:
+            gc.enable()
+        if not timestamps:
+            continue
+        fields = expand_coalesced({
+            'hub': np.full(len(timestamps), len(hub_ids), dtype=np.int32),
+            'time': np.array(timestamps, dtype='datetime64[s]').astype(np.int64),
+            'name': np.array([name_codes.setdefault(name, len(name_codes)) for name in names],
+                             dtype=np.int32),
+            'place': (np.array(places) != PLACES[0]).astype(np.int8),
+            'event': np.array([event_codes[event] for event in events], dtype=np.int8),
+        })
+        for field, array in fields.items():
+            columns[field].append(array)
+        hub_ids.append(get_name(path))
+
+    empty = {'hub': np.int32, 'time': np.int64, 'name': np.int32,
+             'place': np.int8, 'event': np.int8}
+    return EventLog(hub_ids, list(name_codes),
+                    {field: np.concatenate(arrays) if arrays else np.empty(0, empty[field])
+                     for field, arrays in columns.items()})
+
+def expand_coalesced(fields: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Returns the rows of a log with its coalesced events undone: a 'moves'
+    row becomes a leave of the other place and a join of its place at the
+    same time, and 'rejoin' rows are dropped, the session going on.
+
+    Args:
+        fields: hub, time, name, place and event columns of a log
+
+    Returns:
+        dict: the columns, holding only 'in', 'joins' and 'leaves' events
+    """
+    event = fields['event']
+    if not (event >= MOVES).any():
+        return fields
+    repeats = np.where(event == MOVES, 2, np.where(event == REJOIN, 0, 1))
+    expanded = {field: np.repeat(array, repeats) for field, array in fields.items()}
+    # The first copy of each move leaves the other place, the second joins its place.
+    firsts = (np.cumsum(repeats) - repeats)[event == MOVES]
+    expanded['place'][firsts] = 1 - expanded['place'][firsts]
+    expanded['event'][firsts] = LEAVES
+    expanded['event'][expanded['event'] == MOVES] = JOINS
+    return expanded
+
+def get_group_starts(*keys: np.ndarray) -> np.ndarray:
+    """
+    Returns the mask of the rows starting a run of equal keys.
+
+    Args:
+        keys: columns of equal length
+    """
+    starts = np.zeros(len(keys[0]), dtype=bool)
+    if len(starts):
+        starts[0] = True
+        for key in keys:
+            starts[1:] |= key[1:] != key[:-1]
+    return starts
+
+def grouped_cumsum(values: np.ndarray, group: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Returns the running sum of values restarting at each group.
+
+    Args:
+        values: integer column
+        group: group index of each row, non-decreasing
+        starts: mask of the rows starting a group
+    """
+    total = np.cumsum(values, dtype=np.int64)
+    return total - (total - values)[starts][group]
+
+def pair_sessions(log: EventLog) -> Sessions:
+    """
+    Pairs joins and leaves into sessions per hub, display name and place.
+
+    Rows are grouped by hub, monitor run, display name and place, in time
+    order. Within a group, leaves are paired first in first out with the
+    preceding joins. Leaves without a join are dropped, and joins without a
+    leave end at the last row of the monitor run. A monitor run starts at
+    each block of 'in' rows, so sessions never span a restart of hubsmon.
+
+    Args:
+        log: event logs
+
+    Returns:
+        Sessions: paired sessions
+    """
+    num_rows = len(log)
+    # Runs of the monitor: a new one starts at the first 'in' row of a block.
+    is_in = log.event == IN
+    run_start = is_in.copy()
+    if num_rows:
+        run_start[1:] &= ~is_in[:-1] | (log.hub[1:] != log.hub[:-1])
+    run = np.cumsum(run_start | get_group_starts(log.hub))
+    run_end = np.zeros(run[-1] + 1 if num_rows else 0, dtype=np.int64)
+    np.maximum.at(run_end, run, log.time)
+
+    order = np.lexsort((np.arange(num_rows), log.time, log.place, log.name, run))
+    run = run[order]
+    event = log.event[order]
+    starts = get_group_starts(run, log.name[order], log.place[order])
+    group = np.cumsum(starts) - 1
+
+    # Leaves that would bring the number of open sessions below zero have no join.
+    is_open = event != LEAVES
+    balance = grouped_cumsum(np.where(is_open, 1, -1), group, starts)
+    offset = group.astype(np.int64) * (2 * num_rows + 1)
+    lowest = np.minimum.accumulate(balance - offset) + offset
+    previous_lowest = np.zeros(num_rows, dtype=np.int64)
+    previous_lowest[1:] = lowest[:-1]
+    previous_lowest[starts] = 0
+    is_close = ~is_open & (balance >= np.minimum(previous_lowest, 0))
+
+    # The k-th join of a group ends at its k-th valid leave, if any.
+    num_groups = group[-1] + 1 if num_rows else 0
+    num_closes = np.bincount(group[is_close], minlength=num_groups)
+    rank = grouped_cumsum(is_open.astype(np.int64), group, starts) - 1
+    is_paired = is_open & (rank < num_closes[group])
+
+    opened = order[is_open]
+    ends = np.empty(len(opened), dtype=np.int64)
+    ends[is_paired[is_open]] = log.time[order[is_close]]
+    ends[~is_paired[is_open]] = run_end[run[is_open & ~is_paired]]
+    return Sessions({
+        'hub': log.hub[opened],
+        'name': log.name[opened],
+        'place': log.place[opened],
+        'start': log.time[opened],
+        'end': ends,
+        'left_censored': log.event[opened] == IN,
+        'right_censored': ~is_paired[is_open],
+    })
+
+def get_dwell_stats(sessions: Sessions) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the distribution of dwell times of the complete sessions in each place.
+
+    Args:
+        sessions: paired sessions
+
+    Returns:
+        dict: per place, number of sessions, mean, percentiles and maximum in
+            seconds, and number of sessions per histogram bucket
+    """
+    complete = sessions.get_complete()
+    stats = {}
+    for code, place in enumerate(PLACES):
+        dwell = (sessions.end - sessions.start)[complete & (sessions.place == code)]
+        row = {'sessions': len(dwell)}  # type: Dict[str, float]
+        if len(dwell):
+            percentiles = np.percentile(dwell, (50, 90, 99))
+            row.update({'mean': float(dwell.mean()), 'p50': float(percentiles[0]),
+                        'p90': float(percentiles[1]), 'p99': float(percentiles[2]),
+                        'max': float(dwell.max())})
+        bins = np.searchsorted(np.array(DWELL_BOUNDS), dwell, side='right')
+        for index, num in enumerate(np.bincount(bins, minlength=len(DWELL_BOUNDS) + 1)):
+            row[get_bucket_label(index)] = int(num)
+        stats[place] = row
+    return stats
+
+def get_bucket_label(index: int) -> str:
+    """
+    Returns the label of a dwell time histogram bucket, e.g. '<5m' or '>=2h'.
+    """
+    def format_seconds(seconds: int) -> str:
+        return f"{seconds // 3600}h" if seconds >= 3600 else f"{seconds // 60}m"
+    if index < len(DWELL_BOUNDS):
+        return f"<{format_seconds(DWELL_BOUNDS[index])}"
+    return f">={format_seconds(DWELL_BOUNDS[-1])}"
+
+def get_concurrency(sessions: Sessions, interval: int,
+                    by_hub: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the peak number of concurrent sessions per time bucket, censored
+    sessions included. Buckets without any join or leave are omitted: the
+    number of sessions is then the one at the end of the previous bucket.
+
+    Args:
+        sessions: paired sessions
+        interval(int): seconds of a bucket
+        by_hub(bool): one curve per hub and place, or per place across all hubs
+
+    Returns:
+        tuple: hub code (-1 across hubs), place code, bucket start and peak of each bucket
+    """
+    num_sessions = len(sessions)
+    hub = np.concatenate([sessions.hub, sessions.hub]) if by_hub else \
+        np.full(2 * num_sessions, -1, dtype=np.int32)
+    place = np.concatenate([sessions.place, sessions.place])
+    times = np.concatenate([sessions.start, sessions.end])
+    delta = np.concatenate([np.ones(num_sessions, dtype=np.int64),
+                            -np.ones(num_sessions, dtype=np.int64)])
+    # At the same second, leaves are counted before joins: a move is not a peak.
+    order = np.lexsort((delta, times, place, hub))
+    hub, place, times, delta = hub[order], place[order], times[order], delta[order]
+
+    starts = get_group_starts(hub, place)
+    level = grouped_cumsum(delta, np.cumsum(starts) - 1, starts)
+    peaks = np.maximum(level, level - delta)
+    bucket = times - times % interval
+    bucket_starts = np.flatnonzero(starts | get_group_starts(bucket))
+    if not len(bucket_starts):
+        return hub, place, bucket, peaks
+    return (hub[bucket_starts], place[bucket_starts], bucket[bucket_starts],
+            np.maximum.reduceat(peaks, bucket_starts))
+
+def get_conversion(sessions: Sessions, window: int) -> np.ndarray:
+    """
+    Returns the mask of the lobby sessions followed by a room session of the
+    same display name in the same hub, starting at most window seconds from
+    the end of the lobby session.
+
+    Args:
+        sessions: paired sessions
+        window(int): seconds
+
+    Returns:
+        numpy.ndarray: one bool per session, False for room sessions
+    """
+    converted = np.zeros(len(sessions), dtype=bool)
+    lobby = (sessions.place == 1) & ~sessions.right_censored
+    room = sessions.place == 0
+    if not lobby.any() or not room.any():
+        return converted
+
+    # Room starts sorted by person, then time, as one int64 key per session.
+    origin = min(sessions.start.min(), sessions.end.min()) - window
+    span = max(sessions.start.max(), sessions.end.max()) - origin + window + 1
+    person = sessions.hub.astype(np.int64) * (sessions.name.max() + 1) + sessions.name
+    room_keys = np.sort(person[room] * span + (sessions.start[room] - origin))
+    lobby_base = person[lobby] * span + (sessions.end[lobby] - origin)
+    found = np.searchsorted(room_keys, lobby_base - window)
+    valid = found < len(room_keys)
+    converted[np.flatnonzero(lobby)[valid]] = \
+        room_keys[found[valid]] <= lobby_base[valid] + window
+    return converted
+
+def write_sessions(path: str, log: EventLog, sessions: Sessions) -> None:
+    """
+    Writes the paired sessions to a csv file.
+    """
+    names = np.array(log.names, dtype=object)
+    hub_ids = np.array(log.hub_ids, dtype=object)
+    starts = sessions.start.astype('datetime64[s]').astype(str)
+    ends = sessions.end.astype('datetime64[s]').astype(str)
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(['hub_id', 'Display name', 'Room or lobby', 'Start', 'End',
+                         'Dwell seconds', 'Start unknown', 'End unknown'])
+        writer.writerows(zip(hub_ids[sessions.hub], names[sessions.name],
+                             np.array(PLACES)[sessions.place], np.char.replace(starts, 'T', ' '),
+                             np.char.replace(ends, 'T', ' '), sessions.end - sessions.start,
+                             sessions.left_censored, sessions.right_censored))
+
+def write_concurrency(path: str, log: EventLog, sessions: Sessions, interval: int) -> None:
+    """
+    Writes the concurrency curves per hub and across hubs ('*') to a csv file.
+    """
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(['Bucket start', 'hub_id', 'Room or lobby', 'Peak sessions'])
+        for by_hub in (False, True):
+            hub, place, bucket, peaks = get_concurrency(sessions, interval, by_hub)
+            hub_ids = np.array(log.hub_ids + ['*'], dtype=object)
+            starts = np.char.replace(bucket.astype('datetime64[s]').astype(str), 'T', ' ')
+            writer.writerows(zip(starts, hub_ids[hub], np.array(PLACES)[place], peaks))
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+
+    # Parse command line arguments.
+    parser = argparse.ArgumentParser(
+        description="analytics - A tool to report dwell times, concurrency and lobby to room "
+                    "conversion from the csv logs of hubsmon."
+    )
+    parser.add_argument("paths", nargs='*', default=['.'],
+                        help="<hub_id>.csv files or directories containing them "
+                             "(current directory if omitted)")
+    parser.add_argument("-i", "--interval", type=int, default=CONCURRENCY_INTERVAL,
+                        help="seconds of a concurrency bucket")
+    parser.add_argument("-w", "--window", type=int, default=CONVERSION_WINDOW,
+                        help="maximum seconds between leaving the lobby and entering the room")
+    parser.add_argument("--start", help="first timestamp, e.g. '2020-11-13 14:00:00'")
+    parser.add_argument("--end", help="last timestamp, e.g. '2020-11-13 14:30:00'")
+    parser.add_argument("-o", "--output-dir",
+                        help="write sessions.csv and concurrency.csv to this directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = find_logs(args.paths)
+    log = load_logs(paths, args.start, args.end)
+    loaded_at = time.perf_counter()
+    sessions = pair_sessions(log)
+    converted = get_conversion(sessions, args.window)
+    print(f"Loaded {len(log)} rows of {len(log.hub_ids)} hubs in {loaded_at - start:.2f} seconds, "
+          f"paired {len(sessions)} sessions in {time.perf_counter() - loaded_at:.2f} seconds.")
+
+    print("Dwell time (seconds) of sessions with a known start and end:")
+    stats = get_dwell_stats(sessions)
+    columns = ['sessions', 'mean', 'p50', 'p90', 'p99', 'max'] + \
+        [get_bucket_label(index) for index in range(len(DWELL_BOUNDS) + 1)]
+    print(f"{'':<6}" + ''.join(f"{column:>9}" for column in columns))
+    for place, row in stats.items():
+        print(f"{place:<6}" + ''.join(f"{row[column]:>9.0f}" if column in row else f"{'-':>9}"
+                                      for column in columns))
+
+    _, place, bucket, peaks = get_concurrency(sessions, args.interval, by_hub=False)
+    for code, name in enumerate(PLACES):
+        mask = place == code
+        if mask.any():
+            index = np.argmax(np.where(mask, peaks, -1))
+            print(f"Peak concurrent sessions in {name}: {peaks[index]} at "
+                  f"{str(bucket[index].astype('datetime64[s]')).replace('T', ' ')}.")
+
+    lobby = (sessions.place == 1) & ~sessions.right_censored
+    if lobby.any():
+        print(f"Lobby to room conversion: {converted.sum()} of {lobby.sum()} lobby sessions "
+              f"({converted.sum() / lobby.sum():.1%}) entered the room within "
+              f"{args.window} seconds.")
+        for code, hub_id in enumerate(log.hub_ids):
+            hub_lobby = lobby & (sessions.hub == code)
+            if hub_lobby.any():
+                print(f"  {hub_id}: {converted[hub_lobby].mean():.1%} "
+                      f"of {hub_lobby.sum()}")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        write_sessions(os.path.join(args.output_dir, 'sessions.csv'), log, sessions)
+        write_concurrency(os.path.join(args.output_dir, 'concurrency.csv'), log, sessions,
+                          args.interval)
+        print(f"Sessions and concurrency written to {args.output_dir}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the analytics command on synthetic multi-day event logs: visitors
+wait in the lobby, most of them enter the room, and the monitor restarts
+once a day with 'in' rows for the sessions present.
+
+Reports the time to load the logs, pair sessions, and compute dwell times,
+concurrency and lobby to room conversion.
+"""
+import argparse
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import analytics  # pylint: disable=wrong-import-position
+
+def make_rows(num_rows: int, days: int) -> list:
+    """
+    Returns chronological event rows of one hub, as written by hubsmon.
+    """
+    start = time.mktime((2021, 3, 1, 0, 0, 0, 0, 0, -1))
+    duration = days * 86400
+    events = []
+    for visitor in range(num_rows // 4):
+        name = f"Visitor-{visitor % 5000}"
+        hmd = random.random() < 0.2
+        joined_at = start + random.random() * duration
+        entered_at = joined_at + random.expovariate(1 / 20)
+        events.append((joined_at, name, 'joins', 'lobby', hmd))
+        events.append((entered_at, name, 'leaves', 'lobby', hmd))
+        if random.random() < 0.7:
+            events.append((entered_at, name, 'joins', 'room', hmd))
+            events.append((entered_at + random.expovariate(1 / 900), name, 'leaves', 'room', hmd))
+    events.sort()
+
+    rows = []
+    present = {}
+    next_restart = start + 86400
+    for at, name, event, place, hmd in events:
+        if at >= start + duration:
+            break
+        if at >= next_restart:
+            # Restart of the monitor: the sessions present are logged as 'in'.
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_restart))
+            rows.extend([stamp, name_place[0], 'in', name_place[1], present_hmd, False]
+                        for name_place, present_hmd in present.items())
+            next_restart += 86400
+        if event == 'joins':
+            present[(name, place)] = hmd
+        else:
+            present.pop((name, place), None)
+        rows.append([time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at)),
+                     name, event, place, hmd, False])
+    return rows
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Analytics benchmark for hubsmon logs.")
+    parser.add_argument("--hubs", type=int, default=20, help="number of hubs")
+    parser.add_argument("--rows", type=int, default=100000, help="rows per hub")
+    parser.add_argument("--days", type=int, default=7, help="days covered by the logs")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='hubsmon-analytics-')
+    try:
+        for index in range(args.hubs):
+            with open(os.path.join(directory, f"hub{index:04d}.csv"), 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+                writer.writerow(analytics.LOG_HEADER)
+                writer.writerows(make_rows(args.rows, args.days))
+
+        start = time.perf_counter()
+        log = analytics.load_logs(analytics.find_logs([directory]))
+        loaded_at = time.perf_counter()
+        sessions = analytics.pair_sessions(log)
+        paired_at = time.perf_counter()
+        analytics.get_dwell_stats(sessions)
+        analytics.get_concurrency(sessions, analytics.CONCURRENCY_INTERVAL)
+        analytics.get_concurrency(sessions, analytics.CONCURRENCY_INTERVAL, by_hub=False)
+        converted = analytics.get_conversion(sessions, analytics.CONVERSION_WINDOW)
+        done_at = time.perf_counter()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{len(log)} rows, {len(sessions)} sessions, {converted.sum()} lobby to room")
+    print(f"load {loaded_at - start:.2f} s, pair {paired_at - loaded_at:.2f} s, "
+          f"reports {done_at - paired_at:.2f} s, "
+          f"{len(log) / (done_at - start):.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Measure hubsmon.process_message on a mix of hub frames: decoding every frame
+with json (the former behavior), the prefix-classified fast path with json,
+and the fast path with the installed JSON backend (orjson/ujson).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import hubsmon  # pylint: disable=wrong-import-position
+import phoenix  # pylint: disable=wrong-import-position
+from recorder import read_recording  # pylint: disable=wrong-import-position
+
+def make_meta(presence: str) -> dict:
+    """
+    Returns a presence meta shaped like the ones sent by reticulum.
+    """
+    return {
+        "context": {"embed": False, "mobile": random.random() < 0.3},
+        "permissions": {name: False for name in (
+            "close_hub", "embed_hub", "fly", "join_hub", "kick_users", "mute_users",
+            "pin_objects", "spawn_and_move_media", "spawn_camera", "spawn_drawing",
+            "spawn_emoji", "update_hub", "update_hub_promotion", "update_roles")},
+        "phx_ref": uuid.uuid4().hex[:12],
+        "presence": presence,
+        "profile": {"avatarId": "gVgSB4W", "displayName": "Ringed-Teal-15373"},
+        "roles": {"creator": False, "owner": False, "signed_in": False},
+    }
+
+def make_naf(topic: str) -> str:
+    """
+    Returns a NAF entity update frame, the bulk of the traffic of a busy hub.
+    """
+    components = {str(index): {"x": random.random(), "y": random.random(),
+                               "z": random.random()} for index in range(8)}
+    data = {"d": [{"networkId": uuid.uuid4().hex[:7], "owner": str(uuid.uuid4()),
+                   "lastOwnerTime": time.time(), "template": "#remote-avatar",
+                   "persistent": False, "parent": None, "components": components}
+                  for _ in range(3)]}
+    return json.dumps(["2", None, topic, "naf", {"dataType": "um", "data": data}])
+
+def make_frames(num_frames: int, presence_ratio: float) -> list:
+    """
+    Returns a synthetic frame mix: mostly NAF, some chat, presence_diff and replies.
+    """
+    topic = "hub:bench01"
+    frames = []
+    for _ in range(num_frames):
+        draw = random.random()
+        if draw < presence_ratio:
+            key = str(uuid.uuid4())
+            frames.append(json.dumps([None, None, topic, "presence_diff", {
+                "joins": {key: {"metas": [make_meta("room")]}}, "leaves": {}}]))
+        elif draw < presence_ratio + 0.02:
+            frames.append(json.dumps(["2", "5", topic, "phx_reply",
+                                      {"status": "ok", "response": {}}]))
+        elif draw < presence_ratio + 0.07:
+            frames.append(json.dumps(["2", None, topic, "message",
+                                      {"session_id": str(uuid.uuid4()), "type": "chat",
+                                       "body": "hello", "name": "Ringed-Teal-15373"}]))
+        else:
+            frames.append(make_naf(topic))
+    return frames
+
+def run(frames: list, repeat: int) -> float:
+    """
+    Returns frames processed per second by hubsmon.process_message.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hubsmon.rosters.clear()
+        for message in frames:
+            hubsmon.process_message('bench01', message)
+    return len(frames) * repeat / (time.perf_counter() - start)
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Frame dispatch benchmark for hubsmon.")
+    parser.add_argument("--frames", help="file with one frame per line, or a recording of "
+                                         "hubsmon --record (.gz), a synthetic mix if omitted")
+    parser.add_argument("--count", type=int, default=20000, help="number of synthetic frames")
+    parser.add_argument("--presence-ratio", type=float, default=0.05,
+                        help="share of presence_diff frames in the synthetic mix")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the frames")
+    args = parser.parse_args()
+
+    if args.frames and args.frames.endswith('.gz'):
+        frames = [message for _, _, message in read_recording(args.frames)]
+    elif args.frames:
+        with open(args.frames) as frames_file:
+            frames = [line.rstrip('\n') for line in frames_file if line.strip()]
+    else:
+        random.seed(0)
+        frames = make_frames(args.count, args.presence_ratio)
+
+    # Isolate dispatch from console and disk output.
+    hubsmon.process_meta = lambda hub_id, meta, event_type: None
+
+    classify = hubsmon.classify
+    variants = [('decode all (json)', lambda message: (None, None), json.loads),
+                ('fast path (json)', classify, json.loads)]
+    if phoenix.JSON_BACKEND != 'json':
+        variants.append((f"fast path ({phoenix.JSON_BACKEND})", classify, phoenix.loads))
+
+    size = sum(map(len, frames)) / len(frames)
+    print(f"{len(frames)} frames, {size:.0f} bytes on average")
+    print(f"{'variant':>22} {'frames/s':>12}")
+    for name, classifier, decoder in variants:
+        hubsmon.classify = classifier
+        hubsmon.loads = decoder
+        print(f"{name:>22} {run(frames, args.repeat):>12.0f}")
+
+if __name__ == "__main__":
+    main()
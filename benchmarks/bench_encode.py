@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the encoding cost of join and chat messages: the former per-call
+template read, str.replace and JSON round trip, against compiled templates.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import phoenix  # pylint: disable=wrong-import-position
+
+def legacy_req_str(template: str, hub_id: str, seq_number: int, monitor_name: str,
+                   join_ref: str = None) -> str:
+    """
+    Returns a join request string the way hubsmon built it before compiled templates.
+    """
+    with open(template) as template_file:
+        template_str = template_file.read()
+        json_str = template_str.replace("{$hub_id}", hub_id)
+        json_str = json_str.replace("{$seq_num}", str(seq_number))
+        json_str = json_str.replace("{$monitor_name}", monitor_name)
+        json_data = json.loads(json_str)
+        if join_ref is not None:
+            json_data[0] = join_ref
+        return json.dumps(json_data)
+
+def legacy_chat_str(hub_id: str, seq_number: int, message: str, join_ref: str = None) -> str:
+    """
+    Returns a chat request string the way hubsmsg built it before compiled templates.
+    """
+    json_str = phoenix.CHAT_TEMPLATE.replace("{$hub_id}", hub_id)
+    json_str = json_str.replace("{$seq_num}", str(seq_number))
+    json_str = json_str.replace("{$msg}", message)
+    json_data = json.loads(json_str)
+    if join_ref is not None:
+        json_data[0] = join_ref
+    return json.dumps(json_data)
+
+def measure(function, count: int) -> float:
+    """
+    Returns microseconds per call of function(seq_number).
+    """
+    start = time.perf_counter()
+    for seq_number in range(count):
+        function(seq_number)
+    return (time.perf_counter() - start) / count * 1e6
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Message encoding benchmark.")
+    parser.add_argument("--count", type=int, default=100000, help="messages per case")
+    args = parser.parse_args()
+
+    template = os.path.join(ROOT_DIR, phoenix.HUB_JOIN_TEMPLATE)
+    text = "Hello from the poster session, see you in room 3!"
+    cases = [
+        ('hub join', lambda seq: legacy_req_str(template, 'jccsqWd', seq, 'hubsmon', '2'),
+         lambda seq: phoenix.get_req_str(template, 'jccsqWd', seq, 'hubsmon', '2')),
+        ('chat', lambda seq: legacy_chat_str('jccsqWd', seq, text, '2'),
+         lambda seq: phoenix.get_chat_str('jccsqWd', seq, text, '2')),
+    ]
+
+    print(f"{'message':>10} {'legacy us':>10} {'compiled us':>12} {'speedup':>8}")
+    for name, legacy, compiled in cases:
+        assert legacy(1) == compiled(1)
+        legacy_us = measure(legacy, args.count)
+        compiled_us = measure(compiled, args.count)
+        speedup = legacy_us / compiled_us
+        print(f"{name:>10} {legacy_us:>10.2f} {compiled_us:>12.2f} {speedup:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the thread-per-room layout with the shared event loop used by
+hubsmon, with and without multiplexed connections, against the local
+stand-in server.
+
+Each trial runs in a fresh subprocess and reports thread count, RSS, CPU time
+and per-message latency (stand-in send time to the end of process_message).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import connection  # pylint: disable=wrong-import-position
+import hubsmon  # pylint: disable=wrong-import-position
+from room import Room  # pylint: disable=wrong-import-position
+from standin import run_server  # pylint: disable=wrong-import-position
+
+def get_rss_kb() -> int:
+    """
+    Returns the current resident set size in KiB.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def make_rooms(num_rooms: int, port: int) -> list:
+    """
+    Returns rooms pointing at the stand-in server, without any HTTP request.
+    """
+    return [Room(f"https://hubs.mozilla.com/bench{i:04d}/bench-room", f"127.0.0.1:{port}")
+            for i in range(num_rooms)]
+
+# Send time the stand-in adds to every meta, which the monitor does not keep.
+SENT_AT_PATTERN = re.compile(r'"sent_at": ?([0-9.]+)')
+
+def record_latency(latencies: list) -> None:
+    """
+    Wrap hubsmon.process_message to record the stand-in send → processed
+    latency of every meta of the presence frames.
+    """
+    process_message = hubsmon.process_message
+
+    def timed_process_message(hub_id, message, *args):
+        result = process_message(hub_id, message, *args)
+        now = time.time()
+        latencies.extend(now - float(sent_at) for sent_at in SENT_AT_PATTERN.findall(message))
+        return result
+
+    hubsmon.process_message = timed_process_message
+
+def run_room_thread(hubs_room: Room, name: str, stops: list) -> None:
+    """
+    Thread target reproducing the former layout: one event loop per room.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    stop = loop.create_future()
+    inputs = asyncio.Queue()
+    joins, _ = hubsmon.get_joins([hubs_room], name)
+    stops.append((loop, stop))
+    loop.run_until_complete(
+        connection.run_client([hubs_room], inputs, stop, hubsmon.process_message, joins=joins))
+    loop.close()
+
+def run_trial(mode: str, num_rooms: int, port: int, duration: float) -> dict:
+    """
+    Monitor num_rooms rooms for duration seconds and return the measurements.
+    """
+    hubs_rooms = make_rooms(num_rooms, port)
+    latencies = []
+    record_latency(latencies)
+    sample = {}
+
+    def take_sample():
+        sample['threads'] = threading.active_count()
+        sample['rss_kb'] = get_rss_kb()
+
+    if mode == 'threads':
+        stops = []
+        threads = [threading.Thread(target=run_room_thread, args=(hubs_room, 'Bench', stops))
+                   for hubs_room in hubs_rooms]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        take_sample()
+        for loop, stop in stops:
+            loop.call_soon_threadsafe(connection.request_stop, stop)
+        for thread in threads:
+            thread.join()
+    else:
+        async def trial():
+            loop = asyncio.get_event_loop()
+            stop = loop.create_future()
+            loop.call_later(duration, take_sample)
+            loop.call_later(duration, connection.request_stop, stop)
+            await hubsmon.monitor(hubs_rooms, 'Bench', stop, multiplex=(mode == 'multiplex'))
+        asyncio.run(trial())
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    latencies.sort()
+    result = {
+        'mode': mode,
+        'rooms': num_rooms,
+        'threads': sample.get('threads'),
+        'rss_mb': round(sample.get('rss_kb', 0) / 1024, 1),
+        'cpu_s': round(usage.ru_utime + usage.ru_stime, 2),
+        'events': len(latencies),
+    }
+    if latencies:
+        result['lat_mean_ms'] = round(statistics.mean(latencies) * 1000, 2)
+        result['lat_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 2)
+        result['lat_p99_ms'] = round(latencies[int(len(latencies) * 0.99)] * 1000, 2)
+    return result
+
+def trial_main(args: argparse.Namespace) -> None:
+    """
+    Run a single trial in this process and print its result as JSON.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    connection.RETICULUM_IO_URL = "ws://{host}/socket/websocket?vsn=2.0.0"
+
+    workdir = tempfile.mkdtemp(prefix='hubsmon-bench-')
+    for template in ('phx_join_1.template', 'phx_join_2.template'):
+        shutil.copy(os.path.join(ROOT_DIR, template), workdir)
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = run_trial(args.trial, args.rooms[0], args.port, args.duration)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result))
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Event loop layout benchmark for hubsmon.")
+    parser.add_argument("--rooms", default="10,100,500,1000",
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        help="comma separated room counts")
+    parser.add_argument("--modes", default="threads,single,multiplex",
+                        help="comma separated layouts to compare (threads, single, multiplex)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per trial")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between two presence events per room")
+    parser.add_argument("--port", type=int, default=4010, help="stand-in server port")
+    parser.add_argument("--trial", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        trial_main(args)
+        return
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    server = multiprocessing.Process(target=run_server,
+                                     args=('127.0.0.1', args.port, 1 / args.interval),
+                                     daemon=True)
+    server.start()
+    time.sleep(1)
+
+    header = ('mode', 'rooms', 'threads', 'rss_mb', 'cpu_s', 'events',
+              'lat_mean_ms', 'lat_p50_ms', 'lat_p99_ms')
+    print(' '.join(f"{column:>11}" for column in header))
+    try:
+        for num_rooms in args.rooms:
+            for mode in args.modes.split(','):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--trial', mode,
+                     '--rooms', str(num_rooms), '--port', str(args.port),
+                     '--duration', str(args.duration)],
+                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(' '.join(f"{str(result.get(column, '-')):>11}" for column in header))
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the cost of presence_state snapshots of packed rooms: decoding and
+keeping every meta as nested dicts (the former roster), against reducing
+each meta to a Session record right after decoding, as hubsmon does.
+
+Reports the time to decode and apply one snapshot, and the Python heap at
+its peak and once the snapshots of all rooms are kept in their rosters.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import phoenix  # pylint: disable=wrong-import-position
+from roster import Roster, read_sessions  # pylint: disable=wrong-import-position
+from standin import make_meta  # pylint: disable=wrong-import-position
+
+def make_state(num_users: int) -> str:
+    """
+    Returns a presence_state frame of num_users sessions, half of them in the lobby.
+    """
+    state = {str(uuid.uuid4()): {"metas": [make_meta(f"User-{index}",
+                                                     'room' if index % 2 else 'lobby')]}
+             for index in range(num_users)}
+    return json.dumps(["2", None, "hub:bench01", "presence_state", state])
+
+def apply_dicts(loads, message: str) -> dict:
+    """
+    The former roster: every decoded meta is kept, keyed by phx_ref, along
+    with its presence key, place and device.
+    """
+    state = loads(message)[4]
+    sessions = {}
+    keys = {}
+    counts = {}
+    for key in state:
+        for meta in state[key]['metas']:
+            context = meta['context']
+            device = ('hmd' if context.get('hmd') is True else
+                      'mobile' if context.get('mobile') is True else 'desktop')
+            place_device = (meta['presence'], device)
+            sessions[meta['phx_ref']] = (key,) + place_device + (meta,)
+            keys.setdefault(key, set()).add(meta['phx_ref'])
+            counts[place_device] = counts.get(place_device, 0) + 1
+    return sessions
+
+def apply_records(loads, message: str) -> Roster:
+    """
+    The current roster: metas are reduced to Session records and the payload dropped.
+    """
+    roster = Roster()
+    roster.apply_state(read_sessions(loads(message)[4]))
+    return roster
+
+def measure(apply, loads, messages: list, repeat: int) -> dict:
+    """
+    Returns the best time per snapshot, and the heap peak and size once all are kept.
+    The rosters of all rooms are kept while timing, as in the monitor, so that
+    the cost of garbage collection passes over them is included.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        kept = [apply(loads, message) for message in messages]
+        best = min(best, (time.perf_counter() - start) / len(messages))
+        del kept
+
+    gc.collect()
+    tracemalloc.start()
+    kept = [apply(loads, message) for message in messages]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {'ms': best * 1000, 'peak_mb': peak / 1e6, 'kept_mb': current / 1e6}
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="presence_state benchmark for hubsmon.")
+    parser.add_argument("--users", default="100,1000,3000",
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        help="comma separated participant counts per room")
+    parser.add_argument("--rooms", type=int, default=20, help="number of rooms kept")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repetitions")
+    args = parser.parse_args()
+
+    backends = [('json', json.loads)]
+    if phoenix.JSON_BACKEND != 'json':
+        backends.append((phoenix.JSON_BACKEND, phoenix.loads))
+
+    print(f"{'users':>6} {'backend':>8} {'roster':>8} {'ms/state':>9} "
+          f"{'peak MB':>8} {'kept MB':>8}")
+    for num_users in args.users:
+        messages = [make_state(num_users) for _ in range(args.rooms)]
+        for backend, loads in backends:
+            for name, apply in (('dicts', apply_dicts), ('records', apply_records)):
+                result = measure(apply, loads, messages, args.repeat)
+                print(f"{num_users:>6} {backend:>8} {name:>8} {result['ms']:>9.2f} "
+                      f"{result['peak_mb']:>8.1f} {result['kept_mb']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Measure startup room resolution against the local stand-in HTTP server:
+the former one-by-one requests.get + BeautifulSoup lookup, one-by-one Room()
+with the streaming scanner, and the pooled concurrent resolver.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from resolver import resolve_rooms  # pylint: disable=wrong-import-position
+from room import Room  # pylint: disable=wrong-import-position
+from standin import run_http_server  # pylint: disable=wrong-import-position
+
+def resolve_legacy(urls: list) -> list:
+    """
+    The former lookup: full download and DOM parse of every page, one by one.
+    """
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+    hosts = []
+    for url in urls:
+        resp = requests.get(url)
+        resp.raise_for_status()
+        soup = BeautifulSoup(resp.text, 'lxml')
+        for meta in soup.find_all("meta"):
+            if meta.get('name', '').lower() == 'ret:phx_host':
+                hosts.append(meta.get('value', '').lower())
+                break
+    return hosts
+
+def resolve_sequential(urls: list) -> list:
+    """
+    One Room() after another, each with its own connection.
+    """
+    return [Room(url) for url in urls]
+
+def resolve_bulk(urls: list, max_connections: int) -> list:
+    """
+    Pooled concurrent resolution used by hubsmon at startup.
+    """
+    return asyncio.run(resolve_rooms(urls, max_connections))
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Room resolution benchmark for hubsmon.")
+    parser.add_argument("--rooms", type=int, default=200, help="number of rooms")
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="server side delay per page in seconds")
+    parser.add_argument("--page-size", type=int, default=200 * 1024, help="page size in bytes")
+    parser.add_argument("--max-connections", type=int, default=16, help="resolver pool size")
+    parser.add_argument("--port", type=int, default=8090, help="stand-in HTTP server port")
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(
+        target=run_http_server,
+        args=('127.0.0.1', args.port, '127.0.0.1:4000', args.delay, args.page_size),
+        daemon=True)
+    server.start()
+    time.sleep(1)
+
+    urls = [f"http://127.0.0.1:{args.port}/bench{i:04d}/bench-room" for i in range(args.rooms)]
+    methods = [('legacy', lambda: resolve_legacy(urls)),
+               ('sequential', lambda: resolve_sequential(urls)),
+               ('bulk', lambda: resolve_bulk(urls, args.max_connections))]
+    try:
+        print(f"{'method':>11} {'rooms':>7} {'seconds':>9} {'rooms/s':>9}")
+        for name, method in methods:
+            start = time.perf_counter()
+            try:
+                resolved = method()
+            except ImportError:
+                print(f"{name:>11} skipped (bs4/lxml not installed)")
+                continue
+            elapsed = time.perf_counter() - start
+            print(f"{name:>11} {len(resolved):>7} {elapsed:>9.2f} {len(resolved) / elapsed:>9.1f}")
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Run hubsmon against the local stand-in server simulating N rooms of M users
+with join/leave churn, and report throughput, end-to-end event latency, CPU
+time and memory for each combination.
+
+Rooms are resolved over HTTP from the stand-in room pages, as in production.
+Each trial runs in a fresh subprocess; the stand-in runs in its own process
+so its CPU time is not counted.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import connection  # pylint: disable=wrong-import-position
+import hubsmon  # pylint: disable=wrong-import-position
+from bench_event_loop import get_rss_kb, record_latency  # pylint: disable=wrong-import-position
+from csvwriter import CsvWriter  # pylint: disable=wrong-import-position
+from resolver import resolve_rooms  # pylint: disable=wrong-import-position
+from standin import run_standin  # pylint: disable=wrong-import-position
+
+def run_trial(args: argparse.Namespace) -> dict:
+    """
+    Resolve and monitor the rooms for args.duration seconds and return the measurements.
+    """
+    urls = [f"http://127.0.0.1:{args.http_port}/scale{index:04d}/scale-room"
+            for index in range(args.rooms[0])]
+    start = time.perf_counter()
+    hubs_rooms = asyncio.run(resolve_rooms(urls))
+    resolve_s = time.perf_counter() - start
+
+    latencies = []
+    record_latency(latencies)
+    sample = {}
+
+    def take_sample():
+        sample['rss_kb'] = get_rss_kb()
+
+    async def trial():
+        loop = asyncio.get_event_loop()
+        stop = loop.create_future()
+        loop.call_later(args.duration, take_sample)
+        loop.call_later(args.duration, connection.request_stop, stop)
+        await hubsmon.monitor(hubs_rooms, 'Bench', stop, multiplex=args.multiplex,
+                              writer=CsvWriter())
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    asyncio.run(trial())
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    # The presence_state of every room is processed first, then the churn.
+    latencies.sort()
+    result = {
+        'rooms': args.rooms[0],
+        'users': args.users[0],
+        'resolve_s': round(resolve_s, 2),
+        'events': len(latencies),
+        'events_s': round(len(latencies) / elapsed),
+        'cpu_s': round(usage.ru_utime + usage.ru_stime
+                       - usage_before.ru_utime - usage_before.ru_stime, 2),
+        'rss_mb': round(sample.get('rss_kb', 0) / 1024, 1),
+        'peak_mb': round(usage.ru_maxrss / 1024, 1),
+    }
+    if latencies:
+        result['lat_mean_ms'] = round(statistics.mean(latencies) * 1000, 2)
+        result['lat_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 2)
+        result['lat_p99_ms'] = round(latencies[int(len(latencies) * 0.99)] * 1000, 2)
+    return result
+
+def trial_main(args: argparse.Namespace) -> None:
+    """
+    Run a single trial in this process and print its result as JSON.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    connection.RETICULUM_IO_URL = "ws://{host}/socket/websocket?vsn=2.0.0"
+
+    workdir = tempfile.mkdtemp(prefix='hubsmon-bench-')
+    for template in ('phx_join_1.template', 'phx_join_2.template'):
+        shutil.copy(os.path.join(ROOT_DIR, template), workdir)
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = run_trial(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result))
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Scale benchmark of hubsmon.")
+    parser.add_argument("--rooms", default="10,100,500",
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        help="comma separated room counts")
+    parser.add_argument("--users", default="10,100,300",
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        help="comma separated participant counts per room")
+    parser.add_argument("--churn", type=float, default=1.0,
+                        help="presence changes per second per room")
+    parser.add_argument("--naf-rate", type=float, default=0.0,
+                        help="NAF frames per second per room")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per trial")
+    parser.add_argument("-m", "--multiplex", action='store_true',
+                        help="share one connection among rooms")
+    parser.add_argument("--port", type=int, default=4020, help="stand-in WebSocket port")
+    parser.add_argument("--http-port", type=int, default=8020, help="stand-in HTTP port")
+    parser.add_argument("--trial", action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        trial_main(args)
+        return
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    header = ('rooms', 'users', 'resolve_s', 'events', 'events_s', 'cpu_s', 'rss_mb',
+              'peak_mb', 'lat_mean_ms', 'lat_p50_ms', 'lat_p99_ms')
+    print(' '.join(f"{column:>11}" for column in header))
+    for num_users in args.users:
+        # Room state lives in the stand-in: restart it for each population.
+        server = multiprocessing.Process(
+            target=run_standin, args=('127.0.0.1', args.port, args.http_port),
+            kwargs={'churn': args.churn, 'users': num_users, 'naf_rate': args.naf_rate},
+            daemon=True)
+        server.start()
+        time.sleep(1)
+        try:
+            for num_rooms in args.rooms:
+                command = [sys.executable, os.path.abspath(__file__), '--trial',
+                           '--rooms', str(num_rooms), '--users', str(num_users),
+                           '--port', str(args.port), '--http-port', str(args.http_port),
+                           '--duration', str(args.duration)]
+                if args.multiplex:
+                    command.append('--multiplex')
+                output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                                        universal_newlines=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(' '.join(f"{str(result.get(column, '-')):>11}" for column in header))
+        finally:
+            server.terminate()
+            server.join()
+
+if __name__ == "__main__":
+    main()
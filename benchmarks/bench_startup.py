@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Start monitoring N rooms at once against the local stand-in server throttling
+hub joins, as reticulum does, and compare connecting every room right away
+with the admission scheduler.
+
+Reports the rejected joins, the number of rooms monitored, the time until
+the last room received its first presence_state, and the median and maximum
+time to first presence_state per room. Each trial runs in a fresh subprocess.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import connection  # pylint: disable=wrong-import-position
+import hubsmon  # pylint: disable=wrong-import-position
+from admission import Admission  # pylint: disable=wrong-import-position
+from room import Room  # pylint: disable=wrong-import-position
+from standin import run_standin  # pylint: disable=wrong-import-position
+
+MODES = ('burst', 'admission')
+
+def run_trial(args: argparse.Namespace) -> dict:
+    """
+    Start monitoring the rooms and return the measurements once all are monitored.
+    """
+    hubs_rooms = [Room(f"http://127.0.0.1:{args.http_port}/start{index:04d}/start-room",
+                       f"127.0.0.1:{args.port}") for index in range(args.rooms)]
+    admission = None
+    if args.mode == 'admission':
+        admission = Admission(args.max_pending, args.connect_rate)
+    elapsed = {}
+
+    async def watch(stop: "asyncio.Future[None]", start: float) -> None:
+        while not stop.done():
+            await asyncio.wait([stop], timeout=0.05)
+            if not hubsmon.awaiting_state or time.perf_counter() - start >= args.timeout:
+                elapsed['all_s'] = time.perf_counter() - start
+                connection.request_stop(stop)
+
+    async def trial():
+        stop = asyncio.get_event_loop().create_future()
+        watcher = asyncio.ensure_future(watch(stop, time.perf_counter()))
+        await hubsmon.monitor(hubs_rooms, 'Bench', stop, multiplex=args.multiplex,
+                              admission=admission)
+        await watcher
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        asyncio.run(trial())
+
+    first_states = sorted(metrics.first_state for metrics in hubsmon.room_metrics.values()
+                          if metrics.first_state is not None)
+    result = {
+        'mode': args.mode,
+        'rooms': args.rooms,
+        'rejected': output.getvalue().count(' rejected'),
+        'monitored': len(first_states),
+        'all_s': round(elapsed.get('all_s', 0.0), 2),
+    }
+    if first_states:
+        result['first_p50_s'] = round(first_states[len(first_states) // 2], 2)
+        result['first_max_s'] = round(first_states[-1], 2)
+    return result
+
+def trial_main(args: argparse.Namespace) -> None:
+    """
+    Run a single trial in this process and print its result as JSON.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    connection.RETICULUM_IO_URL = "ws://{host}/socket/websocket?vsn=2.0.0"
+
+    workdir = tempfile.mkdtemp(prefix='hubsmon-bench-')
+    for template in ('phx_join_1.template', 'phx_join_2.template'):
+        shutil.copy(os.path.join(ROOT_DIR, template), workdir)
+    os.chdir(workdir)
+    try:
+        result = run_trial(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result))
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="Startup benchmark of hubsmon.")
+    parser.add_argument("--rooms", default="100,300",
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        help="comma separated room counts")
+    parser.add_argument("--join-rate", type=float, default=50.0,
+                        help="hub joins accepted per second by the stand-in")
+    parser.add_argument("--max-pending", type=int, default=8,
+                        help="connections connecting and joining at the same time")
+    parser.add_argument("--connect-rate", type=float, default=40.0,
+                        help="connections started per second")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds after which a trial ends, all rooms monitored or not")
+    parser.add_argument("-m", "--multiplex", action='store_true',
+                        help="share one connection among rooms")
+    parser.add_argument("--port", type=int, default=4030, help="stand-in WebSocket port")
+    parser.add_argument("--http-port", type=int, default=8030, help="stand-in HTTP port")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--trial", action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        args.rooms = args.rooms[0]
+        trial_main(args)
+        return
+
+    header = ('mode', 'rooms', 'rejected', 'monitored', 'all_s', 'first_p50_s', 'first_max_s')
+    print(' '.join(f"{column:>11}" for column in header))
+    for num_rooms in args.rooms:
+        for mode in MODES:
+            # A new stand-in for each trial, so that no room is left over from the previous one.
+            server = multiprocessing.Process(
+                target=run_standin, args=('127.0.0.1', args.port, args.http_port),
+                kwargs={'churn': 0.0, 'users': 10, 'join_rate': args.join_rate}, daemon=True)
+            server.start()
+            time.sleep(1)
+            try:
+                command = [sys.executable, os.path.abspath(__file__), '--trial', '--mode', mode,
+                           '--rooms', str(num_rooms), '--join-rate', str(args.join_rate),
+                           '--max-pending', str(args.max_pending),
+                           '--connect-rate', str(args.connect_rate),
+                           '--timeout', str(args.timeout),
+                           '--port', str(args.port), '--http-port', str(args.http_port)]
+                if args.multiplex:
+                    command.append('--multiplex')
+                output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                                        universal_newlines=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(' '.join(f"{str(result.get(column, '-')):>11}" for column in header))
+            finally:
+                server.terminate()
+                server.join()
+
+if __name__ == "__main__":
+    main()
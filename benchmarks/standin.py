@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+""" A local stand-in for a reticulum server, speaking the Phoenix v2 framing used by hubsmon """
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Set
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+ROOM_PAGE_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<meta name="ret:phx_host" value="{phx_host}">
+<title>Stand-in room</title>
+</head>
+<body>
+"""
+
+# Minimum seconds between two sends of a simulated room.
+TICK = 0.05
+
+class RoomPageHandler(BaseHTTPRequestHandler):
+    """
+    Serves a Hubs-like room page for any path. The body after <head> is padded
+    to page_size bytes so that reading the whole page has a realistic cost.
+    """
+    protocol_version = 'HTTP/1.1'
+    phx_host = '127.0.0.1:4000'
+    delay = 0.0
+    page_size = 200 * 1024
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """
+        Respond with the room page after the configured delay.
+        """
+        if self.delay > 0:
+            time.sleep(self.delay)
+        head = ROOM_PAGE_HEAD.format(phx_host=self.phx_host).encode()
+        padding = b'<div></div>\n' * max(0, (self.page_size - len(head)) // 12)
+        body = head + padding + b'</body>\n</html>\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:  # pylint: disable=arguments-differ
+        pass
+
+class RoomPageServer(ThreadingHTTPServer):
+    """
+    HTTP server tolerating clients that close once they have read enough.
+    """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        pass
+
+def run_http_server(host: str, port: int, phx_host: str,
+                    delay: float = 0.0, page_size: int = 200 * 1024) -> None:
+    """
+    Serve room pages until the process ends. Usable as a thread or process target.
+
+    Args:
+        host(str): address to listen on
+        port(int): port to listen on
+        phx_host(str): value of ret:phx_host in the pages
+        delay(float): seconds to wait before each response, emulating network latency
+        page_size(int): approximate size of a page in bytes
+    """
+    handler = type('Handler', (RoomPageHandler,),
+                   {'phx_host': phx_host, 'delay': delay, 'page_size': page_size})
+    RoomPageServer((host, port), handler).serve_forever()
+
+# Share of participants joining from a mobile device and from a head-mounted display.
+MOBILE_RATIO = 0.3
+HMD_RATIO = 0.05
+
+def make_meta(display_name: str, presence: str) -> dict:
+    """
+    Returns a presence meta shaped like the ones sent by reticulum.
+
+    Args:
+        display_name(str): user's display name
+        presence(str): 'room' or 'lobby'
+
+    Returns:
+        dict: presence meta. 'sent_at' carries the send time for latency measurement.
+    """
+    draw = random.random()
+    return {
+        "context": {"embed": False, "mobile": draw < MOBILE_RATIO,
+                    "hmd": MOBILE_RATIO <= draw < MOBILE_RATIO + HMD_RATIO},
+        "permissions": {name: False for name in (
+            "close_hub", "embed_hub", "fly", "join_hub", "kick_users", "mute_users",
+            "pin_objects", "spawn_and_move_media", "spawn_camera", "spawn_drawing",
+            "spawn_emoji", "update_hub", "update_hub_promotion", "update_roles")},
+        "phx_ref": uuid.uuid4().hex[:12],
+        "presence": presence,
+        "profile": {"avatarId": "gVgSB4W", "displayName": display_name},
+        "roles": {"creator": False, "owner": False, "signed_in": False},
+        "sent_at": time.time(),
+    }
+
+def make_naf(topic: str) -> str:
+    """
+    Returns a NAF entity update frame, as sent by participants' clients.
+    """
+    components = {str(index): {"x": random.random(), "y": random.random(),
+                               "z": random.random()} for index in range(8)}
+    data = {"d": [{"networkId": uuid.uuid4().hex[:7], "owner": str(uuid.uuid4()),
+                   "lastOwnerTime": time.time(), "template": "#remote-avatar",
+                   "persistent": False, "parent": None, "components": components}]}
+    return json.dumps([None, None, topic, "naf", {"dataType": "um", "data": data}])
+
+def reply(msg: list, status: str = "ok", response: dict = None) -> str:
+    """
+    Returns a phx_reply frame for the given request.
+
+    Args:
+        msg(list): decoded request frame
+        status(str): reply status
+        response(dict): reply response, empty if omitted
+
+    Returns:
+        str: phx_reply frame
+    """
+    return json.dumps([msg[0], msg[1], msg[2], "phx_reply",
+                       {"status": status, "response": response or {}}])
+
+class Simulation:
+    """
+    A class holds the parameters of the simulated rooms.
+
+    Every room starts with `users` participants and changes `churn` times per
+    second: a participant joins (in the lobby with probability lobby_ratio),
+    moves from the lobby to the room, or leaves, so that the population stays
+    around `users`. Rooms also carry `naf_rate` NAF frames per second.
+
+    Like a throttled reticulum, at most `join_rate` hub joins per second are
+    accepted over all clients, in bursts of as many; the others are rejected.
+    """
+
+    def __init__(self, churn: float = 1.0, users: int = 0, lobby_ratio: float = 0.5,
+                 naf_rate: float = 0.0, join_rate: float = 0.0) -> None:
+        self.churn = churn
+        self.users = users
+        self.lobby_ratio = lobby_ratio
+        self.naf_rate = naf_rate
+        self.join_rate = join_rate
+        self.join_tokens = join_rate
+        self.join_time = time.monotonic()
+        self.rejected_joins = 0
+        self.rooms = {}  # type: Dict[str, SimulatedRoom]
+
+    def admit_join(self) -> bool:
+        """
+        Returns False if a hub join exceeds join_rate and is to be rejected.
+        """
+        if self.join_rate <= 0:
+            return True
+        now = time.monotonic()
+        self.join_tokens = min(self.join_rate,
+                               self.join_tokens + (now - self.join_time) * self.join_rate)
+        self.join_time = now
+        if self.join_tokens < 1:
+            self.rejected_joins += 1
+            return False
+        self.join_tokens -= 1
+        return True
+
+    def subscribe(self, topic: str, websocket) -> "SimulatedRoom":
+        """
+        Returns the room of a topic, started on its first subscriber.
+        """
+        room = self.rooms.get(topic)
+        if room is None:
+            room = self.rooms[topic] = SimulatedRoom(self, topic)
+        room.clients.add(websocket)
+        return room
+
+    def unsubscribe(self, room: "SimulatedRoom", websocket) -> None:
+        """
+        Removes a subscriber, and the room after its last one.
+        """
+        room.clients.discard(websocket)
+        if not room.clients:
+            room.task.cancel()
+            del self.rooms[room.topic]
+
+class SimulatedRoom:
+    """
+    A class represents the participants of a simulated hub and pushes their
+    presence_diff to the subscribed clients.
+    """
+
+    def __init__(self, simulation: Simulation, topic: str) -> None:
+        self.simulation = simulation
+        self.topic = topic
+        # presence key -> meta, one session per participant
+        self.presences = {}  # type: Dict[str, dict]
+        self.clients = set()  # type: Set[object]
+        self.num_users = 0
+        for _ in range(simulation.users):
+            self.__join('lobby' if random.random() < simulation.lobby_ratio else 'room')
+        self.task = asyncio.ensure_future(self.run())
+
+    def get_state(self) -> dict:
+        """
+        Returns the payload of presence_state, stamped with the current time.
+        """
+        now = time.time()
+        return {key: {"metas": [dict(meta, sent_at=now)]} for key, meta in self.presences.items()}
+
+    def step(self) -> dict:
+        """
+        Applies one change and returns its presence_diff payload.
+        """
+        target = self.simulation.users
+        count = len(self.presences)
+        if count == 0:
+            join_ratio = 1.0
+        elif target == 0:
+            join_ratio = 0.0
+        else:
+            join_ratio = max(0.0, 1 - count / (2 * target))
+
+        if random.random() < join_ratio:
+            place = 'lobby' if random.random() < self.simulation.lobby_ratio else 'room'
+            key = self.__join(place)
+            return {"joins": {key: {"metas": [self.presences[key]]}}, "leaves": {}}
+
+        key = random.choice(list(self.presences))
+        meta = self.presences[key]
+        leaves = {key: {"metas": [dict(meta, sent_at=time.time())]}}
+        if meta['presence'] == 'lobby' and random.random() < 0.5:
+            # Entering the room is a join of a new session and a leave of the lobby one.
+            moved = make_meta(meta['profile']['displayName'], 'room')
+            moved['context'] = meta['context']
+            self.presences[key] = moved
+            return {"joins": {key: {"metas": [moved]}}, "leaves": leaves}
+        del self.presences[key]
+        return {"joins": {}, "leaves": leaves}
+
+    async def run(self) -> None:
+        """
+        Push presence_diff and NAF frames to the subscribers until cancelled.
+        """
+        # Changes due every tick are sent together, at most every TICK seconds.
+        rate = self.simulation.churn + self.simulation.naf_rate
+        if rate <= 0:
+            return
+        tick = max(1 / rate, TICK)
+        changes = 0.0
+        nafs = 0.0
+        while True:
+            await asyncio.sleep(tick)
+            changes += self.simulation.churn * tick
+            nafs += self.simulation.naf_rate * tick
+            frames = []
+            while changes >= 1:
+                changes -= 1
+                frames.append(json.dumps([None, None, self.topic, "presence_diff", self.step()]))
+            while nafs >= 1:
+                nafs -= 1
+                frames.append(make_naf(self.topic))
+            for websocket in list(self.clients):
+                try:
+                    for frame in frames:
+                        await websocket.send(frame)
+                except ConnectionClosed:
+                    pass
+
+    def __join(self, place: str) -> str:
+        self.num_users += 1
+        key = str(uuid.uuid4())
+        self.presences[key] = make_meta(f"Standin-User-{self.num_users}", place)
+        return key
+
+async def handle_client(websocket, path: str = None, simulation: Simulation = None) -> None:
+    """
+    Serve one client connection.
+
+    Args:
+        websocket: client connection
+        path: request path (unused, for websockets < 10.1)
+        simulation: simulated rooms shared by all connections
+    """
+    if simulation is None:
+        simulation = Simulation()
+    rooms = []
+    try:
+        async for message in websocket:
+            msg = json.loads(message)
+            event = msg[3]
+            if event == "phx_join" and msg[2].startswith("hub:") and not simulation.admit_join():
+                await websocket.send(reply(msg, "error", {"reason": "too many joins"}))
+                continue
+            if event in ("phx_join", "phx_leave", "heartbeat", "message"):
+                await websocket.send(reply(msg))
+            if event == "phx_join" and msg[2].startswith("hub:"):
+                room = simulation.subscribe(msg[2], websocket)
+                rooms.append(room)
+                await websocket.send(json.dumps(
+                    [msg[0], None, msg[2], "presence_state", room.get_state()]))
+            elif event == "phx_leave":
+                for room in [room for room in rooms if room.topic == msg[2]]:
+                    rooms.remove(room)
+                    simulation.unsubscribe(room, websocket)
+    except ConnectionClosed:
+        pass
+    finally:
+        for room in rooms:
+            simulation.unsubscribe(room, websocket)
+
+async def serve(host: str, port: int, simulation: Simulation) -> None:
+    """
+    Run the stand-in server until cancelled.
+
+    Args:
+        host(str): address to listen on
+        port(int): port to listen on
+        simulation: simulated rooms
+    """
+    async def handler(websocket, path=None):
+        await handle_client(websocket, path, simulation)
+
+    async with websockets.serve(handler, host, port, max_queue=None):
+        await asyncio.Future()
+
+def run_server(host: str, port: int, churn: float = 1.0, users: int = 0,
+               lobby_ratio: float = 0.5, naf_rate: float = 0.0, join_rate: float = 0.0) -> None:
+    """
+    Entry point usable as a multiprocessing target.
+
+    Args:
+        host(str): address to listen on
+        port(int): port to listen on
+        churn(float): presence changes per second per room
+        users(int): participants per room
+        lobby_ratio(float): share of participants joining in the lobby
+        naf_rate(float): NAF frames per second per room
+        join_rate(float): hub joins accepted per second, unlimited if 0
+    """
+    try:
+        asyncio.run(serve(host, port, Simulation(churn, users, lobby_ratio, naf_rate, join_rate)))
+    except KeyboardInterrupt:
+        pass
+
+def run_standin(host: str, port: int, http_port: int, **simulation) -> None:
+    """
+    Serve room pages and the WebSocket endpoint. Usable as a multiprocessing target.
+
+    Args:
+        host(str): address to listen on
+        port(int): WebSocket port, also the ret:phx_host of the room pages
+        http_port(int): port serving room pages
+        simulation: keyword arguments of run_server
+    """
+    threading.Thread(target=run_http_server, args=(host, http_port, f"{host}:{port}"),
+                     daemon=True).start()
+    run_server(host, port, **simulation)
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+    parser = argparse.ArgumentParser(description="A local stand-in for a reticulum server.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=4000, help="port to listen on")
+    parser.add_argument("--churn", type=float, default=1.0,
+                        help="presence changes per second per room")
+    parser.add_argument("--users", type=int, default=0,
+                        help="participants per room, sent in presence_state on join")
+    parser.add_argument("--lobby-ratio", type=float, default=0.5,
+                        help="share of participants joining in the lobby")
+    parser.add_argument("--naf-rate", type=float, default=0.0,
+                        help="NAF frames per second per room")
+    parser.add_argument("--join-rate", type=float, default=0.0,
+                        help="hub joins accepted per second, the others rejected; 0 for no limit")
+    parser.add_argument("--http-port", type=int, default=8080,
+                        help="port serving room pages, e.g. http://127.0.0.1:8080/<hub_id>/<slug>")
+    args = parser.parse_args()
+    run_standin(args.host, args.port, args.http_port, churn=args.churn, users=args.users,
+                lobby_ratio=args.lobby_ratio, naf_rate=args.naf_rate, join_rate=args.join_rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+""" Coalescing of the leaves and joins of a presence key into single move or rejoin events """
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+from roster import Session
+
+# Default seconds a leave waits for a join of the same presence key.
+COALESCE_WINDOW = 5.0
+
+class Coalescer:
+    """
+    A class pairs a leave and a join of a presence key in the same hub within
+    `window` seconds, in either order, and reports the pair as one event:
+
+    * 'moves' when the join is in the other place, e.g. entering the room
+      from the lobby, which phoenix sends as a leave and a join in one diff
+    * 'rejoin' when the join is in the same place, e.g. a client reconnecting
+      or updating its presence, whose new session may join before the old one
+      is seen to leave
+
+    Leaves and joins are held until paired, and reported as 'leaves' or 'joins'
+    with the time they were received once the window has passed. A join is not
+    paired with the leave of its own session, e.g. of a short visit.
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW) -> None:
+        """
+        Args:
+            window(float): seconds a leave or a join waits for the other of the same presence key
+        """
+        self.window = window
+        # (hub_id, phx_ref) -> (hub_id, time received, session, 'leaves' or 'joins'), oldest first
+        self.pending = OrderedDict()  # type: OrderedDict
+        # (hub_id, presence key) -> held leaves and joins of the key, oldest first
+        self.keys = {}  # type: Dict[Tuple[str, str], Deque[Tuple[str, str]]]
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def coalesce(self, hub_id: str, joins: Sequence[Session], leaves: Sequence[Session],
+                 now: float) -> List[Tuple[Session, str, float]]:
+        """
+        Pairs the joins and leaves with each other and with those held, holds
+        the others, and returns the events of the pairs.
+
+        Args:
+            hub_id(str): hub_id
+            joins: sessions joined, e.g. of a presence_diff
+            leaves: sessions left, paired first with the joins of the same call
+            now(float): time.time() the sessions were received
+
+        Returns:
+            list: joined session, event type, 'moves' or 'rejoin', and time of each pair,
+                and of each join released by the leave of its own session as 'joins'
+        """
+        events = []
+        held = []
+        for session in leaves:
+            pending_ref = (hub_id, session.phx_ref)
+            if pending_ref in self.pending:
+                if self.pending[pending_ref][3] == 'leaves':
+                    continue
+                # Left within the window after joining: no pair for either.
+                _, joined_at, joined = self.__pop(pending_ref)
+                events.append((joined, 'joins', joined_at))
+            held.append(session)
+
+        # A leave followed by a join, e.g. in one diff.
+        joined_later = []
+        for session in joins:
+            pending_ref = (hub_id, session.phx_ref)
+            if pending_ref in self.pending:
+                if self.pending[pending_ref][3] == 'joins':
+                    continue
+                _, left_at, left = self.__pop(pending_ref)
+                events.append((left, 'leaves', left_at))
+            left = next((left for left in held
+                         if left.key == session.key and left.phx_ref != session.phx_ref), None)
+            if left is not None:
+                held.remove(left)
+                events.append((session, get_pair_event(left, session), now))
+                continue
+            pending_ref = self.__find(hub_id, session, 'leaves')
+            if pending_ref is not None:
+                _, _, left = self.__pop(pending_ref)
+                events.append((session, get_pair_event(left, session), now))
+                continue
+            joined_later.append(session)
+
+        # A join followed by a leave.
+        for session in held:
+            pending_ref = self.__find(hub_id, session, 'joins')
+            if pending_ref is not None:
+                _, joined_at, joined = self.__pop(pending_ref)
+                events.append((joined, get_pair_event(session, joined), joined_at))
+            else:
+                self.__hold(hub_id, session, 'leaves', now)
+        for session in joined_later:
+            self.__hold(hub_id, session, 'joins', now)
+        return events
+
+    def expire(self, now: float, hub_id: str = None) -> List[Tuple[str, float, Session, str]]:
+        """
+        Releases the leaves and joins not paired within the window.
+
+        Args:
+            now(float): current time.time(), or infinity to release all of them
+            hub_id(str): hub_id to release all of a hub at once, None for every hub
+
+        Returns:
+            list: hub_id, time received, session and event type, 'leaves' or 'joins',
+                of each one, oldest first
+        """
+        if hub_id is not None:
+            refs = [pending_ref for pending_ref in self.pending if pending_ref[0] == hub_id]
+        else:
+            refs = []
+            for pending_ref, (_, received_at, _, _) in self.pending.items():
+                if received_at > now - self.window:
+                    break
+                refs.append(pending_ref)
+
+        released = []
+        for pending_ref in refs:
+            event_type = self.pending[pending_ref][3]
+            released.append((pending_ref[0],) + self.__pop(pending_ref)[1:] + (event_type,))
+        return released
+
+    def __hold(self, hub_id: str, session: Session, event_type: str, now: float) -> None:
+        pending_ref = (hub_id, session.phx_ref)
+        self.pending[pending_ref] = (hub_id, now, session, event_type)
+        self.keys.setdefault((hub_id, session.key), deque()).append(pending_ref)
+
+    def __find(self, hub_id: str, session: Session, event_type: str) -> Optional[Tuple[str, str]]:
+        # Oldest held event of the type for the key of session, of another session.
+        for pending_ref in self.keys.get((hub_id, session.key), ()):
+            if self.pending[pending_ref][3] == event_type and pending_ref[1] != session.phx_ref:
+                return pending_ref
+        return None
+
+    def __pop(self, pending_ref: Tuple[str, str]) -> Tuple[str, float, Session]:
+        hub_id, received_at, session, _ = self.pending.pop(pending_ref)
+        key_refs = self.keys[(hub_id, session.key)]
+        key_refs.remove(pending_ref)
+        if not key_refs:
+            del self.keys[(hub_id, session.key)]
+        return hub_id, received_at, session
+
+def get_pair_event(left: Session, joined: Session) -> str:
+    """
+    Returns the event type of a leave and a join of the same presence key.
+
+    Args:
+        left(Session): session left
+        joined(Session): session joined
+
+    Returns:
+        str: 'rejoin' if both are in the same place, 'moves' otherwise
+    """
+    return 'rejoin' if left.presence == joined.presence else 'moves'
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+""" Phoenix WebSocket connections to reticulum servers, shared by hubsmon and hubsmsg """
+import asyncio
+import json
+import random
+import signal
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import websockets
+from websockets.exceptions import ConnectionClosed, WebSocketException
+from admission import Admission, Ticket
+from phoenix import classify, loads
+from recorder import FrameRecorder
+from room import Room
+import profiling
+
+CLOSE_CODES = {
+    1000: "OK",
+    1001: "going away",
+    1002: "protocol error",
+    1003: "unsupported type",
+    # 1004 is reserved
+    1005: "no status code [internal]",
+    1006: "connection closed abnormally [internal]",
+    1007: "invalid data",
+    1008: "policy violation",
+    1009: "message too big",
+    1010: "extension required",
+    1011: "unexpected error",
+    1015: "TLS failure [internal]",
+}
+
+RETICULUM_IO_URL = "wss://{host}/socket/websocket?vsn=2.0.0"
+
+# Reconnect delays in seconds: exponential from BACKOFF_BASE up to BACKOFF_MAX,
+# restarting from BACKOFF_BASE once a connection lasted BACKOFF_RESET.
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+BACKOFF_RESET = 60.0
+
+# Heartbeats are sent every HEARTBEAT_INTERVAL seconds on each connection,
+# which is considered dead after HEARTBEAT_MAX_MISSED unanswered heartbeats.
+HEARTBEAT_TEMPLATE = '[null, "{ref}", "phoenix", "heartbeat", {{}}]'
+HEARTBEAT_INTERVAL = 30.0
+HEARTBEAT_MAX_MISSED = 2
+
+# A rejected phx_join is sent again with backoff, at most JOIN_RETRIES times per connection.
+JOIN_RETRIES = 5
+
+def request_stop(stop: "asyncio.Future[None]") -> None:
+    """
+    Ask every client running on the event loop to finish.
+
+    Args:
+        stop: stop condition shared by all clients
+    """
+    if not stop.done():
+        stop.set_result(None)
+
+def install_signal_handlers(loop: asyncio.AbstractEventLoop,
+                            stop: "asyncio.Future[None]"
+                           ) -> None:
+    """
+    Resolve the stop condition when receiving SIGINT or SIGTERM.
+
+    Args:
+        loop: event loop
+        stop: stop condition
+    """
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, request_stop, stop)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on this platform (e.g. Windows) or not running
+            # in the main thread. ^C still ends asyncio.run() in main().
+            pass
+
+def format_close(code: int, reason: str) -> str:
+    """
+    Display a human-readable version of the close code and reason.
+
+    Args:
+        code: close code
+        reason: reason text
+    """
+    if code is None:
+        return "no close frame"
+    if 3000 <= code < 4000:
+        explanation = "registered"
+    elif 4000 <= code < 5000:
+        explanation = "private use"
+    else:
+        explanation = CLOSE_CODES.get(code, "unknown")
+    result = f"code = {code} ({explanation}), "
+
+    if reason:
+        result += f"reason = {reason}"
+    else:
+        result += "no reason"
+
+    return result
+
+def group_rooms(hubs_rooms: List[Room], multiplex: bool) -> List[List[Room]]:
+    """
+    Returns the rooms to be served by each connection.
+
+    Args:
+        hubs_rooms: rooms to be connected
+        multiplex: share one connection among rooms on the same reticulum server
+
+    Returns:
+        list: a list of rooms per connection
+    """
+    if not multiplex:
+        return [[hubs_room] for hubs_room in hubs_rooms]
+
+    groups = OrderedDict()  # type: Dict[str, List[Room]]
+    for hubs_room in hubs_rooms:
+        groups.setdefault(hubs_room.get_reticulum_server(), []).append(hubs_room)
+    return list(groups.values())
+
+class ConnectionStats:
+    """
+    A class represents the state and heartbeat round-trip times of a
+    connection, shared by the rooms it serves.
+    """
+    __slots__ = ('state', 'connects', 'rtt_count', 'rtt_last', 'rtt_min', 'rtt_max', 'rtt_total',
+                 'missed')
+
+    def __init__(self) -> None:
+        # 'connecting', 'connected', 'reconnecting' or 'closed'
+        self.state = 'connecting'
+        # successful connections, the first one included
+        self.connects = 0
+        self.rtt_count = 0
+        self.rtt_last = None  # type: Optional[float]
+        self.rtt_min = None  # type: Optional[float]
+        self.rtt_max = None  # type: Optional[float]
+        self.rtt_total = 0.0
+        # heartbeats left unanswered
+        self.missed = 0
+
+    def record_rtt(self, rtt: float) -> None:
+        """
+        Records the round-trip time of an answered heartbeat.
+
+        Args:
+            rtt(float): seconds between the heartbeat and its phx_reply
+        """
+        self.rtt_count += 1
+        self.rtt_last = rtt
+        self.rtt_total += rtt
+        if self.rtt_min is None or rtt < self.rtt_min:
+            self.rtt_min = rtt
+        if self.rtt_max is None or rtt > self.rtt_max:
+            self.rtt_max = rtt
+
+    def get_rtt(self) -> Dict[str, Optional[float]]:
+        """
+        Returns heartbeat round-trip time statistics in seconds.
+
+        Returns:
+            dict: last, min, average and max round-trip time,
+                number of answered and missed heartbeats
+        """
+        return {
+            'last': self.rtt_last,
+            'min': self.rtt_min,
+            'avg': self.rtt_total / self.rtt_count if self.rtt_count else None,
+            'max': self.rtt_max,
+            'count': self.rtt_count,
+            'missed': self.missed,
+        }
+
+    def format_rtt(self) -> str:
+        """
+        Returns a human-readable summary of the round-trip times.
+        """
+        if not self.rtt_count:
+            return f"no heartbeat reply, {self.missed} missed"
+        rtt = self.get_rtt()
+        return (f"min/avg/max = {rtt['min'] * 1000:.1f}/{rtt['avg'] * 1000:.1f}/"
+                f"{rtt['max'] * 1000:.1f} ms, {rtt['count']} replies, {rtt['missed']} missed")
+
+def get_backoff_delay(attempt: int) -> float:
+    """
+    Returns the delay before a reconnect: exponential backoff with full jitter.
+
+    Args:
+        attempt(int): number of consecutive failed attempts, starting from 1
+
+    Returns:
+        float: seconds to wait
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+async def run_client(hubs_rooms: List[Room],
+                     inputs: "asyncio.Queue[str]",
+                     stop: "asyncio.Future[None]",
+                     process_message: Callable[..., bool],
+                     on_connect_failure: Callable[[List[Room]], None] = None,
+                     joins: List[str] = (),
+                     stats: ConnectionStats = None,
+                     recorder: FrameRecorder = None,
+                     routes: Dict[str, str] = None,
+                     admission: Admission = None,
+                     priority: int = 0,
+                     on_join_failure: Callable[[str], None] = None,
+                     ) -> None:
+    """
+    WebSocket client task serving one or more rooms on the same reticulum server.
+
+    The connection is re-established with exponential backoff whenever it
+    drops, misses heartbeat replies or cannot be made, and joins are sent
+    again on every connection. Rooms can be added or removed while it runs
+    by changing hubs_rooms, joins and routes in place.
+    With admission, every connection waits for its turn, reconnects first,
+    and holds its slot until its rooms received their first presence_state.
+    Incoming frames are routed to the room of their "hub:<hub_id>" topic.
+    Frames of other topics ("ret", "phoenix") are processed with hub_id None.
+    A room whose joins are rejected for good is removed from hubs_rooms, and
+    the connection ends once no room is left.
+
+    Args:
+        hubs_rooms: rooms sharing this connection
+        inputs: queue for outgoing messages, task_done() is called once each is sent
+        stop: stop condition
+        process_message: handler of an incoming message, called with its hub_id, the
+            message, its topic and event, and the decoded frame of a phx_reply, else None.
+            Returns False to close.
+        on_connect_failure: called with hubs_rooms when the server cannot be reached
+        joins: phx_join messages sent first on every connection
+        stats: state and heartbeat round-trip times of this connection
+        recorder: recording of every received frame, disabled if None
+        routes: hub_id of each "hub:<hub_id>" topic, built from hubs_rooms if omitted
+        admission: scheduler of the connections, connect right away if None
+        priority: order of admission among first connections, lower first
+        on_join_failure: called with the hub_id of a room given up after its joins were
+            rejected JOIN_RETRIES more times
+    """
+    if stats is None:
+        stats = ConnectionStats()
+    reticulum_io_url = RETICULUM_IO_URL.format(host=hubs_rooms[0].get_reticulum_server())
+    attempt = 0
+    while not stop.done():
+        if attempt > 0:
+            delay = get_backoff_delay(attempt)
+            stats.state = 'reconnecting'
+            print(f"Reconnecting to {reticulum_io_url} in {delay:.1f} seconds.")
+            await asyncio.wait([stop], timeout=delay)
+            if stop.done():
+                break
+
+        ticket = None
+        if admission is not None:
+            ticket = await admission.acquire(
+                [hubs_room.get_hub_id() for hubs_room in hubs_rooms], (attempt == 0, priority),
+                stop)
+            if ticket is None:
+                break
+
+        try:
+            websocket = await websockets.connect(reticulum_io_url)
+        except (OSError, WebSocketException) as ex:
+            print(f"Failed to connect to {reticulum_io_url}: {ex}.")
+            if ticket is not None:
+                ticket.release()
+            if on_connect_failure is not None:
+                on_connect_failure(hubs_rooms)
+            attempt += 1
+            continue
+        else:
+            stats.state = 'connected'
+            stats.connects += 1
+            print(f"Connected to {reticulum_io_url}.")
+
+        connected_at = time.monotonic()
+        try:
+            for message in joins:
+                await websocket.send(message)
+            rejected = await communicate(websocket, hubs_rooms, inputs, stop, process_message,
+                                         stats, recorder, routes, joins, ticket, on_join_failure)
+        except ConnectionClosed:
+            rejected = False
+        finally:
+            if ticket is not None:
+                ticket.release()
+            stats.state = 'closed'
+            await websocket.close()
+            close_status = format_close(websocket.close_code, websocket.close_reason)
+            print(f"Connection closed: {close_status}.")
+            print(f"Heartbeat RTT to {reticulum_io_url}: {stats.format_rtt()}.")
+
+        if rejected:
+            # The server refused a request of ours: retrying would not help.
+            break
+        # A connection that stayed up for a while starts a new backoff sequence.
+        if time.monotonic() - connected_at >= BACKOFF_RESET:
+            attempt = 0
+        attempt += 1
+
+async def communicate(websocket,
+                      hubs_rooms: List[Room],
+                      inputs: "asyncio.Queue[str]",
+                      stop: "asyncio.Future[None]",
+                      process_message: Callable[..., bool],
+                      stats: ConnectionStats,
+                      recorder: FrameRecorder = None,
+                      routes: Dict[str, str] = None,
+                      joins: List[str] = (),
+                      ticket: Ticket = None,
+                      on_join_failure: Callable[[str], None] = None,
+                      ) -> bool:
+    """
+    Exchanges messages on an established connection until it closes or stop.
+
+    A heartbeat with a unique ref is sent every HEARTBEAT_INTERVAL seconds,
+    starting at a random offset so that connections do not send them all at
+    once. Its phx_reply gives the round-trip time; after HEARTBEAT_MAX_MISSED
+    heartbeats without reply the connection is given up.
+
+    A phx_join rejected by the server, e.g. when throttled, is sent again
+    after a backoff delay instead of closing the connection. Once one has
+    been rejected JOIN_RETRIES more times, its room is given up: its join,
+    route and room are dropped, and the other rooms of the connection go on.
+    The connection is closed once it has no room left.
+
+    Args:
+        websocket: established connection
+        hubs_rooms: rooms sharing this connection
+        inputs: queue for outgoing messages
+        stop: stop condition
+        process_message: handler of an incoming message, returns False to close
+        stats: heartbeat round-trip times of this connection
+        recorder: recording of every received frame, disabled if None
+        routes: hub_id of each "hub:<hub_id>" topic, built from hubs_rooms if omitted
+        joins: phx_join messages sent on this connection, sent again when rejected
+        ticket: admission slot, released once every room received its presence_state or
+            was given up
+        on_join_failure: called with the hub_id of a room given up
+
+    Returns:
+        bool: True if process_message asked to close the connection, or no room is left
+    """
+    loop = asyncio.get_event_loop()
+    single_hub_id = None
+    hub_ids = routes
+    if routes is None:
+        hub_ids = {'hub:' + hubs_room.get_hub_id(): hubs_room.get_hub_id()
+                   for hubs_room in hubs_rooms}
+        if len(hubs_rooms) == 1:
+            single_hub_id = hubs_rooms[0].get_hub_id()
+
+    next_heartbeat = loop.time() + random.uniform(0, HEARTBEAT_INTERVAL)
+    heartbeat_ref = None
+    heartbeat_sent_at = 0.0
+    heartbeat_count = 0
+    missed = 0
+    # join_ref -> rejections of a phx_join on this connection
+    join_rejections = {}  # type: Dict[str, int]
+    # join_ref -> loop.time() to send a rejected phx_join again, and the message
+    join_retries = {}  # type: Dict[str, Tuple[float, str]]
+    # Set when the connection is to be closed after the current frame.
+    closing = False
+    while True:
+        wake_at = next_heartbeat
+        if join_retries:
+            wake_at = min(wake_at, min(due for due, _ in join_retries.values()))
+        incoming = asyncio.ensure_future(websocket.recv())
+        outgoing = asyncio.ensure_future(inputs.get())
+        done, pending = await asyncio.wait(
+            [incoming, outgoing, stop], timeout=max(0.0, wake_at - loop.time()),
+            return_when=asyncio.FIRST_COMPLETED
+        )
+
+        # Cancel pending tasks to avoid leaking them.
+        if incoming in pending:
+            incoming.cancel()
+        if outgoing in pending:
+            outgoing.cancel()
+
+        if incoming in done:
+            try:
+                message = incoming.result()
+            except ConnectionClosed:
+                if outgoing in done:
+                    give_back(inputs, outgoing.result())
+                return False
+            else:
+                timer = profiling.stage_timer
+                if timer is not None:
+                    received_at = time.perf_counter()
+                topic, event = classify(message)
+                if single_hub_id is not None:
+                    hub_id = single_hub_id
+                else:
+                    hub_id = hub_ids.get(topic)
+                if recorder is not None:
+                    recorder.record(hub_id, message)
+                handled = False
+                reply = None
+                if event == 'phx_reply':
+                    reply = loads(message)
+                    if heartbeat_ref is not None and topic == 'phoenix' and \
+                            reply[1] == heartbeat_ref:
+                        stats.record_rtt(loop.time() - heartbeat_sent_at)
+                        heartbeat_ref = None
+                        missed = 0
+                        handled = True
+                    elif reply[0] is not None and reply[1] == reply[0] and \
+                            reply[4].get('status') == 'error':
+                        # Replies to a phx_join carry its join_ref as ref. The admission
+                        # slot is kept while the join is retried.
+                        rejections = join_rejections.get(reply[0], 0) + 1
+                        join_rejections[reply[0]] = rejections
+                        join = get_join(joins, reply[0])
+                        if join is None:
+                            # Given up or left meanwhile.
+                            if ticket is not None and hub_id is not None:
+                                ticket.done(hub_id)
+                            handled = True
+                        elif rejections <= JOIN_RETRIES:
+                            delay = get_backoff_delay(rejections)
+                            print(f"Join of {topic} rejected: {json.dumps(reply[4])}, "
+                                  f"retrying in {delay:.1f} seconds.")
+                            join_retries[reply[0]] = (loop.time() + delay, join)
+                            handled = True
+                        elif topic in hub_ids:
+                            # Only this room is given up, not the connection shared by others.
+                            print(f"Join of {topic} rejected {rejections} times: "
+                                  f"{json.dumps(reply[4])}, giving up the room.")
+                            joins.remove(join)
+                            del hub_ids[topic]
+                            hubs_rooms[:] = [hubs_room for hubs_room in hubs_rooms
+                                             if hubs_room.get_hub_id() != hub_id]
+                            single_hub_id = None
+                            if ticket is not None:
+                                ticket.done(hub_id)
+                            if on_join_failure is not None:
+                                on_join_failure(hub_id)
+                            closing = not hub_ids
+                            handled = True
+                elif event == 'presence_state' and ticket is not None and hub_id is not None:
+                    ticket.done(hub_id)
+                if not handled:
+                    if timer is not None:
+                        timer.observe('recv', time.perf_counter() - received_at)
+                    retval = process_message(hub_id, message, (topic, event), reply)
+                    if retval is False:
+                        closing = True
+
+        if outgoing in done and closing:
+            # Taken but not sent: put back, as when the connection is closed by the server.
+            give_back(inputs, outgoing.result())
+        elif outgoing in done:
+            message = outgoing.result()
+            try:
+                await websocket.send(message)
+            except ConnectionClosed:
+                give_back(inputs, message)
+                raise
+            inputs.task_done()
+
+        if closing:
+            return True
+        if stop in done:
+            return False
+
+        for join_ref, (due, join) in list(join_retries.items()):
+            if loop.time() >= due:
+                del join_retries[join_ref]
+                await websocket.send(join)
+
+        if loop.time() >= next_heartbeat:
+            if heartbeat_ref is not None:
+                missed += 1
+                stats.missed += 1
+                if missed >= HEARTBEAT_MAX_MISSED:
+                    print(f"No reply to {missed} heartbeats from {websocket.remote_address}.")
+                    return False
+            heartbeat_count += 1
+            heartbeat_ref = f"hb{heartbeat_count}"
+            heartbeat_sent_at = loop.time()
+            await websocket.send(HEARTBEAT_TEMPLATE.format(ref=heartbeat_ref))
+            next_heartbeat = loop.time() + HEARTBEAT_INTERVAL
+
+def give_back(inputs: "asyncio.Queue[str]", message: str) -> None:
+    """
+    Puts back a message taken from inputs but not sent, to be sent on the next connection.
+    An Outbox keeps it as the message to send first.
+
+    Args:
+        inputs: queue for outgoing messages
+        message(str): message returned by inputs.get()
+    """
+    inputs.put_nowait(message)
+    # The message taken is done, the one put back is not: join() keeps waiting for it.
+    inputs.task_done()
+
+def get_join(joins: List[str], join_ref: str) -> Optional[str]:
+    """
+    Returns the phx_join message of a channel.
+
+    Args:
+        joins: phx_join messages sent on the connection
+        join_ref(str): join reference of the channel
+
+    Returns:
+        str: the message, None if the channel is no longer joined
+    """
+    for join in joins:
+        if loads(join)[0] == join_ref:
+            return join
+    return None
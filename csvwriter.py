@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+""" Buffered CSV writer doing the disk I/O of presence events off the event loop """
+import csv
+import gzip
+import io
+import os
+import queue
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+# Default thresholds of a flush to disk.
+FLUSH_ROWS = 500
+FLUSH_INTERVAL = 1.0
+# Default number of rows waiting for the writer thread before write() blocks.
+MAX_PENDING_ROWS = 100000
+
+# Closed segments of <name>.csv are <name>.<first timestamp>.csv, or .csv.gz when compressed.
+SEGMENT_PATTERN = re.compile(r'\.\d{8}-\d{6}(-\d+)?\.csv(\.gz)?$')
+# A rotated <name>.csv waits as <name>.csv.<number>.pending until it is closed as a segment.
+PENDING_PATTERN = re.compile(r'^(?P<name>.+)\.csv\.(?P<number>\d+)\.pending$')
+# Start of a row, as opposed to a header line.
+TIMESTAMP_PATTERN = re.compile(r'"?\d{4}-\d{2}-\d{2} ')
+# Sidecar index of the closed segments of <name>.csv, one row per chunk of rows.
+# Rows are not always in time order, e.g. leaves logged late by coalescing, so
+# each chunk is indexed with its earliest and latest timestamps.
+INDEX_SUFFIX = '.index.csv'
+INDEX_HEADER = ['Segment', 'Earliest timestamp', 'Latest timestamp', 'Offset']
+# Rows per indexed chunk. A compressed chunk is a gzip member of its own, so
+# that reading can start at its offset.
+CHUNK_ROWS = 1000
+
+def read_header(path: str) -> str:
+    """
+    Returns the header line of a csv file, empty if it has none or does not exist.
+
+    Args:
+        path(str): csv file
+    """
+    if not os.path.exists(path):
+        return ''
+    with open(path, newline='') as csv_file:
+        line = csv_file.readline()
+    return '' if TIMESTAMP_PATTERN.match(line) else line
+
+class Segment:
+    """
+    A class represents the csv file being appended to.
+    """
+    __slots__ = ('file', 'writer', 'header', 'opened_at')
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path(str): csv file, created if missing
+        """
+        # The header line is repeated at the top of every segment.
+        self.header = read_header(path)
+        self.file = open(path, 'a', newline='')  # type: TextIO
+        self.writer = csv.writer(self.file, quoting=csv.QUOTE_ALL)
+        self.opened_at = time.monotonic()
+
+class CsvWriter:
+    """
+    A class appends rows to <hub_id>.csv files from a background thread.
+
+    Rows are handed over through a bounded queue, buffered per hub and
+    written when flush_rows rows are pending or flush_interval seconds have
+    passed. File handles stay open until close(). When the disk cannot keep
+    up, write() blocks once max_pending rows are queued, so memory stays bounded.
+    If writing fails, e.g. on a full disk, the next write() or close() raises
+    the error, and the rows queued meanwhile are dropped.
+
+    With rotation enabled, a file that reached rotate_bytes or was opened
+    rotate_interval seconds ago, checked every flush_interval even without
+    new rows, is renamed <name>.csv.<number>.pending and a new <name>.csv
+    starts with the same header. A second thread then closes it as a segment
+    named after its first timestamp, gzip compressed by default, and indexed
+    in <name>.index.csv, so that compressing does not hold up the rows of
+    other files. Files left pending by a previous run are closed first.
+    read_rows() reads a time range from the segments, the pending files and
+    the current file.
+    """
+
+    def __init__(self,
+                 flush_rows: int = FLUSH_ROWS,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 fsync: bool = False,
+                 max_pending: int = MAX_PENDING_ROWS,
+                 directory: str = '.',
+                 rotate_bytes: int = 0,
+                 rotate_interval: float = 0.0,
+                 compress: bool = True) -> None:
+        """
+        Args:
+            flush_rows(int): number of buffered rows triggering a flush
+            flush_interval(float): maximum seconds a row stays buffered
+            fsync(bool): fsync files after each flush for durability
+            max_pending(int): maximum number of rows queued for the writer thread
+            directory(str): directory of the csv files
+            rotate_bytes(int): size of a file triggering its rotation, 0 for no limit
+            rotate_interval(float): seconds after which a file is rotated, 0 for no limit
+            compress(bool): gzip rotated segments
+        """
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.rows = queue.Queue(maxsize=max_pending)  # type: queue.Queue
+        self.files = {}  # type: Dict[str, Segment]
+        # (name, pending file, header) of each rotated file to close as a segment,
+        # starting with the files left pending by a previous run.
+        self.rotated = queue.Queue()  # type: queue.Queue
+        try:
+            left = [PENDING_PATTERN.match(file_name) for file_name in os.listdir(directory)]
+        except OSError:
+            left = []
+        for match in sorted((match for match in left if match),
+                            key=lambda match: int(match.group('number'))):
+            self.rotated.put((match.group('name'), os.path.join(directory, match.group(0)), None))
+        # Error that stopped the writer or the compressor thread.
+        self.error = None  # type: Optional[BaseException]
+        self.thread = threading.Thread(target=self.__run, name='csv-writer', daemon=True)
+        self.thread.start()
+        self.compressor = threading.Thread(target=self.__compress, name='csv-compressor',
+                                           daemon=True)
+        self.compressor.start()
+
+    def write(self, hub_id: str, row: list) -> None:
+        """
+        Queues a row to be appended to <hub_id>.csv.
+
+        Args:
+            hub_id(str): hub_id
+            row(list): csv row
+
+        Raises:
+            Exception: the error that stopped the writer or the compressor thread
+        """
+        if self.error is not None:
+            raise self.error
+        self.rows.put((hub_id, row))
+
+    def close(self) -> None:
+        """
+        Writes all pending rows, closes the files and the rotated segments.
+
+        Raises:
+            Exception: the error that stopped the writer or the compressor thread
+        """
+        self.rows.put(None)
+        self.thread.join()
+        self.compressor.join()
+        if self.error is not None:
+            raise self.error
+
+    def __run(self) -> None:
+        """
+        Writer thread: writes the rows until close(), or records the error that stopped it.
+        """
+        try:
+            self.__write_rows()
+        except Exception as ex:  # pylint: disable=broad-except
+            self.error = ex
+            # Rows are still taken, and dropped, so that write() does not block for good.
+            while self.rows.get() is not None:
+                pass
+        finally:
+            for segment in self.files.values():
+                try:
+                    segment.file.close()
+                except OSError:
+                    pass
+            self.files = {}
+            self.rotated.put(None)
+
+    def __write_rows(self) -> None:
+        """
+        Buffers rows per hub and flushes them on thresholds, until close().
+        """
+        pending = {}  # type: Dict[str, List[list]]
+        num_pending = 0
+        deadline = None  # type: Optional[float]
+        # Files are checked for rotation by age every flush_interval, rows or not.
+        next_check = None  # type: Optional[float]
+        if self.rotate_interval > 0:
+            next_check = time.monotonic() + self.flush_interval
+        while True:
+            wake_at = deadline
+            if next_check is not None and (wake_at is None or next_check < wake_at):
+                wake_at = next_check
+            timeout = None if wake_at is None else max(0.0, wake_at - time.monotonic())
+            try:
+                item = self.rows.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item:
+                hub_id, row = item
+                pending.setdefault(hub_id, []).append(row)
+                num_pending += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if item is None or num_pending >= self.flush_rows or \
+                    (deadline is not None and time.monotonic() >= deadline):
+                self.__flush(pending)
+                pending = {}
+                num_pending = 0
+                deadline = None
+
+            if item is None:
+                break
+
+            if next_check is not None and time.monotonic() >= next_check:
+                now = time.monotonic()
+                for name, segment in list(self.files.items()):
+                    if now - segment.opened_at >= self.rotate_interval:
+                        self.__rotate(name)
+                next_check = now + self.flush_interval
+
+    def __flush(self, pending: Dict[str, List[list]]) -> None:
+        """
+        Appends buffered rows to their files, and rotates the files due by size.
+
+        Args:
+            pending: rows per hub_id
+        """
+        for hub_id, rows in pending.items():
+            if hub_id not in self.files:
+                self.files[hub_id] = Segment(os.path.join(self.directory, hub_id + '.csv'))
+            segment = self.files[hub_id]
+            segment.writer.writerows(rows)
+            segment.file.flush()
+            if self.fsync:
+                os.fsync(segment.file.fileno())
+            if self.rotate_bytes > 0 and segment.file.tell() >= self.rotate_bytes:
+                self.__rotate(hub_id)
+
+    def __rotate(self, name: str) -> None:
+        """
+        Renames <name>.csv to be closed as a segment by the compressor thread,
+        and starts a new file. A file without rows is kept.
+
+        Args:
+            name(str): file name without .csv
+        """
+        segment = self.files[name]
+        if segment.file.tell() <= len(segment.header.encode()):
+            segment.opened_at = time.monotonic()
+            return
+        del self.files[name]
+        segment.file.close()
+        path = os.path.join(self.directory, name + '.csv')
+        number = time.time_ns()
+        while os.path.exists(f"{path}.{number}.pending"):
+            number += 1
+        pending_path = f"{path}.{number}.pending"
+        os.replace(path, pending_path)
+        with open(path, 'w', newline='') as csv_file:
+            csv_file.write(segment.header)
+        self.files[name] = Segment(path)
+        self.rotated.put((name, pending_path, segment.header))
+
+    def __compress(self) -> None:
+        """
+        Compressor thread: closes the rotated files in turn until close(). After
+        an error, the files are left pending for the next run.
+        """
+        while True:
+            item = self.rotated.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.__close_segment(*item)
+            except Exception as ex:  # pylint: disable=broad-except
+                self.error = ex
+
+    def __close_segment(self, name: str, pending_path: str, header: Optional[str]) -> None:
+        """
+        Closes a pending file as an indexed segment, then removes it.
+
+        Args:
+            name(str): file name without .csv
+            pending_path(str): <name>.csv.<number>.pending
+            header(str): header line of the file, read from it if None
+        """
+        if header is None:
+            header = read_header(pending_path)
+        path = os.path.join(self.directory, name + '.csv')
+        entries = close_segment(pending_path, header, self.compress, path)
+        if entries:
+            index_path = os.path.join(self.directory, name + INDEX_SUFFIX)
+            is_new = not os.path.exists(index_path)
+            with open(index_path, 'a', newline='') as index_file:
+                writer = csv.writer(index_file, quoting=csv.QUOTE_ALL)
+                if is_new:
+                    writer.writerow(INDEX_HEADER)
+                writer.writerows(entries)
+        # Removed once indexed, so that read_rows() finds the rows in one or the other.
+        os.remove(pending_path)
+
+def close_segment(path: str, header: str, compress: bool, name_path: str = None) -> List[list]:
+    """
+    Copies a csv file to a segment named after its first timestamp, gzip
+    compressing it in chunks of CHUNK_ROWS rows, and returns its index
+    entries. The file is left to the caller, to be removed once indexed.
+
+    Args:
+        path(str): <name>.csv, or a rotated file
+        header(str): header line of the file, possibly empty
+        compress(bool): gzip the segment
+        name_path(str): <name>.csv the segment is named after, path if omitted
+
+    Returns:
+        list: segment file name, earliest and latest timestamps and byte offset
+            of each chunk, empty if the file had no rows
+    """
+    if name_path is None:
+        name_path = path
+    with open(path, newline='') as csv_file:
+        csv_file.read(len(header))
+        rows = (row for row in csv.reader(csv_file) if row)
+        first = next(rows, None)
+        if first is None:
+            return []
+
+        stamp = re.sub(r'\D', '', first[0])
+        root = f"{name_path[:-len('.csv')]}.{stamp[:8]}-{stamp[8:14]}"
+        suffix = '.csv.gz' if compress else '.csv'
+        segment_path = root + suffix
+        number = 1
+        while os.path.exists(segment_path):
+            number += 1
+            segment_path = f"{root}-{number}{suffix}"
+
+        entries = []
+        with open(segment_path, 'xb') as segment_file:
+            # Each chunk is an independent gzip member, or plain text.
+            def write_chunk(chunk: List[List[str]]) -> None:
+                text = io.StringIO()
+                csv.writer(text, quoting=csv.QUOTE_ALL).writerows(chunk)
+                timestamps = [row[0] for row in chunk]
+                entries.append([os.path.basename(segment_path), min(timestamps),
+                                max(timestamps), segment_file.tell()])
+                data = text.getvalue().encode()
+                segment_file.write(gzip.compress(data) if compress else data)
+
+            if header:
+                data = header.encode()
+                segment_file.write(gzip.compress(data) if compress else data)
+            chunk = [first]
+            for row in rows:
+                if len(chunk) >= CHUNK_ROWS:
+                    write_chunk(chunk)
+                    chunk = []
+                chunk.append(row)
+            write_chunk(chunk)
+    return entries
+
+def read_rows(directory: str, name: str,
+              start: str = None, end: str = None) -> Iterator[List[str]]:
+    """
+    Yields the rows of <name>.csv and of its rotated segments and pending
+    files between two timestamps, in file order. Only the segment chunks
+    overlapping the range are read, from their indexed offset to the next
+    chunk. A file closed as a segment meanwhile may have its rows repeated.
+
+    Args:
+        directory(str): directory of the csv files
+        name(str): file name without .csv, e.g. a hub_id
+        start(str): first timestamp, e.g. '2020-11-13 14:00:00', from the beginning if omitted
+        end(str): last timestamp, to the end if omitted
+
+    Returns:
+        iterator: csv rows without the header
+    """
+    def in_range(row: List[str]) -> bool:
+        return (start is None or row[0] >= start) and (end is None or row[0] <= end)
+
+    def read_file(csv_file: TextIO) -> Iterator[List[str]]:
+        for row in csv.reader(csv_file):
+            # The header, if any, is not a row.
+            if row and TIMESTAMP_PATTERN.match(row[0]) and in_range(row):
+                yield row
+
+    # Opened before reading the index: a pending file is removed only once indexed.
+    matches = [PENDING_PATTERN.match(file_name) for file_name in os.listdir(directory or '.')]
+    pending_files = []  # type: List[TextIO]
+    for match in sorted((match for match in matches if match and match.group('name') == name),
+                        key=lambda match: int(match.group('number'))):
+        try:
+            pending_files.append(open(os.path.join(directory, match.group(0)), newline=''))
+        except FileNotFoundError:
+            pass
+
+    try:
+        index_path = os.path.join(directory, name + INDEX_SUFFIX)
+        entries = []  # type: List[List[str]]
+        if os.path.exists(index_path):
+            with open(index_path, newline='') as index_file:
+                entries = list(csv.reader(index_file))[1:]
+
+        # Byte range of each chunk overlapping the range, per segment. The rows of a
+        # chunk are filtered one by one: they are not always in time order.
+        segments = {}  # type: Dict[str, List[Tuple[int, Optional[int]]]]
+        for number, (segment, earliest, latest, offset) in enumerate(entries):
+            if (start is None or latest >= start) and (end is None or earliest <= end):
+                following = entries[number + 1] if number + 1 < len(entries) else None
+                chunk_end = int(following[3]) if following and following[0] == segment else None
+                segments.setdefault(segment, []).append((int(offset), chunk_end))
+        for segment, chunks in segments.items():
+            with open(os.path.join(directory, segment), 'rb') as segment_file:
+                for offset, chunk_end in chunks:
+                    segment_file.seek(offset)
+                    data = segment_file.read(-1 if chunk_end is None else chunk_end - offset)
+                    if segment.endswith('.gz'):
+                        data = gzip.decompress(data)
+                    for row in csv.reader(io.StringIO(data.decode(), newline='')):
+                        if row and in_range(row):
+                            yield row
+
+        for pending_file in pending_files:
+            yield from read_file(pending_file)
+    finally:
+        for pending_file in pending_files:
+            pending_file.close()
+
+    path = os.path.join(directory, name + '.csv')
+    if os.path.exists(path):
+        with open(path, newline='') as csv_file:
+            yield from read_file(csv_file)
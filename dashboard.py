@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+""" Live console view of the monitored hubs rooms, redrawn at a fixed rate """
+import asyncio
+import datetime
+import sys
+import time
+from typing import Dict, List, Optional, TextIO
+from connection import ConnectionStats
+from roster import Roster
+
+# Default seconds between two redraws.
+REFRESH_INTERVAL = 1.0
+
+# Moves the cursor home and clears the screen.
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+
+COLUMNS = ('hub_id', 'state', 'room', 'lobby', 'hmd', 'mobile', 'desktop', 'events/s', 'rtt ms')
+
+class Dashboard:
+    """
+    A class renders one row per room: room and lobby counts, device split,
+    presence event rate and state of the connection.
+
+    Drawing costs one write per interval whatever the number of events, so
+    busy rooms cannot make the console a bottleneck of the event loop.
+    """
+
+    def __init__(self,
+                 hub_ids: List[str],
+                 rosters: Dict[str, Roster],
+                 connection_stats: Dict[str, ConnectionStats],
+                 event_counts: Dict[str, int],
+                 interval: float = REFRESH_INTERVAL,
+                 stream: TextIO = None) -> None:
+        """
+        Args:
+            hub_ids: rooms in display order
+            rosters: presence roster of each room, or anything with get_counts()
+            connection_stats: state of the connection serving each room
+            event_counts: number of presence events processed in each room
+            interval(float): seconds between two redraws
+            stream: output, stdout if omitted. The screen is cleared before
+                each redraw only when it is a terminal.
+        """
+        self.hub_ids = hub_ids
+        self.rosters = rosters
+        self.connection_stats = connection_stats
+        self.event_counts = event_counts
+        self.interval = interval
+        self.stream = sys.stdout if stream is None else stream
+        self.last_counts = dict(event_counts)
+        self.last_time = time.monotonic()
+
+    def render(self, now: float = None) -> str:
+        """
+        Returns the view, and starts a new event rate measurement.
+
+        Args:
+            now(float): time.monotonic(), current time if omitted
+
+        Returns:
+            str: header and one line per room
+        """
+        if now is None:
+            now = time.monotonic()
+        elapsed = max(now - self.last_time, 1e-9)
+
+        width = max([len(COLUMNS[0])] + [len(hub_id) for hub_id in self.hub_ids])
+        lines = [datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                 f"{COLUMNS[0]:<{width}} {COLUMNS[1]:<12}"
+                 + ''.join(f"{column:>9}" for column in COLUMNS[2:])]
+        totals = dict.fromkeys(COLUMNS[2:8], 0)  # type: Dict[str, float]
+        for hub_id in self.hub_ids:
+            roster = self.rosters.get(hub_id)
+            counts = roster.get_counts() if roster is not None else {}
+            num_events = self.event_counts.get(hub_id, 0)
+            rate = (num_events - self.last_counts.get(hub_id, 0)) / elapsed
+            self.last_counts[hub_id] = num_events
+
+            stats = self.connection_stats.get(hub_id)
+            state = stats.state if stats is not None else '-'
+            rtt = stats.rtt_last if stats is not None else None  # type: Optional[float]
+
+            values = [counts.get(column, 0) for column in COLUMNS[2:7]] + [rate]
+            for column, value in zip(COLUMNS[2:8], values):
+                totals[column] += value
+            lines.append(f"{hub_id:<{width}} {state:<12}"
+                         + ''.join(f"{value:>9}" for value in values[:5])
+                         + f"{rate:>9.1f}"
+                         + (f"{rtt * 1000:>9.1f}" if rtt is not None else f"{'-':>9}"))
+
+        lines.append(f"{'total':<{width}} {'':<12}"
+                     + ''.join(f"{totals[column]:>9}" for column in COLUMNS[2:7])
+                     + f"{totals['events/s']:>9.1f}")
+        self.last_time = now
+        return '\n'.join(lines) + '\n'
+
+    def draw(self) -> None:
+        """
+        Writes the view to the stream.
+        """
+        text = self.render()
+        if self.stream.isatty():
+            text = CLEAR_SCREEN + text
+        self.stream.write(text)
+        self.stream.flush()
+
+    async def run(self, stop: "asyncio.Future[None]") -> None:
+        """
+        Redraw every interval until stop, and once more at the end.
+
+        Args:
+            stop: stop condition
+        """
+        while not stop.done():
+            await asyncio.wait([stop], timeout=self.interval)
+            self.draw()
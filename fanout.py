@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+""" Rate-limited broadcast of chat lines to hubs rooms with bounded per-room queues """
+import asyncio
+import functools
+import os
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError
+from typing import List, Optional, Tuple
+from connection import request_stop
+from phoenix import CHAT_REF_PREFIX, get_chat_str
+
+# What to do with a new line for a room whose queue is full:
+# drop it, merge it into the last pending message, or wait for room in the queue.
+POLICIES = ('drop', 'coalesce', 'block')
+POLICY = 'coalesce'
+# Default number of messages waiting to be sent per room.
+QUEUE_SIZE = 100
+# Longest message, in characters, that lines are coalesced into. A line that
+# does not fit is dropped, so that a stalled room does not build an ever-growing
+# message the server would refuse anyway.
+MAX_COALESCED_LENGTH = 1000
+# Default rate limits in messages per second, and bursts in messages.
+# Reticulum disconnects clients flooding a hub channel, so rooms are kept
+# well below one message per second on average.
+ROOM_RATE = 1.0
+ROOM_BURST = 5
+GLOBAL_RATE = 50.0
+GLOBAL_BURST = 50
+# Number of lines waiting to be broadcast before reading stdin or the control socket waits.
+LINES_QUEUE_SIZE = 100
+# Bytes read from stdin at once.
+STDIN_CHUNK_SIZE = 4096
+
+class TokenBucket:
+    """
+    A class represents a token bucket rate limiter.
+
+    A token is added every 1 / rate seconds up to burst tokens, and sending a
+    message takes one. A rate of 0 or less means no limit.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def get_delay(self, now: float) -> float:
+        """
+        Returns seconds to wait until a token is available, 0 if one is.
+        """
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        """
+        Takes a token, which get_delay() reported available.
+        """
+        if self.rate > 0:
+            self.tokens -= 1
+
+class Line:
+    """
+    A class represents a stdin line broadcast to every room.
+    """
+    __slots__ = ('text', 'read_at', 'pending', 'dropped')
+
+    def __init__(self, text: str, read_at: float) -> None:
+        self.text = text
+        # time.monotonic() when the line was read
+        self.read_at = read_at
+        # number of rooms the line has not been sent to yet, plus one until it is
+        # queued to every room
+        self.pending = 1
+        # number of rooms the line was dropped for
+        self.dropped = 0
+
+class FanoutStats:
+    """
+    A class counts broadcast messages and measures fan-out latency, from
+    reading a line until its last room's websocket.send() completed.
+    """
+
+    def __init__(self) -> None:
+        self.lines = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.latencies = []  # type: List[float]
+
+    def finish(self, line: Line, now: float) -> None:
+        """
+        Records a line handled for one more room, and its latency once all are.
+        """
+        line.pending -= 1
+        if line.pending == 0:
+            self.lines += 1
+            self.latencies.append(now - line.read_at)
+
+    def format(self) -> str:
+        """
+        Returns a human-readable summary of the broadcast.
+        """
+        summary = (f"{self.lines} lines, {self.sent} messages sent, {self.dropped} dropped, "
+                   f"{self.coalesced} coalesced")
+        if not self.latencies:
+            return summary
+        latencies = sorted(self.latencies)
+        mean = sum(latencies) / len(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return (f"{summary}, fan-out latency mean/p50/p99/max = {mean * 1000:.1f}/"
+                f"{p50 * 1000:.1f}/{p99 * 1000:.1f}/{latencies[-1] * 1000:.1f} ms")
+
+class Channel:
+    """
+    A class represents the queue of chat messages to one room.
+    """
+    __slots__ = ('hub_id', 'join_ref', 'pending', 'bucket', 'space')
+
+    def __init__(self, hub_id: str, join_ref: str, bucket: TokenBucket) -> None:
+        self.hub_id = hub_id
+        self.join_ref = join_ref
+        # [text, lines] of each message waiting to be sent
+        self.pending = deque()  # type: deque
+        self.bucket = bucket
+        # set while the queue is not full
+        self.space = asyncio.Event()
+        self.space.set()
+
+class Outbox:
+    """
+    A class represents the outgoing chat messages of one connection.
+
+    It is given to run_client() as the queue of outgoing messages: get()
+    returns the next message of the rooms in turn, once both the room's and
+    the global rate limits allow it, and task_done() reports it was sent.
+    Control frames such as phx_join and phx_leave, put with put_nowait(),
+    are sent before any chat message and are not rate-limited, so that the
+    outbox can serve a connection whose rooms change while it runs.
+    """
+
+    def __init__(self,
+                 rooms: List[Tuple[str, str]],
+                 stats: FanoutStats,
+                 global_bucket: TokenBucket,
+                 policy: str = POLICY,
+                 queue_size: int = QUEUE_SIZE,
+                 room_rate: float = ROOM_RATE,
+                 room_burst: int = ROOM_BURST) -> None:
+        """
+        Args:
+            rooms: hub_id and join reference of the hub channel of each room
+            stats: statistics shared by all connections
+            global_bucket(TokenBucket): rate limit shared by all connections
+            policy(str): 'drop', 'coalesce' or 'block' when a room's queue is full
+            queue_size(int): maximum number of messages waiting per room
+            room_rate(float): messages per second per room, no limit if 0
+            room_burst(int): messages sent at once per room
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy: {policy}")
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.channels = [Channel(hub_id, join_ref, TokenBucket(room_rate, room_burst))
+                         for hub_id, join_ref in rooms]
+        self.stats = stats
+        self.global_bucket = global_bucket
+        self.policy = policy
+        self.queue_size = max(1, queue_size)
+        # chat refs are prefixed so that their replies are not taken for phx_join ones
+        self.ref = 0
+        self.turn = 0
+        self.changed = asyncio.Event()
+        # control frames waiting, and the number of them not sent yet
+        self.control = deque()  # type: deque
+        self.unfinished = 0
+        self.finished = asyncio.Event()
+        self.finished.set()
+        # message handed over by get() and not yet sent, and a message to send again;
+        # the lines of a control frame are None
+        self.sending = None  # type: Optional[Tuple[str, Optional[List[Line]]]]
+        self.retry = None  # type: Optional[Tuple[str, Optional[List[Line]]]]
+
+    def add(self, hub_id: str, join_ref: str) -> None:
+        """
+        Starts queuing the next lines to a room joined on the connection.
+
+        Args:
+            hub_id(str): hub_id
+            join_ref(str): join reference of the hub channel of the room
+        """
+        self.channels.append(Channel(hub_id, join_ref,
+                                     TokenBucket(self.room_rate, self.room_burst)))
+
+    def remove(self, hub_id: str) -> None:
+        """
+        Stops queuing lines to a room left on the connection, dropping its pending messages.
+
+        Args:
+            hub_id(str): hub_id
+        """
+        for channel in self.channels:
+            if channel.hub_id == hub_id:
+                break
+        else:
+            return
+        self.channels.remove(channel)
+        now = time.monotonic()
+        while channel.pending:
+            for line in channel.pending.popleft()[1]:
+                self.stats.dropped += 1
+                line.dropped += 1
+                self.stats.finish(line, now)
+        channel.space.set()
+
+    async def put(self, line: Line) -> None:
+        """
+        Queues a line to every room of this connection, applying the policy
+        to rooms whose queue is full. Coalescing falls back to dropping once
+        the last pending message would exceed MAX_COALESCED_LENGTH.
+        """
+        for channel in list(self.channels):
+            while len(channel.pending) >= self.queue_size and self.policy == 'block':
+                channel.space.clear()
+                await channel.space.wait()
+            if channel not in self.channels:
+                # Left while waiting for room in its queue.
+                continue
+
+            if len(channel.pending) < self.queue_size:
+                channel.pending.append([line.text, [line]])
+                line.pending += 1
+            elif self.policy == 'coalesce' and \
+                    len(channel.pending[-1][0]) + 1 + len(line.text) <= MAX_COALESCED_LENGTH:
+                entry = channel.pending[-1]
+                entry[0] += '\n' + line.text
+                entry[1].append(line)
+                line.pending += 1
+                self.stats.coalesced += 1
+            else:
+                self.stats.dropped += 1
+                line.dropped += 1
+        self.changed.set()
+
+    async def get(self) -> str:
+        """
+        Returns the next message to send, waiting for the rate limits.
+        """
+        if self.retry is not None:
+            self.sending, self.retry = self.retry, None
+            return self.sending[0]
+
+        while True:
+            if self.control:
+                self.sending = (self.control.popleft(), None)
+                return self.sending[0]
+            now = time.monotonic()
+            delay = None  # type: Optional[float]
+            for offset in range(len(self.channels)):
+                index = (self.turn + offset) % len(self.channels)
+                channel = self.channels[index]
+                if not channel.pending:
+                    continue
+                room_delay = channel.bucket.get_delay(now)
+                if room_delay > 0:
+                    delay = room_delay if delay is None else min(delay, room_delay)
+                    continue
+                global_delay = self.global_bucket.get_delay(now)
+                if global_delay > 0:
+                    delay = global_delay if delay is None else min(delay, global_delay)
+                    break
+
+                channel.bucket.consume()
+                self.global_bucket.consume()
+                self.turn = index + 1
+                text, lines = channel.pending.popleft()
+                channel.space.set()
+                self.ref += 1
+                self.sending = (get_chat_str(channel.hub_id, f"{CHAT_REF_PREFIX}{self.ref}", text,
+                                             channel.join_ref), lines)
+                return self.sending[0]
+
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def put_nowait(self, message: str) -> None:
+        """
+        Gives back the message last returned by get(), to be sent on the next
+        connection, or queues a control frame.
+        """
+        if self.sending is not None and self.sending[0] == message:
+            self.retry, self.sending = self.sending, None
+        else:
+            self.control.append(message)
+            self.unfinished += 1
+            self.finished.clear()
+        self.changed.set()
+
+    def task_done(self) -> None:
+        """
+        Reports that the message last returned by get() was sent.
+        """
+        if self.sending is None:
+            return
+        _, lines = self.sending
+        self.sending = None
+        if lines is None:
+            self.unfinished -= 1
+            if self.unfinished == 0:
+                self.finished.set()
+            return
+        now = time.monotonic()
+        self.stats.sent += 1
+        for line in lines:
+            self.stats.finish(line, now)
+
+    async def join(self) -> None:
+        """
+        Waits until every control frame was sent.
+        """
+        await self.finished.wait()
+
+    def qsize(self) -> int:
+        """
+        Returns the number of control frames and chat messages waiting.
+        """
+        return len(self.control) + sum(len(channel.pending) for channel in self.channels)
+
+def read_stdin(loop: asyncio.AbstractEventLoop,
+               lines: "asyncio.Queue[Optional[Tuple[str, float]]]"
+              ) -> None:
+    """
+    Forward stdin lines to the event loop. Runs in a daemon thread because
+    reading blocks. Reading waits while the queue of lines is full.
+
+    stdin is read with os.read() rather than input(): a daemon thread blocked
+    in sys.stdin holds its lock, and the interpreter aborts at exit.
+
+    Args:
+        loop: event loop
+        lines: queue receiving each line and the time it was read, or None on EOF
+    """
+    buffer = b''
+    try:
+        while True:
+            data = os.read(0, STDIN_CHUNK_SIZE)
+            buffer += data
+            *complete, buffer = buffer.split(b'\n')
+            if not data and buffer:
+                # Last line without a newline.
+                complete.append(buffer)
+            for line in complete:
+                text = line.decode('utf-8', 'replace').rstrip('\r')
+                asyncio.run_coroutine_threadsafe(lines.put((text, time.monotonic())),
+                                                 loop).result()
+            if not data:
+                raise EOFError
+    except (EOFError, OSError, RuntimeError, CancelledError):  # ^D, or the loop is closed
+        try:
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        except RuntimeError:
+            pass
+
+async def broadcast(outboxes: List[Outbox],
+                    lines: "asyncio.Queue[Optional[Tuple[str, float]]]",
+                    stop: "asyncio.Future[None]",
+                    stats: FanoutStats,
+                    stop_at_eof: bool = True
+                   ) -> None:
+    """
+    Send each line as a chat message to every room.
+
+    Args:
+        outboxes: outgoing messages of each connection, changed in place as connections
+            come and go
+        lines: queue of lines
+        stop: stop condition
+        stats: broadcast statistics
+        stop_at_eof: stop at the end of stdin or an empty line, else skip them
+    """
+    while not stop.done():
+        next_line = asyncio.ensure_future(lines.get())
+        await asyncio.wait([next_line, stop], return_when=asyncio.FIRST_COMPLETED)
+        if not next_line.done():
+            next_line.cancel()
+            break
+
+        item = next_line.result()
+        if not item or not item[0]:
+            if not stop_at_eof:
+                continue
+            print('bye.')
+            request_stop(stop)
+            break
+
+        line = Line(item[0], item[1])
+        for outbox in list(outboxes):
+            await outbox.put(line)
+        stats.finish(line, time.monotonic())
+
+class Broadcaster:
+    """
+    A class broadcasts the lines read from stdin, from a local control
+    socket, or both, to the rooms of every outbox it opened, with rate limits
+    shared by all of them.
+    """
+
+    def __init__(self,
+                 stdin: bool = True,
+                 control_socket: str = None,
+                 policy: str = POLICY,
+                 queue_size: int = QUEUE_SIZE,
+                 room_rate: float = ROOM_RATE,
+                 room_burst: int = ROOM_BURST,
+                 global_rate: float = GLOBAL_RATE,
+                 global_burst: int = GLOBAL_BURST) -> None:
+        """
+        Args:
+            stdin(bool): broadcast the lines of stdin
+            control_socket(str): path of a unix socket whose lines are broadcast, None for none
+            policy(str): 'drop', 'coalesce' or 'block' when a room's queue is full
+            queue_size(int): maximum number of messages waiting per room
+            room_rate(float): messages per second per room, no limit if 0
+            room_burst(int): messages sent at once per room
+            global_rate(float): messages per second to all rooms, no limit if 0
+            global_burst(int): messages sent at once to all rooms
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy: {policy}")
+        self.stdin = stdin
+        self.control_socket = control_socket
+        self.policy = policy
+        self.queue_size = queue_size
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.stats = FanoutStats()
+        self.outboxes = []  # type: List[Outbox]
+
+    def open(self, rooms: List[Tuple[str, str]]) -> Outbox:
+        """
+        Returns the outbox of a new connection, receiving the next lines.
+
+        Args:
+            rooms: hub_id and join reference of the hub channel of each room
+
+        Returns:
+            Outbox: queue of outgoing messages of the connection
+        """
+        outbox = Outbox(rooms, self.stats, self.global_bucket, self.policy, self.queue_size,
+                        self.room_rate, self.room_burst)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def close(self, outbox: Outbox) -> None:
+        """
+        Stops broadcasting to the rooms of a closed connection, if not done yet.
+        A broadcast blocked on one of its rooms goes on with the other rooms.
+        """
+        for channel in list(outbox.channels):
+            outbox.remove(channel.hub_id)
+        if outbox in self.outboxes:
+            self.outboxes.remove(outbox)
+
+    async def run(self, stop: "asyncio.Future[None]", stop_at_eof: bool = True) -> None:
+        """
+        Broadcasts the lines until stop, then prints the statistics.
+
+        Args:
+            stop: stop condition
+            stop_at_eof: stop at the end of stdin or an empty line, else skip them
+        """
+        loop = asyncio.get_event_loop()
+        lines = asyncio.Queue(maxsize=LINES_QUEUE_SIZE)
+        if self.stdin:
+            reader = threading.Thread(target=read_stdin, args=(loop, lines), daemon=True)
+            reader.start()
+        server = None
+        try:
+            if self.control_socket is not None:
+                if os.path.exists(self.control_socket) and \
+                        stat.S_ISSOCK(os.stat(self.control_socket).st_mode):
+                    # Left over by a process that did not stop cleanly.
+                    os.unlink(self.control_socket)
+                server = await asyncio.start_unix_server(
+                    functools.partial(self.__serve, lines), self.control_socket)
+                print(f"Broadcasting the lines sent to {self.control_socket}.")
+            await broadcast(self.outboxes, lines, stop, self.stats, stop_at_eof)
+        finally:
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+                os.unlink(self.control_socket)
+            print(f"Broadcast: {self.stats.format()}.")
+
+    @staticmethod
+    async def __serve(lines: "asyncio.Queue[Optional[Tuple[str, float]]]",
+                      reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        """
+        Queues each non-empty line of a control socket client until it disconnects.
+        """
+        try:
+            while True:
+                data = await reader.readline()
+                if not data:
+                    break
+                text = data.decode('utf-8', 'replace').rstrip('\r\n')
+                if text:
+                    await lines.put((text, time.monotonic()))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
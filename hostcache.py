@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+""" On-disk cache of the reticulum server resolved for each hubs room """
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Set
+
+# Writers in several worker processes take turns where file locks are available.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Default location and lifetime of cached entries.
+HOST_CACHE_FILE = 'hosts_cache.json'
+HOST_CACHE_TTL = 24 * 60 * 60
+# Seconds during which changes are gathered into one write by save_later().
+SAVE_DELAY = 1.0
+
+class HostCache:
+    """
+    A class represents reticulum servers resolved for room URLs, persisted as JSON.
+    Each write merges the entries put or invalidated since the previous one into
+    the file, so that processes sharing it keep the changes of each other.
+
+    {"version": 1, "entries": {"<room URL>": {"hub_id": ..., "host": ..., "resolved_at": ...}}}
+    """
+    VERSION = 1
+
+    def __init__(self, path: str = HOST_CACHE_FILE, ttl: float = HOST_CACHE_TTL) -> None:
+        """
+        Args:
+            path(str): cache file
+            ttl(float): seconds during which a resolved host is used without fetching the room page
+        """
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}  # type: Dict[str, dict]
+        # URLs to be fetched again in the background: answered from the cache, or whose
+        # connection failed.
+        self.hits = set()  # type: Set[str]
+        # Entries put, or None if invalidated, since the last pop_changes().
+        self.changes = {}  # type: Dict[str, Optional[dict]]
+        # Write scheduled by save_later(), and lock of the writes from other threads.
+        self.timer = None  # type: Optional[asyncio.TimerHandle]
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """
+        Loads the cache file. A missing or broken file gives an empty cache.
+        """
+        self.entries = self.read_entries(report=True)
+
+    def read_entries(self, report: bool = False) -> Dict[str, dict]:
+        """
+        Returns the entries of the cache file, none if it is missing or broken.
+
+        Args:
+            report(bool): print why a broken file is ignored
+        """
+        try:
+            with open(self.path) as cache_file:
+                json_data = json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as ex:
+            if report:
+                print(f"Ignoring host cache {self.path}: {ex}")
+            return {}
+
+        if json_data.get('version') == self.VERSION:
+            return json_data.get('entries', {})
+        return {}
+
+    def save(self) -> None:
+        """
+        Writes the changes to the cache file.
+        """
+        self.write(self.pop_changes())
+
+    def pop_changes(self) -> Dict[str, Optional[dict]]:
+        """
+        Returns the changes made since the last call, to be written with write()
+        from another thread.
+        """
+        changes = self.changes
+        self.changes = {}
+        return changes
+
+    def write(self, changes: Dict[str, Optional[dict]]) -> None:
+        """
+        Merges changes into the cache file, written atomically.
+
+        Args:
+            changes(dict): changes returned by pop_changes()
+        """
+        with self.lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = self.read_entries()
+            for url, entry in changes.items():
+                if entry is None:
+                    entries.pop(url, None)
+                else:
+                    entries[url] = entry
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'version': self.VERSION, 'entries': entries}, cache_file, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def save_later(self, delay: float = SAVE_DELAY) -> None:
+        """
+        Writes the cache file from another thread in delay seconds, once for
+        all the changes made meanwhile. Requires a running event loop.
+
+        Args:
+            delay(float): seconds to wait for more changes
+        """
+        if self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(delay, self.__save_in_background)
+
+    def flush(self) -> None:
+        """
+        Writes now the changes waiting for save_later(), if any.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+            self.save()
+
+    def __save_in_background(self) -> None:
+        self.timer = None
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(None, self.__write_or_report, loop, self.pop_changes())
+
+    def __write_or_report(self, loop: asyncio.AbstractEventLoop,
+                          changes: Dict[str, Optional[dict]]) -> None:
+        try:
+            self.write(changes)
+        except OSError as ex:
+            print(f"Failed to write host cache {self.path}: {ex}")
+            # Written with the next changes, unless made again meanwhile.
+            loop.call_soon_threadsafe(self.__restore, changes)
+
+    def __restore(self, changes: Dict[str, Optional[dict]]) -> None:
+        for url, entry in changes.items():
+            self.changes.setdefault(url, entry)
+
+    def get(self, url: str) -> Optional[str]:
+        """
+        Returns the cached reticulum server of the room if not expired.
+
+        Args:
+            url(str): mozilla hubs room's URL.
+
+        Returns:
+            str: reticulum server name, or None on a miss
+        """
+        entry = self.entries.get(url)
+        if entry is None or time.time() - entry['resolved_at'] > self.ttl:
+            return None
+        self.hits.add(url)
+        return entry['host']
+
+    def put(self, url: str, hub_id: str, host: str) -> None:
+        """
+        Records a freshly resolved reticulum server.
+
+        Args:
+            url(str): mozilla hubs room's URL.
+            hub_id(str): hub_id of the room
+            host(str): reticulum server name
+        """
+        self.entries[url] = {'hub_id': hub_id, 'host': host, 'resolved_at': time.time()}
+        self.changes[url] = self.entries[url]
+
+    def invalidate(self, url: str) -> None:
+        """
+        Forgets the reticulum server of the room, e.g. after a failed connect.
+
+        Args:
+            url(str): mozilla hubs room's URL.
+        """
+        self.entries.pop(url, None)
+        self.changes[url] = None
+        self.hits.discard(url)
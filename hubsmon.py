@@ -2,170 +2,337 @@
 """ A program to monitor presence events occurred in the specified hubs room """
 import argparse
 import asyncio
+import functools
+import itertools
 import json
 import os
-import signal
-import threading
 import csv
 import datetime
+import multiprocessing
+import signal
 import time
-import websockets
-from websockets.exceptions import ConnectionClosed, WebSocketException
-from room import Room
-
-CLOSE_CODES = {
-    1000: "OK",
-    1001: "going away",
-    1002: "protocol error",
-    1003: "unsupported type",
-    # 1004 is reserved
-    1005: "no status code [internal]",
-    1006: "connection closed abnormally [internal]",
-    1007: "invalid data",
-    1008: "policy violation",
-    1009: "message too big",
-    1010: "extension required",
-    1011: "unexpected error",
-    1015: "TLS failure [internal]",
-}
-
-def exit_from_event_loop_thread(loop: asyncio.AbstractEventLoop,
-                                stop: "asyncio.Future[None]"
-                               ) -> None:
-    """
-    Exit from event loop thread.
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+from admission import CONNECT_RATE, MAX_PENDING, Admission
+from coalescer import COALESCE_WINDOW, Coalescer
+from connection import ConnectionStats, group_rooms, install_signal_handlers, request_stop, \
+    run_client
+from csvwriter import FLUSH_INTERVAL, FLUSH_ROWS, CsvWriter
+from dashboard import REFRESH_INTERVAL, Dashboard
+from fanout import GLOBAL_BURST, GLOBAL_RATE, POLICIES, POLICY, QUEUE_SIZE, ROOM_BURST, \
+    ROOM_RATE, Broadcaster, Outbox
+from hostcache import HOST_CACHE_FILE, HOST_CACHE_TTL, HostCache
+from metrics import METRICS_HOST, MetricsBuilder, MetricsServer, RoomMetrics, format_label
+from phoenix import CHAT_REF_PREFIX, LEAVE_REF_PREFIX, classify, get_hub_join_str, get_joins, \
+    get_leave_str, loads
+from profiling import CAPTURE_WINDOW, PROFILE_DIR, STAGES, Profiler
+from recorder import FrameRecorder
+from resolver import MAX_CONNECTIONS, forget_hosts, refresh_host_cache, resolve_rooms
+from rollup import WIDTHS, Rollup
+from room import Room, get_hub_id
+from roster import PLACES, Roster, Session, read_sessions
+from shard import SUMMARY_INTERVAL, Supervisor, get_shard, get_worker_path, make_summary
+import profiling
 
-    Args:
-        loop: event loop
-        stop: stop condition
-    """
-    loop.stop()
-    if not stop.done():
-        # When exiting the thread that runs the event loop, raise
-        # KeyboardInterrupt in the main thread to exit the program.
-        os.kill(os.getpid(), signal.SIGINT)
+# Presence roster of each monitored room, keyed by hub_id.
+rosters = {}  # type: Dict[str, Roster]
 
-def get_req_str(template: str, hub_id: str, seq_number: int, monitor_name: str) -> str:
-    """
-    Returns phoenix request string, built from the given template and hub_id.
+# Heartbeat round-trip times of the connection serving each room, keyed by hub_id.
+connection_stats = {}  # type: Dict[str, ConnectionStats]
 
-    Args:
-        template(str): template file
-        hub_id(str): hub_id
-        seq_number(int): message's sequence number starting from 1
-        monitor_name(str): display name of this monitor program
+# Occupancy rollups of every room, disabled when None.
+occupancy = None  # type: Optional[Rollup]
 
-    Returns:
-        str: Phoenix request string after replacement
-    """
-    with open(template) as template_file:
-        template_str = template_file.read()
-        json_str = template_str.replace("{$hub_id}", hub_id)
-        json_str = json_str.replace("{$seq_num}", str(seq_number))
-        json_str = json_str.replace("{$monitor_name}", monitor_name)
-        json_data = json.loads(json_str)
-        return json.dumps(json_data)
+# Buffered writer of presence events. Rows are appended synchronously when None.
+csv_writer = None  # type: Optional[CsvWriter]
 
-def format_close(code: int, reason: str) -> str:
-    """
-    Display a human-readable version of the close code and reason.
+# Pairing of leaves and joins into move and rejoin events, raw events when None.
+coalescer = None  # type: Optional[Coalescer]
 
-    Args:
-        code: close code
-        reason: reason text
-    """
-    if 3000 <= code < 4000:
-        explanation = "registered"
-    elif 4000 <= code < 5000:
-        explanation = "private use"
-    else:
-        explanation = CLOSE_CODES.get(code, "unknown")
-    result = f"code = {code} ({explanation}), "
+# Number of presence events processed in each room, keyed by hub_id.
+event_counts = {}  # type: Dict[str, int]
+
+# Print every presence event on the console.
+verbose = False
+
+# Frames, bytes and processing latency of each room, keyed by hub_id.
+room_metrics = {}  # type: Dict[str, RoomMetrics]
+
+# Queue of outgoing messages of the connection serving each room, keyed by hub_id.
+outgoing_queues = {}  # type: Dict[str, asyncio.Queue]
+
+# hub_id of the monitored rooms, in the order they were joined.
+monitored_hub_ids = []  # type: List[str]
+
+# time.monotonic() each room was started at, until its first presence_state.
+awaiting_state = {}  # type: Dict[str, float]
+
+# hub_id of the rooms given up after their joins were rejected, until started again.
+given_up_hub_ids = []  # type: List[str]
+
+# time.monotonic() monitoring started at, until every room first started got its presence_state.
+startup_at = None  # type: Optional[float]
 
-    if reason:
-        result += f"reason = {reason}"
-    else:
-        result += "no reason"
+# Default seconds between two checks of the rooms file for changes.
+ROOMS_POLL_INTERVAL = 2.0
 
-    return result
+# Seconds given to a connection to send its last leave before it is closed.
+LEAVE_TIMEOUT = 5.0
 
-def process_meta(hub_id: str, meta: dict, event_type: str) -> None:
+def process_meta(hub_id: str, session: Session, event_type: str, at: float = None) -> None:
     """
-    Returns device type texts from the context.
+    Logs a presence event of a session.
 
     Args:
-        meta: meta element
-
-    Returns:
-        list: a list of device type texts
+        hub_id: hub ID.
+        session: session read from the presence payload
+        event_type: 'in', 'joins', 'leaves', or with coalescing 'moves' or 'rejoin'
+        at: time.time() of the event, now if omitted
     """
 
-    dt_now = datetime.datetime.now()
+    dt_now = datetime.datetime.now() if at is None else datetime.datetime.fromtimestamp(at)
     dt_now_str = dt_now.strftime('%Y-%m-%d %H:%M:%S')
 
-    device_types = []
-    is_hmd = False
-    is_mobile = False
-    if "hmd" in meta['context']:
-        if meta['context']['hmd'] is True:
-            is_hmd = True
-            device_types.append('hmd')
-    if "mobile" in meta['context']:
-        if meta['context']['mobile'] is True:
-            is_mobile = True
-            device_types.append('mobile')
-
-    print(dt_now_str,
-          hub_id,
-          meta['profile']['displayName'],
-          device_types,
-          event_type,
-          meta['presence'])
+    event_counts[hub_id] = event_counts.get(hub_id, 0) + 1
+    if verbose:
+        device_types = [device for device, used in (('hmd', session.hmd),
+                                                    ('mobile', session.mobile)) if used]
+        print(dt_now_str,
+              hub_id,
+              session.display_name,
+              device_types,
+              event_type,
+              session.presence)
 
     row = []
     row.append(dt_now_str)
-    row.append(meta['profile']['displayName'])
+    row.append(session.display_name)
     row.append(event_type)
-    row.append(meta['presence'])
-    row.append(is_hmd)
-    row.append(is_mobile)
+    row.append(session.presence)
+    row.append(session.hmd)
+    row.append(session.mobile)
+    if csv_writer is not None:
+        csv_writer.write(hub_id, row)
+        return
+
     with open(hub_id + '.csv', 'a') as csv_file:
         writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
         writer.writerow(row)
         csv_file.flush()
 
-def process_message(hub_id: str, message: str) -> bool:
+def get_roster(hub_id: str) -> Roster:
+    """
+    Returns the presence roster of the room, created on first use.
+
+    Args:
+        hub_id: hub ID.
+
+    Returns:
+        Roster: sessions currently present in the room
+    """
+    roster = rosters.get(hub_id)
+    if roster is None:
+        roster = rosters[hub_id] = Roster()
+    return roster
+
+def update_occupancy(hub_id: str, roster: Roster) -> None:
+    """
+    Feeds the room's current occupancy to the rollups.
+
+    Args:
+        hub_id: hub ID.
+        roster: presence roster of the room
+    """
+    if occupancy is not None:
+        occupancy.update(hub_id, roster.get_counts())
+
+# Events decoded and handled by process_message.
+PRESENCE_EVENTS = frozenset(('presence_state', 'presence_diff'))
+HANDLED_EVENTS = PRESENCE_EVENTS | {'phx_reply'}
+
+def process_message(hub_id: str, message: str,
+                    frame: Tuple[Optional[str], Optional[str]] = None,
+                    decoded: list = None) -> bool:
     """
     Process a message sent from WebSocket server.
 
     Args:
         hub_id: hub ID.
         message: a message to be processed.
+        frame: topic and event of the message as returned by classify(), classified here
+            if omitted
+        decoded: the message already decoded, e.g. a phx_reply, decoded here if omitted
     """
-    msg_as_json = json.loads(message)
-    if msg_as_json[3] == 'presence_state':
-        for key in msg_as_json[4]:
-            for meta in msg_as_json[4][key]['metas']:
-                process_meta(hub_id, meta, 'in')
+    received_at = time.perf_counter()
+    metrics = room_metrics.get(hub_id)
+    if metrics is not None:
+        metrics.record_frame(message)
+
+    # Chat, NAF and other hub traffic is skipped without decoding it.
+    _, event = classify(message) if frame is None else frame
+    if event is not None and event not in HANDLED_EVENTS:
+        return True
+
+    msg_as_json = loads(message) if decoded is None else decoded
+    if hub_id is None and msg_as_json[3] in PRESENCE_EVENTS:
+        # Sent for a room just left on a shared connection.
+        return True
 
-    elif msg_as_json[3] == 'presence_diff':
-        #print(json.dumps(msg_as_json[4], indent=2))
-        for key in msg_as_json[4]['joins']:
-            for meta in msg_as_json[4]['joins'][key]['metas']:
-                process_meta(hub_id, meta, 'joins')
+    timer = profiling.stage_timer
+    if msg_as_json[3] in PRESENCE_EVENTS:
+        roster = get_roster(hub_id)
+        first_state = False
+        present = ()  # type: Sequence[Session]
+        if msg_as_json[3] == 'presence_state':
+            # Only the fields logged are kept: the decoded payload is dropped here.
+            state = read_sessions(msg_as_json[4])
+            del msg_as_json
+            decoded_at = time.perf_counter()
+            if roster.initialized:
+                # Joined again after a reconnect: log only what changed meanwhile.
+                joins, leaves = roster.resync(state)
+            else:
+                roster.apply_state(state)
+                joins, leaves, present, first_state = (), (), state, True
+        else:
+            joins = read_sessions(msg_as_json[4]['joins'])
+            leaves = read_sessions(msg_as_json[4]['leaves'])
+            del msg_as_json
+            decoded_at = time.perf_counter()
+            roster.apply_diff(joins, leaves)
+        update_occupancy(hub_id, roster)
+        dispatched_at = time.perf_counter()
 
-        for key in msg_as_json[4]['leaves']:
-            for meta in msg_as_json[4]['leaves'][key]['metas']:
-                process_meta(hub_id, meta, 'leaves')
+        for session in present:
+            process_meta(hub_id, session, 'in')
+        if coalescer is not None:
+            # Leaves and joins are logged when paired, or once the window has passed.
+            for session, event_type, at in coalescer.coalesce(hub_id, joins, leaves, time.time()):
+                process_meta(hub_id, session, event_type, at)
+        else:
+            for session in joins:
+                process_meta(hub_id, session, 'joins')
+            for session in leaves:
+                process_meta(hub_id, session, 'leaves')
+        if first_state:
+            report_first_state(hub_id)
+        if timer is not None:
+            timer.observe('decode', decoded_at - received_at)
+            timer.observe('dispatch', dispatched_at - decoded_at)
+            timer.observe('sink', time.perf_counter() - dispatched_at)
 
     elif msg_as_json[3] == 'phx_reply':
         status = msg_as_json[4]['status']
-        if status == 'error':
+        ref = str(msg_as_json[1])
+        # A leave may fail when the channel is already gone, e.g. after a reconnect.
+        if status == 'error' and not ref.startswith(LEAVE_REF_PREFIX):
             print(json.dumps(msg_as_json[4]))
-            return False
+            # A refused chat message does not end the monitoring of the room.
+            return ref.startswith(CHAT_REF_PREFIX)
+        return True
 
+    if metrics is not None:
+        metrics.latency.observe(time.perf_counter() - received_at)
     return True
 
+def report_first_state(hub_id: str) -> None:
+    """
+    Records the time from starting a room until its first presence_state,
+    and reports the startup time once every room first started is monitored.
+
+    Args:
+        hub_id: hub ID.
+    """
+    started_at = awaiting_state.pop(hub_id, None)
+    if started_at is None:
+        return
+    now = time.monotonic()
+    metrics = room_metrics.get(hub_id)
+    if metrics is not None:
+        metrics.first_state = now - started_at
+    if verbose:
+        print(f"First presence_state of {hub_id} after {now - started_at:.2f} seconds.")
+    report_startup(now)
+
+def report_startup(now: float) -> None:
+    """
+    Reports the startup time once every room first started is monitored or given up.
+
+    Args:
+        now: time.monotonic()
+    """
+    global startup_at  # pylint: disable=global-statement
+    if startup_at is None or awaiting_state:
+        return
+    report = f"All {len(monitored_hub_ids)} rooms monitored after {now - startup_at:.2f} seconds"
+    if given_up_hub_ids:
+        report += f", {len(given_up_hub_ids)} given up"
+    first_states = sorted(room_metrics[hub_id].first_state for hub_id in monitored_hub_ids
+                          if room_metrics[hub_id].first_state is not None)
+    if first_states:
+        report += (f", first presence_state min/median/max = {first_states[0]:.2f}/"
+                   f"{first_states[len(first_states) // 2]:.2f}/{first_states[-1]:.2f} seconds")
+    print(report + '.')
+    startup_at = None
+
+def render_metrics(hub_ids: List[str]) -> str:
+    """
+    Returns the metrics of the monitored rooms in Prometheus text format.
+
+    Args:
+        hub_ids: monitored rooms
+
+    Returns:
+        str: exposition text
+    """
+    labels = {hub_id: f'hub_id="{format_label(hub_id)}"' for hub_id in hub_ids}
+    metrics = {hub_id: room_metrics.get(hub_id) or RoomMetrics() for hub_id in hub_ids}
+    stats = {hub_id: connection_stats.get(hub_id) or ConnectionStats() for hub_id in hub_ids}
+    counts = {hub_id: get_roster(hub_id).get_counts() for hub_id in hub_ids}
+
+    builder = MetricsBuilder()
+    builder.add('hubsmon_frames_received_total', 'counter', 'Frames received for the room.',
+                {labels[hub_id]: metrics[hub_id].frames for hub_id in hub_ids})
+    builder.add('hubsmon_received_bytes_total', 'counter', 'Bytes of frames received for the room.',
+                {labels[hub_id]: metrics[hub_id].bytes for hub_id in hub_ids})
+    builder.add('hubsmon_presence_events_total', 'counter', 'Presence events processed.',
+                {labels[hub_id]: event_counts.get(hub_id, 0) for hub_id in hub_ids})
+    builder.add('hubsmon_reconnects_total', 'counter',
+                'Connections re-established after the first one.',
+                {labels[hub_id]: max(0, stats[hub_id].connects - 1) for hub_id in hub_ids})
+    builder.add('hubsmon_connected', 'gauge', '1 if the connection serving the room is up.',
+                {labels[hub_id]: int(stats[hub_id].state == 'connected') for hub_id in hub_ids})
+    builder.add('hubsmon_heartbeat_rtt_seconds', 'gauge', 'Last heartbeat round-trip time.',
+                {labels[hub_id]: stats[hub_id].rtt_last for hub_id in hub_ids
+                 if stats[hub_id].rtt_last is not None})
+    builder.add('hubsmon_heartbeats_missed_total', 'counter', 'Heartbeats left unanswered.',
+                {labels[hub_id]: stats[hub_id].missed for hub_id in hub_ids})
+    builder.add('hubsmon_occupancy', 'gauge', 'Sessions in the room or the lobby.',
+                {f'{labels[hub_id]},place="{place}"': counts[hub_id][place]
+                 for hub_id in hub_ids for place in PLACES})
+    builder.add('hubsmon_first_state_seconds', 'gauge',
+                'Time from starting the room until its first presence_state.',
+                {labels[hub_id]: metrics[hub_id].first_state for hub_id in hub_ids
+                 if metrics[hub_id].first_state is not None})
+    builder.add('hubsmon_room_given_up', 'gauge',
+                '1 for a room given up after its joins were rejected, until started again.',
+                {f'hub_id="{format_label(hub_id)}"': 1 for hub_id in given_up_hub_ids})
+    builder.add('hubsmon_outgoing_queue_depth', 'gauge',
+                'Messages waiting to be sent on the connection serving the room.',
+                {labels[hub_id]: outgoing_queues[hub_id].qsize() for hub_id in hub_ids
+                 if hub_id in outgoing_queues})
+    if csv_writer is not None:
+        builder.add('hubsmon_csv_queue_depth', 'gauge',
+                    'Rows waiting for the csv writer thread.', {'': csv_writer.rows.qsize()})
+    builder.add('hubsmon_processing_seconds', 'histogram',
+                'Time from receiving a presence frame until its rows are handed to the writer.',
+                {labels[hub_id]: metrics[hub_id].latency for hub_id in hub_ids})
+    timer = profiling.stage_timer
+    if timer is not None:
+        builder.add('hubsmon_stage_seconds', 'histogram',
+                    'Time spent in each stage of the frame pipeline, while stage timing is on.',
+                    {f'stage="{stage}"': timer.histograms[stage] for stage in STAGES})
+    return builder.get_text()
+
 def init_csv(hubs_room: Room) -> None:
     """
     Creates new csv file with csv header if not exists.
@@ -187,72 +354,641 @@ def init_csv(hubs_room: Room) -> None:
             writer.writerow(row)
             csv_file.flush()
 
-HEARTBEAT_TEMPLATE = '[null, "{$seq_num}", "phoenix", "heartbeat", {}]'
+async def tick_rollup(rollup: Rollup, stop: "asyncio.Future[None]") -> None:
+    """
+    Close the occupancy buckets every second, even in rooms without events.
+
+    Args:
+        rollup: occupancy rollups
+        stop: stop condition
+    """
+    while not stop.done():
+        await asyncio.wait([stop], timeout=1)
+        rollup.tick()
+
+def release_events(hub_id: str = None, now: float = None) -> None:
+    """
+    Logs the leaves and joins held by the coalescer for longer than its window,
+    or all of them for a hub or at the end of monitoring.
+
+    Args:
+        hub_id: hub ID to log all its held events, None for every hub
+        now: current time.time(), all held events are logged if omitted
+    """
+    if coalescer is None:
+        return
+    for held_hub_id, received_at, session, event_type in coalescer.expire(
+            float('inf') if now is None else now, hub_id):
+        process_meta(held_hub_id, session, event_type, received_at)
+
+async def tick_coalescer(stop: "asyncio.Future[None]") -> None:
+    """
+    Log the leaves and joins that were not paired in time, every second.
+
+    Args:
+        stop: stop condition
+    """
+    while not stop.done():
+        await asyncio.wait([stop], timeout=1)
+        release_events(now=time.time())
+    release_events()
+
+class Connection:
+    """
+    A class represents a connection of monitor() and the rooms it serves.
+    With multiplexing, rooms join and leave the shared connection while it runs.
+    With chat, its outgoing messages are the outbox of the broadcaster.
+    """
+    __slots__ = ('hubs_rooms', 'joins', 'channels', 'routes', 'inputs', 'outbox', 'stats', 'stop',
+                 'task', 'last_join_ref')
+
+    def __init__(self, hubs_rooms: List[Room], monitor_name: str,
+                 stop: "asyncio.Future[None]", chat: Broadcaster = None) -> None:
+        """
+        Args:
+            hubs_rooms: rooms served by the connection
+            monitor_name: display name of this monitor program
+            stop: stop condition of all connections
+            chat: broadcaster of chat messages to the rooms, None for no chat
+        """
+        self.hubs_rooms = list(hubs_rooms)
+        self.joins, join_refs = get_joins(self.hubs_rooms, monitor_name)
+        # hub_id -> (join_ref, phx_join message)
+        self.channels = {hubs_room.get_hub_id(): (join_ref, join) for hubs_room, join_ref, join
+                         in zip(self.hubs_rooms, join_refs, self.joins[1:])}
+        self.routes = {'hub:' + hub_id: hub_id for hub_id in self.channels}
+        self.outbox = None  # type: Optional[Outbox]
+        if chat is not None:
+            self.outbox = chat.open([(hub_id, join_ref)
+                                     for hub_id, (join_ref, _) in self.channels.items()])
+        self.inputs = self.outbox or asyncio.Queue()  # type: asyncio.Queue
+        self.stats = ConnectionStats()
+        # Stops this connection only, or all of them with stop.
+        self.stop = asyncio.get_event_loop().create_future()
+        stop.add_done_callback(lambda _: request_stop(self.stop))
+        self.task = None  # type: Optional[asyncio.Future]
+        self.last_join_ref = len(join_refs) + 1
+
+    def add(self, hubs_room: Room, monitor_name: str) -> None:
+        """
+        Joins a room on this connection, now if it is up and on every reconnect.
+
+        Args:
+            hubs_room: room to be joined
+            monitor_name: display name of this monitor program
+        """
+        hub_id = hubs_room.get_hub_id()
+        self.last_join_ref += 1
+        join_ref = str(self.last_join_ref)
+        join = get_hub_join_str(hub_id, join_ref, monitor_name)
+        self.hubs_rooms.append(hubs_room)
+        self.joins.append(join)
+        self.channels[hub_id] = (join_ref, join)
+        self.routes['hub:' + hub_id] = hub_id
+        if self.outbox is not None:
+            self.outbox.add(hub_id, join_ref)
+        if self.stats.state == 'connected':
+            self.inputs.put_nowait(join)
+
+    def remove(self, hub_id: str, leave: bool = True) -> bool:
+        """
+        Leaves a room on this connection.
+
+        Args:
+            hub_id: hub_id of the room
+            leave: send a phx_leave if connected, not for a room whose joins were rejected
+
+        Returns:
+            bool: True if no room is left on this connection
+        """
+        join_ref, join = self.channels.pop(hub_id)
+        self.hubs_rooms[:] = [hubs_room for hubs_room in self.hubs_rooms
+                              if hubs_room.get_hub_id() != hub_id]
+        # Already dropped by communicate() if the room was given up after rejected joins.
+        if join in self.joins:
+            self.joins.remove(join)
+        self.routes.pop('hub:' + hub_id, None)
+        if self.outbox is not None:
+            self.outbox.remove(hub_id)
+        if leave and self.stats.state == 'connected':
+            self.inputs.put_nowait(get_leave_str(hub_id, join_ref))
+        return not self.channels
+
+    async def close(self) -> None:
+        """
+        Sends the pending messages, the last leave among them, then closes the
+        connection. Nothing is waited for if the connection already ended.
+        """
+        sent = asyncio.ensure_future(self.inputs.join())
+        await asyncio.wait([sent, self.task], timeout=LEAVE_TIMEOUT,
+                           return_when=asyncio.FIRST_COMPLETED)
+        sent.cancel()
+        request_stop(self.stop)
+        await self.task
+
+def read_rooms_file(rooms_file: str) -> List[str]:
+    """
+    Returns the room URLs of a rooms file.
+
+    Args:
+        rooms_file: a JSON file contains a list of room URLs
+
+    Returns:
+        list: room URLs
+    """
+    with open(rooms_file) as json_file:
+        return json.load(json_file)['rooms']
+
+def get_wanted_rooms(urls: List[str], shard: Tuple[int, int] = None) -> Dict[str, str]:
+    """
+    Returns the room URLs of a rooms file keyed by hub_id, incorrect URLs left out.
+
+    Args:
+        urls: room URLs
+        shard: (worker index, number of workers) keeping only the rooms of a worker,
+            all rooms if None
 
-async def run_client(hubs_room: Room,
-                     loop: asyncio.AbstractEventLoop,
-                     inputs: "asyncio.Queue[str]",
-                     stop: "asyncio.Future[None]",
+    Returns:
+        dict: first URL of each hub_id
+    """
+    wanted = {}  # type: Dict[str, str]
+    for url in urls:
+        try:
+            hub_id = get_hub_id(url)
+        except ValueError:
+            continue
+        if shard is None or get_shard(hub_id, shard[1]) == shard[0]:
+            wanted.setdefault(hub_id, url)
+    return wanted
+
+async def watch_rooms(rooms_file: str,
+                      apply: Callable[[List[str]], Awaitable[None]],
+                      stop: "asyncio.Future[None]",
+                      interval: float = ROOMS_POLL_INTERVAL
                      ) -> None:
     """
-    WebSocket client thread
+    Calls apply with the room URLs of the rooms file once at start, then
+    whenever the file changes or SIGHUP is received.
 
     Args:
-        hub_id: hub ID
-        loop: event loop
-        inputs: queue for user input
+        rooms_file: a JSON file contains a list of room URLs
+        apply: coroutine function updating the monitored rooms
         stop: stop condition
+        interval: seconds between two checks of the file, 0 to only reload on SIGHUP
     """
-    # initialize csv file if necessary
-    init_csv(hubs_room)
+    loop = asyncio.get_event_loop()
+    hangup = asyncio.Event()
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            loop.add_signal_handler(signal.SIGHUP, hangup.set)
+        except (NotImplementedError, RuntimeError):
+            pass
 
-    reticulum_io_url = "wss://" + hubs_room.get_reticulum_server() + "/socket/websocket?vsn=2.0.0"
-    try:
-        websocket = await websockets.connect(reticulum_io_url)
-    except WebSocketException as ex:
-        print(f"Failed to connect to {reticulum_io_url}: {ex}.")
-        exit_from_event_loop_thread(loop, stop)
-        return
-    else:
-        print(f"Connected to {reticulum_io_url}.")
+    def get_version() -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(rooms_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
-    hub_id = hubs_room.get_hub_id()
+    version = None
     try:
-        while True:
-            incoming = asyncio.ensure_future(websocket.recv())
-            outgoing = asyncio.ensure_future(inputs.get())
-            done, pending = await asyncio.wait(
-                [incoming, outgoing, stop], return_when=asyncio.FIRST_COMPLETED
-            )
-
-            # Cancel pending tasks to avoid leaking them.
-            if incoming in pending:
-                incoming.cancel()
-            if outgoing in pending:
-                outgoing.cancel()
-
-            if incoming in done:
+        while not stop.done():
+            current = get_version()
+            if current != version or hangup.is_set():
+                hangup.clear()
+                version = current
                 try:
-                    message = incoming.result()
-                except ConnectionClosed:
-                    break
+                    urls = read_rooms_file(rooms_file)
+                except (OSError, ValueError, KeyError) as ex:
+                    print(f"Failed to read {rooms_file}: {ex}.")
                 else:
-                    retval = process_message(hub_id, message)
-                    if retval is False:
-                        break
+                    await apply(urls)
+            waiter = asyncio.ensure_future(hangup.wait())
+            await asyncio.wait([stop, waiter], timeout=interval or None,
+                               return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+    finally:
+        if hasattr(signal, 'SIGHUP'):
+            try:
+                loop.remove_signal_handler(signal.SIGHUP)
+            except (NotImplementedError, RuntimeError):
+                pass
 
-            if outgoing in done:
-                message = outgoing.result()
-                await websocket.send(message)
+async def monitor(hubs_rooms: List[Room],
+                  monitor_name: str,
+                  stop: "Optional[asyncio.Future[None]]" = None,
+                  multiplex: bool = False,
+                  host_cache: HostCache = None,
+                  writer: CsvWriter = None,
+                  rollup: Rollup = None,
+                  dashboard_interval: float = None,
+                  metrics_server: MetricsServer = None,
+                  recorder: FrameRecorder = None,
+                  rooms_file: str = None,
+                  reload_interval: float = ROOMS_POLL_INTERVAL,
+                  max_connections: int = MAX_CONNECTIONS,
+                  shard: Tuple[int, int] = None,
+                  admission: Admission = None,
+                  profiler: Profiler = None,
+                  coalesce: Coalescer = None,
+                  chat: Broadcaster = None
+                 ) -> None:
+    """
+    Monitor all rooms as tasks on the current event loop.
 
-            if stop in done:
-                break
+    Args:
+        hubs_rooms: rooms to be monitored
+        monitor_name: display name of this monitor program
+        stop: stop condition. Created and bound to SIGINT/SIGTERM if omitted.
+        multiplex: share one connection among rooms on the same reticulum server
+        host_cache: cache of resolved reticulum servers, refreshed in the background
+        writer: buffered csv writer, flushed and closed when monitoring ends
+        rollup: occupancy rollups
+        dashboard_interval: seconds between two redraws of the live view, disabled if None
+        metrics_server: server of the metrics endpoint, started and closed with monitoring
+        recorder: recording of every received frame, closed when monitoring ends
+        rooms_file: rooms file watched for changes: only the rooms added or removed
+            are joined or left, the other connections keep running. Disabled if None.
+        reload_interval: seconds between two checks of rooms_file, 0 to only reload on SIGHUP
+        max_connections: number of room pages fetched at the same time when reloading
+        shard: (worker index, number of workers) keeping only the rooms of a worker
+            when reloading, all rooms if None
+        admission: scheduler of the connections, in the order of hubs_rooms and then of
+            the rooms added, all connecting right away if None
+        profiler: stage timing and CPU and heap captures on signals, disabled if None
+        coalesce: pairing of leaves and joins into move and rejoin events, raw events if None
+        chat: broadcaster of chat lines to the rooms on the same connections, none if None
+    """
+    global csv_writer, occupancy, coalescer, startup_at  # pylint: disable=global-statement
+    loop = asyncio.get_event_loop()
+    if stop is None:
+        stop = loop.create_future()
+        install_signal_handlers(loop, stop)
+
+    on_connect_failure = None
+    refresh = None
+    if host_cache is not None:
+        on_connect_failure = functools.partial(forget_hosts, host_cache)
+
+    connections = []  # type: List[Connection]
+    # Connection serving each room, and with multiplexing each reticulum server.
+    room_connections = {}  # type: Dict[str, Connection]
+    server_connections = {}  # type: Dict[str, Connection]
+    priorities = itertools.count()
+
+    def start_rooms(new_rooms: List[Room]) -> None:
+        """
+        Starts monitoring rooms, on the running connection of their server if multiplexed.
+        """
+        for hubs_room in new_rooms:
+            hub_id = hubs_room.get_hub_id()
+            if hub_id in given_up_hub_ids:
+                given_up_hub_ids.remove(hub_id)
+            # initialize csv file if necessary
+            init_csv(hubs_room)
+            roster = get_roster(hub_id)
+            room_metrics[hub_id] = RoomMetrics()
+            if rollup is not None:
+                rollup.update(hub_id, roster.get_counts())
+            monitored_hub_ids.append(hub_id)
+            awaiting_state[hub_id] = time.monotonic()
+        connect_rooms(new_rooms)
 
+    def connect_rooms(new_rooms: List[Room]) -> None:
+        """
+        Serves rooms, on the running connection of their server if multiplexed.
+        """
+        for connection_rooms in group_rooms(new_rooms, multiplex):
+            server = connection_rooms[0].get_reticulum_server()
+            connection = server_connections.get(server)
+            if connection is not None and not connection.task.done():
+                for hubs_room in connection_rooms:
+                    connection.add(hubs_room, monitor_name)
+            else:
+                connection = Connection(connection_rooms, monitor_name, stop, chat)
+                # Schedule the task that will manage the connection.
+                connection.task = asyncio.ensure_future(run_client(
+                    connection.hubs_rooms, connection.inputs, connection.stop, process_message,
+                    on_connect_failure, connection.joins, connection.stats, recorder,
+                    connection.routes if multiplex else None, admission, next(priorities),
+                    give_up_room))
+                if connection.outbox is not None:
+                    # Lines are no longer queued to a connection that ended for good.
+                    connection.task.add_done_callback(
+                        lambda _, outbox=connection.outbox: chat.close(outbox))
+                connections.append(connection)
+                if multiplex:
+                    server_connections[server] = connection
+            for hubs_room in connection_rooms:
+                room_connections[hubs_room.get_hub_id()] = connection
+                connection_stats[hubs_room.get_hub_id()] = connection.stats
+                outgoing_queues[hubs_room.get_hub_id()] = connection.inputs
+
+    def forget_room(hub_id: str) -> "Connection":
+        """
+        Drops the state of a room, and returns the connection that served it.
+        """
+        connection = room_connections.pop(hub_id)
+        release_events(hub_id)
+        monitored_hub_ids.remove(hub_id)
+        for states in (rosters, room_metrics, connection_stats, outgoing_queues, awaiting_state):
+            states.pop(hub_id, None)
+        if rollup is not None:
+            rollup.remove(hub_id)
+        return connection
+
+    def forget_connection(connection: Connection) -> None:
+        """
+        Stops adding rooms to a connection that has no room left.
+        """
+        for server, server_connection in list(server_connections.items()):
+            if server_connection is connection:
+                del server_connections[server]
+
+    def give_up_room(hub_id: str) -> None:
+        """
+        Stops monitoring a room whose joins were rejected for good, until the
+        rooms file adds it again. Its connection ends by itself with its last room.
+        """
+        if hub_id not in room_connections:
+            return
+        connection = forget_room(hub_id)
+        given_up_hub_ids.append(hub_id)
+        if connection.remove(hub_id, leave=False):
+            forget_connection(connection)
+        report_startup(time.monotonic())
+
+    async def close_connection(connection: Connection) -> None:
+        """
+        Closes a connection that has no room left.
+        """
+        await connection.close()
+        connections.remove(connection)
+
+    async def stop_room(hub_id: str) -> None:
+        """
+        Leaves a room, and closes its connection if no other room uses it.
+        """
+        connection = forget_room(hub_id)
+        if connection.remove(hub_id):
+            forget_connection(connection)
+            await close_connection(connection)
+
+    moves = set()  # type: Set[asyncio.Future]
+
+    def move_room(url: str, host: str) -> None:
+        """
+        Joins a room again on its new reticulum server, found by refresh_host_cache().
+        Its roster and metrics are kept, as on a reconnection.
+        """
+        hub_id = get_hub_id(url)
+        connection = room_connections.get(hub_id)
+        if connection is None or stop.done():
+            return
+        hubs_room = next((hubs_room for hubs_room in connection.hubs_rooms
+                          if hubs_room.get_hub_id() == hub_id), None)
+        if hubs_room is None or hubs_room.get_reticulum_server() == host:
+            return
+        print(f"Room {hub_id} moved from {hubs_room.get_reticulum_server()} to {host}.")
+        if connection.remove(hub_id):
+            forget_connection(connection)
+            closing = asyncio.ensure_future(close_connection(connection))
+            moves.add(closing)
+            closing.add_done_callback(moves.discard)
+        connect_rooms([Room(url, host)])
+
+    async def apply_rooms(urls: List[str]) -> None:
+        """
+        Joins the rooms added to the rooms file and leaves the rooms removed from it.
+        """
+        wanted = get_wanted_rooms(urls, shard)
+        given_up_hub_ids[:] = [hub_id for hub_id in given_up_hub_ids if hub_id in wanted]
+        added = [url for hub_id, url in wanted.items() if hub_id not in room_connections]
+        removed = [hub_id for hub_id in monitored_hub_ids if hub_id not in wanted]
+        if not added and not removed:
+            return
+
+        new_rooms = await resolve_rooms(added, max_connections, host_cache, strict=False)
+        start_rooms(new_rooms)
+        for hub_id in removed:
+            await stop_room(hub_id)
+        print(f"Rooms reloaded: {len(new_rooms)} joined, {len(removed)} left, "
+              f"{len(monitored_hub_ids)} monitored.")
+
+    if rooms_file is not None:
+        # A restarted worker leaves out the rooms removed since it was first started.
+        try:
+            wanted = get_wanted_rooms(read_rooms_file(rooms_file), shard)
+        except (OSError, ValueError, KeyError):
+            pass
+        else:
+            hubs_rooms = [hubs_room for hubs_room in hubs_rooms
+                          if hubs_room.get_hub_id() in wanted]
+    monitored_hub_ids.clear()
+    awaiting_state.clear()
+    given_up_hub_ids.clear()
+    startup_at = time.monotonic() if hubs_rooms else None
+    start_rooms(hubs_rooms)
+    if host_cache is not None:
+        refresh = asyncio.ensure_future(refresh_host_cache(host_cache, max_connections,
+                                                           on_resolve=move_room))
+
+    csv_writer = writer
+    occupancy = rollup
+    coalescer = coalesce
+    ticker = None
+    if rollup is not None:
+        ticker = asyncio.ensure_future(tick_rollup(rollup, stop))
+    releaser = None
+    if coalesce is not None:
+        releaser = asyncio.ensure_future(tick_coalescer(stop))
+    if metrics_server is not None:
+        await metrics_server.start()
+    view = None
+    if dashboard_interval is not None:
+        view = asyncio.ensure_future(Dashboard(monitored_hub_ids, rosters, connection_stats,
+                                               event_counts, dashboard_interval).run(stop))
+    watcher = None
+    if rooms_file is not None:
+        watcher = asyncio.ensure_future(watch_rooms(rooms_file, apply_rooms, stop, reload_interval))
+    signals = None
+    if profiler is not None:
+        signals = asyncio.ensure_future(profiler.run(stop))
+    sender = None
+    if chat is not None:
+        # Monitoring goes on at the end of stdin.
+        sender = asyncio.ensure_future(chat.run(stop, stop_at_eof=False))
+    try:
+        # Without a rooms file to watch, monitoring ends with the last connection.
+        while not stop.done():
+            running = [connection.task for connection in connections
+                       if not connection.task.done()]
+            if not running and watcher is None:
+                break
+            if writer is not None and writer.error is not None:
+                print(f"Failed to write csv files: {writer.error!r}. Stopping monitoring.")
+                break
+            await asyncio.wait(running + [stop], timeout=ROOMS_POLL_INTERVAL,
+                               return_when=asyncio.FIRST_COMPLETED)
     finally:
-        await websocket.close()
-        close_status = format_close(websocket.close_code, websocket.close_reason)
-        print(f"Connection closed: {close_status}.")
-        exit_from_event_loop_thread(loop, stop)
+        request_stop(stop)
+        if watcher is not None:
+            await watcher
+        if moves:
+            await asyncio.wait(moves)
+        if connections:
+            await asyncio.wait([connection.task for connection in connections])
+            if writer is not None and writer.error is not None:
+                # Connections ended by the failure of the writer, raised by its close() below.
+                for connection in connections:
+                    if not connection.task.cancelled():
+                        connection.task.exception()
+        if sender is not None:
+            # A blocked broadcast waits for rooms that will not be served anymore.
+            sender.cancel()
+            await asyncio.wait([sender])
+        # Both write rows: a failure of the writer is raised by its close() below.
+        if ticker is not None:
+            await asyncio.wait([ticker])
+        if releaser is not None:
+            await asyncio.wait([releaser])
+        if view is not None:
+            await view
+        if signals is not None:
+            await signals
+        if metrics_server is not None:
+            await metrics_server.close()
+        occupancy = None
+        coalescer = None
+        startup_at = None
+        if refresh is not None:
+            refresh.cancel()
+            host_cache.flush()
+        if writer is not None:
+            csv_writer = None
+            await loop.run_in_executor(None, writer.close)
+        if recorder is not None:
+            await loop.run_in_executor(None, recorder.close)
+
+async def send_summaries(index: int,
+                         hub_ids: List[str],
+                         summaries: multiprocessing.Queue,
+                         stop: "asyncio.Future[None]"
+                        ) -> None:
+    """
+    Send the occupancy of the rooms of this worker to the parent every SUMMARY_INTERVAL.
+
+    Args:
+        index: worker index
+        hub_ids: rooms of this worker
+        summaries: queue read by the parent
+        stop: stop condition
+    """
+    while not stop.done():
+        await asyncio.wait([stop], timeout=SUMMARY_INTERVAL)
+        summaries.put((index, [make_summary(hub_id, get_roster(hub_id).get_counts(),
+                                            event_counts.get(hub_id, 0),
+                                            connection_stats.get(hub_id))
+                               for hub_id in hub_ids]))
+
+def run_worker(index: int,
+               hubs_rooms: List[Room],
+               summaries: multiprocessing.Queue,
+               monitor_name: str,
+               multiplex: bool = False,
+               csv_options: dict = None,
+               rollup_widths: List[int] = (),
+               metrics_port: int = None,
+               metrics_host: str = METRICS_HOST,
+               record: str = None,
+               verbose_events: bool = False,
+               rooms_file: str = None,
+               num_workers: int = 1,
+               reload_interval: float = ROOMS_POLL_INTERVAL,
+               admission_options: dict = None,
+               profiler_options: dict = None,
+               coalesce_window: float = None,
+               host_cache_options: dict = None,
+               host_cache_hits: List[str] = (),
+               max_connections: int = MAX_CONNECTIONS
+              ) -> None:
+    """
+    Worker process monitoring a shard of the rooms, with its own connections,
+    csv files and summaries sent to the parent. It stops on SIGTERM; SIGINT
+    is left to the parent.
+
+    Args:
+        index: worker index
+        hubs_rooms: rooms of this worker
+        summaries: queue read by the parent
+        monitor_name: display name of this monitor program
+        multiplex: share one connection among rooms on the same reticulum server
+        csv_options: keyword arguments of the csv writer
+        rollup_widths: occupancy bucket widths, disabled if empty
+        metrics_port: metrics port of the first worker, the others use the next ports
+        metrics_host: address the metrics endpoint listens on
+        record: recording file name, suffixed with the worker index
+        verbose_events: print every presence event
+        rooms_file: rooms file watched for changes, the rooms of this worker are kept
+        num_workers: number of worker processes sharing the rooms file
+        reload_interval: seconds between two checks of rooms_file, 0 to only reload on SIGHUP
+        admission_options: keyword arguments of the admission scheduler of this worker,
+            connecting right away if None
+        profiler_options: keyword arguments of the profiler, captures suffixed with the
+            worker index
+        coalesce_window: seconds a leave or a join waits for the other of the same presence key,
+            raw events if None
+        host_cache_options: keyword arguments of the host cache, shared with the other
+            workers through its file, not used if None
+        host_cache_hits: room URLs the parent answered from the host cache, those of this
+            worker are fetched again in the background
+        max_connections: number of room pages fetched at the same time when reloading
+    """
+    global verbose  # pylint: disable=global-statement
+    verbose = verbose_events
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in ('SIGHUP', 'SIGUSR1', 'SIGUSR2'):
+        if hasattr(signal, name):
+            # Handled once monitoring runs, not ending the worker before.
+            signal.signal(getattr(signal, name), signal.SIG_IGN)
+
+    writer = CsvWriter(**(csv_options or {}))
+    rollup = None
+    if rollup_widths:
+        rollup = Rollup(rollup_widths, writer=writer, suffix=get_worker_path('', index))
+    recorder = FrameRecorder(get_worker_path(record, index)) if record else None
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(functools.partial(render_metrics, monitored_hub_ids),
+                                       metrics_host, metrics_port + index)
+
+    async def work():
+        loop = asyncio.get_event_loop()
+        stop = loop.create_future()
+        loop.add_signal_handler(signal.SIGTERM, request_stop, stop)
+        sender = asyncio.ensure_future(send_summaries(index, monitored_hub_ids, summaries, stop))
+        admission = Admission(**admission_options) if admission_options is not None else None
+        profiler = Profiler(suffix=get_worker_path('', index), **(profiler_options or {}))
+        coalesce = Coalescer(coalesce_window) if coalesce_window is not None else None
+        host_cache = None
+        if host_cache_options is not None:
+            host_cache = HostCache(**host_cache_options)
+            host_cache.hits.update({hubs_room.get_url() for hubs_room in hubs_rooms} &
+                                   set(host_cache_hits))
+        try:
+            await monitor(hubs_rooms, monitor_name, stop, multiplex=multiplex,
+                          host_cache=host_cache, writer=writer, rollup=rollup,
+                          metrics_server=metrics_server, recorder=recorder,
+                          rooms_file=rooms_file, reload_interval=reload_interval,
+                          max_connections=max_connections, shard=(index, num_workers),
+                          admission=admission, profiler=profiler, coalesce=coalesce)
+        finally:
+            await sender
+
+    asyncio.run(work())
+    # The parent may not read the last summaries.
+    summaries.cancel_join_thread()
 
 def main() -> None:
     """
@@ -265,65 +1001,166 @@ def main() -> None:
     )
     parser.add_argument("rooms_file", help="a JSON file contains a list of room URLs.")
     parser.add_argument("-n", "--name", default='Presence Monitor', help="display name of monitor")
+    parser.add_argument("-m", "--multiplex", action='store_true',
+                        help="share one connection among rooms on the same reticulum server")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="number of room pages fetched at the same time at startup")
+    parser.add_argument("--max-pending-connects", type=int, default=MAX_PENDING,
+                        help="connections connecting and joining their rooms at the same time")
+    parser.add_argument("--connect-rate", type=float, default=CONNECT_RATE,
+                        help="connections started per second, 0 for no limit")
+    parser.add_argument("--host-cache", default=HOST_CACHE_FILE,
+                        help="file caching the reticulum server of each room")
+    parser.add_argument("--host-cache-ttl", type=float, default=HOST_CACHE_TTL,
+                        help="seconds during which a cached reticulum server is used")
+    parser.add_argument("--csv-flush-rows", type=int, default=FLUSH_ROWS,
+                        help="number of buffered csv rows triggering a write to disk")
+    parser.add_argument("--csv-flush-interval", type=float, default=FLUSH_INTERVAL,
+                        help="maximum seconds a csv row stays buffered")
+    parser.add_argument("--csv-fsync", action='store_true',
+                        help="fsync csv files after each write to disk")
+    parser.add_argument("--csv-rotate-mb", type=float, default=0,
+                        help="rotate a csv file once it reaches this size in MB, 0 for no limit")
+    parser.add_argument("--csv-rotate-interval", type=float, default=0,
+                        help="rotate a csv file after this number of seconds, 0 for no limit")
+    parser.add_argument("--csv-no-compress", action='store_true',
+                        help="keep rotated csv segments uncompressed")
+    parser.add_argument("--rollup", default=','.join(map(str, WIDTHS)),
+                        type=lambda text: [int(width) for width in text.split(',') if width],
+                        help="comma separated occupancy bucket widths in seconds, empty to disable")
+    parser.add_argument("-d", "--dashboard", nargs='?', type=float, const=REFRESH_INTERVAL,
+                        metavar='INTERVAL',
+                        help="show a live view of the rooms, redrawn every INTERVAL seconds")
+    parser.add_argument("--coalesce", nargs='?', type=float, const=COALESCE_WINDOW,
+                        metavar='WINDOW',
+                        help="log a leave and a join of the same presence key within WINDOW "
+                             "seconds, in either order, as one 'moves' or 'rejoin' event, "
+                             "instead of raw events")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="print every presence event")
+    parser.add_argument("--chat", action='store_true',
+                        help="send each line of stdin as a chat message to every room")
+    parser.add_argument("--control-socket", metavar='PATH',
+                        help="send each line received on this unix socket as a chat message "
+                             "to every room")
+    parser.add_argument("--chat-policy", choices=POLICIES, default=POLICY,
+                        help="what to do with a chat line for a room whose queue is full")
+    parser.add_argument("--chat-queue-size", type=int, default=QUEUE_SIZE,
+                        help="number of chat messages waiting to be sent per room")
+    parser.add_argument("--chat-room-rate", type=float, default=ROOM_RATE,
+                        help="chat messages per second to each room, 0 for no limit")
+    parser.add_argument("--chat-room-burst", type=int, default=ROOM_BURST,
+                        help="chat messages sent at once to each room")
+    parser.add_argument("--chat-global-rate", type=float, default=GLOBAL_RATE,
+                        help="chat messages per second to all rooms, 0 for no limit")
+    parser.add_argument("--chat-global-burst", type=int, default=GLOBAL_BURST,
+                        help="chat messages sent at once to all rooms")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve metrics in Prometheus text format on this port")
+    parser.add_argument("--metrics-host", default=METRICS_HOST,
+                        help="address the metrics endpoint listens on")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="split the rooms across this number of worker processes")
+    parser.add_argument("--record", metavar='FILE',
+                        help="append every received frame to a gzip recording, see replay.py")
+    parser.add_argument("--stage-timing", action='store_true',
+                        help="time each stage of the frame pipeline from the start, "
+                             "toggled with SIGUSR1")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR,
+                        help="directory of the CPU and heap captures taken on SIGUSR2")
+    parser.add_argument("--profile-window", type=float, default=CAPTURE_WINDOW,
+                        help="seconds of a CPU and heap capture")
+    parser.add_argument("--profile-at-start", action='store_true',
+                        help="take a CPU and heap capture at startup")
+    parser.add_argument("--reload-interval", type=float, default=ROOMS_POLL_INTERVAL,
+                        help="seconds between two checks of the rooms file for added or removed "
+                             "rooms, 0 to only reload on SIGHUP")
     args = parser.parse_args()
+    if args.workers > 0 and (args.chat or args.control_socket):
+        parser.error("chat is sent by a single process: --chat and --control-socket "
+                     "cannot be used with --workers")
+    host_cache = HostCache(args.host_cache, args.host_cache_ttl)
+    global verbose  # pylint: disable=global-statement
+    verbose = args.verbose
 
-    rooms = []
-
-    with open(args.rooms_file) as json_file:
-        json_data = json.load(json_file)
+    hubs_rooms = asyncio.run(
+        resolve_rooms(read_rooms_file(args.rooms_file), args.max_connections, host_cache))
 
-        # setup stuffs for each room
-        for room_url in json_data['rooms']:
-            hubs_room = Room(room_url)
-
-            room = {}
-            rooms.append(room)
-
-            # Create an event loop that will run in a background thread.
-            loop = asyncio.new_event_loop()
-            room['loop'] = loop
-
-            # Create a queue of user inputs. There's no need to limit its size.
-            inputs = asyncio.Queue(loop=loop)
-            room['inputs'] = inputs
-            hub_id = hubs_room.get_hub_id()
-            inputs.put_nowait(get_req_str('phx_join_1.template', hub_id, 1, args.name))
-            inputs.put_nowait(get_req_str('phx_join_2.template', hub_id, 2, args.name))
-
-            # Create a stop condition when receiving SIGINT or SIGTERM.
-            stop = loop.create_future()
-            room['stop'] = stop
-
-            # Schedule the task that will manage the connection.
-            asyncio.ensure_future(run_client(hubs_room, loop, inputs, stop), loop=loop)
+    if len(hubs_rooms) == 0:
+        print('No valid room is specified. Exit monitoring.')
+        return
 
-            # Start the event loop in a background thread.
-            thread = threading.Thread(target=loop.run_forever)
-            room['thread'] = thread
-            thread.start()
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(functools.partial(render_metrics, monitored_hub_ids),
+                                       args.metrics_host, args.metrics_port)
 
-    if len(rooms) == 0:
-        print('No valid room is specified. Exit monitoring.')
+    csv_options = {
+        'flush_rows': args.csv_flush_rows,
+        'flush_interval': args.csv_flush_interval,
+        'fsync': args.csv_fsync,
+        'rotate_bytes': int(args.csv_rotate_mb * 1024 * 1024),
+        'rotate_interval': args.csv_rotate_interval,
+        'compress': not args.csv_no_compress,
+    }
+    profiler_options = {
+        'directory': args.profile_dir,
+        'window': args.profile_window,
+        'stage_timing': args.stage_timing,
+        'capture_at_start': args.profile_at_start,
+    }
+    admission_options = {
+        'max_pending': args.max_pending_connects,
+        'rate': args.connect_rate,
+    }
+    if args.workers > 0:
+        # Each worker monitors its rooms on its own event loop, and admits its share
+        # of the connections.
+        admission_options['max_pending'] = max(1, args.max_pending_connects // args.workers)
+        admission_options['rate'] = args.connect_rate / args.workers
+        Supervisor(run_worker, hubs_rooms, args.workers, {
+            'monitor_name': args.name,
+            'multiplex': args.multiplex,
+            'csv_options': csv_options,
+            'rollup_widths': args.rollup,
+            'metrics_port': args.metrics_port,
+            'metrics_host': args.metrics_host,
+            'record': args.record,
+            'verbose_events': args.verbose,
+            'rooms_file': args.rooms_file,
+            'num_workers': args.workers,
+            'reload_interval': args.reload_interval,
+            'admission_options': admission_options,
+            'profiler_options': profiler_options,
+            'coalesce_window': args.coalesce,
+            'host_cache_options': {'path': args.host_cache, 'ttl': args.host_cache_ttl},
+            'host_cache_hits': sorted(host_cache.hits),
+            'max_connections': args.max_connections,
+        }, args.dashboard, reload=True).run()
         return
 
-    # Read from stdin in the main thread in order to receive signals.
+    # All rooms share one event loop in the main thread.
     try:
-        seq_num = 3
-        while True:
-            # send heartbeat message to phoenix in each 30 seconds
-            time.sleep(30)
-            message = HEARTBEAT_TEMPLATE.replace('{$seq_num}', str(seq_num))
-            for room in rooms:
-                room['loop'].call_soon_threadsafe(room['inputs'].put_nowait, message)
-            seq_num += 1
-
-    except (KeyboardInterrupt, EOFError):  # ^C, ^D
-        for room in rooms:
-            room['loop'].call_soon_threadsafe(room['stop'].set_result, None)
-
-    # Wait for the event loop to terminate.
-    for room in rooms:
-        room['thread'].join()
+        writer = CsvWriter(**csv_options)
+        rollup = Rollup(args.rollup, writer=writer) if args.rollup else None
+        recorder = FrameRecorder(args.record) if args.record else None
+        coalesce = Coalescer(args.coalesce) if args.coalesce is not None else None
+        chat = None
+        if args.chat or args.control_socket:
+            chat = Broadcaster(args.chat, args.control_socket, args.chat_policy,
+                               args.chat_queue_size, args.chat_room_rate, args.chat_room_burst,
+                               args.chat_global_rate, args.chat_global_burst)
+        asyncio.run(monitor(hubs_rooms, args.name, multiplex=args.multiplex,
+                            host_cache=host_cache, writer=writer, rollup=rollup,
+                            dashboard_interval=args.dashboard, metrics_server=metrics_server,
+                            recorder=recorder, rooms_file=args.rooms_file,
+                            reload_interval=args.reload_interval,
+                            max_connections=args.max_connections,
+                            admission=Admission(**admission_options),
+                            profiler=Profiler(**profiler_options),
+                            coalesce=coalesce, chat=chat))
+    except KeyboardInterrupt:  # ^C where signal handlers are unavailable
+        pass
 
 if __name__ == "__main__":
     main()
@@ -2,191 +2,115 @@
 """ A program to monitor presence events occurred in the specified hubs room """
 import argparse
 import asyncio
+import functools
 import json
-import os
-import signal
-import threading
-import csv
-import datetime
-import websockets
-from websockets.exceptions import ConnectionClosed, WebSocketException
+from typing import List, Optional, Tuple
+from connection import group_rooms, install_signal_handlers, request_stop, run_client
+from fanout import GLOBAL_BURST, GLOBAL_RATE, POLICIES, POLICY, QUEUE_SIZE, ROOM_BURST, \
+    ROOM_RATE, Broadcaster
+from hostcache import HOST_CACHE_FILE, HOST_CACHE_TTL, HostCache
+from phoenix import CHAT_REF_PREFIX, LEAVE_REF_PREFIX, classify, get_joins, loads
+from resolver import MAX_CONNECTIONS, forget_hosts, refresh_host_cache, resolve_rooms
 from room import Room
 
-CLOSE_CODES = {
-    1000: "OK",
-    1001: "going away",
-    1002: "protocol error",
-    1003: "unsupported type",
-    # 1004 is reserved
-    1005: "no status code [internal]",
-    1006: "connection closed abnormally [internal]",
-    1007: "invalid data",
-    1008: "policy violation",
-    1009: "message too big",
-    1010: "extension required",
-    1011: "unexpected error",
-    1015: "TLS failure [internal]",
-}
-
-CHAT_TEMPLATE = '["2", "{$seq_num}", "hub:{$hub_id}", "message", {"body":"{$msg}", "type":"chat"}]'
-
-def exit_from_event_loop_thread(loop: asyncio.AbstractEventLoop,
-                                stop: "asyncio.Future[None]"
-                               ) -> None:
-    """
-    Exit from event loop thread.
-
-    Args:
-        loop: event loop
-        stop: stop condition
-    """
-    loop.stop()
-    if not stop.done():
-        # When exiting the thread that runs the event loop, raise
-        # KeyboardInterrupt in the main thread to exit the program.
-        os.kill(os.getpid(), signal.SIGINT)
-
-def get_req_str(template: str, hub_id: str, seq_number: int, monitor_name: str) -> str:
-    """
-    Returns phoenix request string, built from the given template and hub_id.
-
-    Args:
-        template(str): template file
-        hub_id(str): hub_id
-        seq_number(int): message's sequence number starting from 1
-        monitor_name(str): display name of this monitor program
-
-    Returns:
-        str: Phoenix request string after replacement
-    """
-    with open(template) as template_file:
-        template_str = template_file.read()
-        json_str = template_str.replace("{$hub_id}", hub_id)
-        json_str = json_str.replace("{$seq_num}", str(seq_number))
-        json_str = json_str.replace("{$monitor_name}", monitor_name)
-        json_data = json.loads(json_str)
-        return json.dumps(json_data)
-
-def get_chat_str(hub_id: str, seq_number: int, message: str) -> str:
-    """
-    Returns phoenix chat request string.
-
-    Args:
-        hub_id(str): hub_id
-        seq_number(int): message's sequence number starting from 1
-        message(str): chat message
-
-    Returns:
-        str: Phoenix request string after replacement
-    """
-    template_str = CHAT_TEMPLATE
-    json_str = template_str.replace("{$hub_id}", hub_id)
-    json_str = json_str.replace("{$seq_num}", str(seq_number))
-    json_str = json_str.replace("{$msg}", message)
-    json_data = json.loads(json_str)
-    return json.dumps(json_data)
-
-def format_close(code: int, reason: str) -> str:
-    """
-    Display a human-readable version of the close code and reason.
-
-    Args:
-        code: close code
-        reason: reason text
-    """
-    if 3000 <= code < 4000:
-        explanation = "registered"
-    elif 4000 <= code < 5000:
-        explanation = "private use"
-    else:
-        explanation = CLOSE_CODES.get(code, "unknown")
-    result = f"code = {code} ({explanation}), "
-
-    if reason:
-        result += f"reason = {reason}"
-    else:
-        result += "no reason"
-
-    return result
-
-def process_message(hub_id: str, message: str) -> bool:
+def process_message(hub_id: str, message: str,
+                    frame: Tuple[Optional[str], Optional[str]] = None,
+                    decoded: list = None) -> bool:
     """
     Process a message sent from WebSocket server.
 
     Args:
         hub_id: hub ID.
         message: a message to be processed.
+        frame: topic and event of the message as returned by classify(), classified here
+            if omitted
+        decoded: the message already decoded, e.g. a phx_reply, decoded here if omitted
     """
-    msg_as_json = json.loads(message)
+    # Only replies are of interest: everything else is skipped without decoding it.
+    _, event = classify(message) if frame is None else frame
+    if event is not None and event != 'phx_reply':
+        return True
+
+    msg_as_json = loads(message) if decoded is None else decoded
     if msg_as_json[3] == 'phx_reply':
         status = msg_as_json[4]['status']
-        if status == 'error':
+        ref = str(msg_as_json[1])
+        # A leave may fail when the channel is already gone, e.g. after a reconnect.
+        if status == 'error' and not ref.startswith(LEAVE_REF_PREFIX):
             print(json.dumps(msg_as_json[4]))
-            return False
+            # A refused chat message does not close the connection of the room.
+            return ref.startswith(CHAT_REF_PREFIX)
 
     return True
 
-async def run_client(hubs_room: Room,
-                     loop: asyncio.AbstractEventLoop,
-                     inputs: "asyncio.Queue[str]",
-                     stop: "asyncio.Future[None]",
-                     ) -> None:
+async def send_messages(hubs_rooms: List[Room],
+                        monitor_name: str,
+                        stop: "Optional[asyncio.Future[None]]" = None,
+                        multiplex: bool = False,
+                        host_cache: HostCache = None,
+                        policy: str = POLICY,
+                        queue_size: int = QUEUE_SIZE,
+                        room_rate: float = ROOM_RATE,
+                        room_burst: int = ROOM_BURST,
+                        global_rate: float = GLOBAL_RATE,
+                        global_burst: int = GLOBAL_BURST
+                       ) -> None:
     """
-    WebSocket client thread
+    Join all rooms as tasks on the current event loop and broadcast stdin.
 
     Args:
-        hub_id: hub ID
-        loop: event loop
-        inputs: queue for user input
-        stop: stop condition
+        hubs_rooms: rooms to send messages to
+        monitor_name: display name of this program
+        stop: stop condition. Created and bound to SIGINT/SIGTERM if omitted.
+        multiplex: share one connection among rooms on the same reticulum server
+        host_cache: cache of resolved reticulum servers, refreshed in the background
+        policy: 'drop', 'coalesce' or 'block' when a room's queue is full
+        queue_size: maximum number of messages waiting per room
+        room_rate: messages per second per room, no limit if 0
+        room_burst: messages sent at once per room
+        global_rate: messages per second to all rooms, no limit if 0
+        global_burst: messages sent at once to all rooms
     """
-    reticulum_io_url = "wss://" + hubs_room.get_reticulum_server() + "/socket/websocket?vsn=2.0.0"
-    try:
-        websocket = await websockets.connect(reticulum_io_url)
-    except WebSocketException as ex:
-        print(f"Failed to connect to {reticulum_io_url}: {ex}.")
-        exit_from_event_loop_thread(loop, stop)
-        return
-    else:
-        print(f"Connected to {reticulum_io_url}.")
-
-    hub_id = hubs_room.get_hub_id()
+    loop = asyncio.get_event_loop()
+    if stop is None:
+        stop = loop.create_future()
+        install_signal_handlers(loop, stop)
+
+    broadcaster = Broadcaster(True, None, policy, queue_size, room_rate, room_burst,
+                              global_rate, global_burst)
+    clients = []
+    on_connect_failure = None
+    refresh = None
+    if host_cache is not None:
+        on_connect_failure = functools.partial(forget_hosts, host_cache)
+        refresh = asyncio.ensure_future(refresh_host_cache(host_cache))
+
+    for connection_rooms in group_rooms(hubs_rooms, multiplex):
+        joins, join_refs = get_joins(connection_rooms, monitor_name)
+        # Outgoing messages are bounded per room and rate-limited.
+        outbox = broadcaster.open([(hubs_room.get_hub_id(), join_ref)
+                                   for hubs_room, join_ref in zip(connection_rooms, join_refs)])
+
+        # Schedule the task that will manage the connection. Lines are no longer
+        # queued to a room given up after its joins were rejected, nor to a
+        # connection that ended for good.
+        client = asyncio.ensure_future(
+            run_client(connection_rooms, outbox, stop, process_message, on_connect_failure,
+                       joins, on_join_failure=outbox.remove))
+        client.add_done_callback(lambda _, outbox=outbox: broadcaster.close(outbox))
+        clients.append(client)
+
+    sender = asyncio.ensure_future(broadcaster.run(stop))
     try:
-        while True:
-            incoming = asyncio.ensure_future(websocket.recv())
-            outgoing = asyncio.ensure_future(inputs.get())
-            done, pending = await asyncio.wait(
-                [incoming, outgoing, stop], return_when=asyncio.FIRST_COMPLETED
-            )
-
-            # Cancel pending tasks to avoid leaking them.
-            if incoming in pending:
-                incoming.cancel()
-            if outgoing in pending:
-                outgoing.cancel()
-
-            if incoming in done:
-                try:
-                    message = incoming.result()
-                except ConnectionClosed:
-                    break
-                else:
-                    retval = process_message(hub_id, message)
-                    if retval is False:
-                        break
-
-            if outgoing in done:
-                message = outgoing.result()
-                await websocket.send(message)
-
-            if stop in done:
-                break
-
+        await asyncio.wait(clients)
     finally:
-        await websocket.close()
-        close_status = format_close(websocket.close_code, websocket.close_reason)
-        print(f"Connection closed: {close_status}.")
-        exit_from_event_loop_thread(loop, stop)
+        request_stop(stop)
+        # A blocked broadcast waits for rooms that will not be served anymore.
+        sender.cancel()
+        await asyncio.wait([sender])
+        if refresh is not None:
+            refresh.cancel()
+            host_cache.flush()
 
 def main() -> None:
     """
@@ -199,72 +123,47 @@ def main() -> None:
     )
     parser.add_argument("rooms_file", help="a JSON file contains a list of room URLs.")
     parser.add_argument("-n", "--name", default='Presence Monitor', help="display name of monitor")
+    parser.add_argument("-m", "--multiplex", action='store_true',
+                        help="share one connection among rooms on the same reticulum server")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="number of room pages fetched at the same time at startup")
+    parser.add_argument("--host-cache", default=HOST_CACHE_FILE,
+                        help="file caching the reticulum server of each room")
+    parser.add_argument("--host-cache-ttl", type=float, default=HOST_CACHE_TTL,
+                        help="seconds during which a cached reticulum server is used")
+    parser.add_argument("--policy", choices=POLICIES, default=POLICY,
+                        help="what to do with a line for a room whose queue is full")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="number of messages waiting to be sent per room")
+    parser.add_argument("--room-rate", type=float, default=ROOM_RATE,
+                        help="messages per second to each room, 0 for no limit")
+    parser.add_argument("--room-burst", type=int, default=ROOM_BURST,
+                        help="messages sent at once to each room")
+    parser.add_argument("--global-rate", type=float, default=GLOBAL_RATE,
+                        help="messages per second to all rooms, 0 for no limit")
+    parser.add_argument("--global-burst", type=int, default=GLOBAL_BURST,
+                        help="messages sent at once to all rooms")
     args = parser.parse_args()
-
-    rooms = []
+    host_cache = HostCache(args.host_cache, args.host_cache_ttl)
 
     with open(args.rooms_file) as json_file:
         json_data = json.load(json_file)
+        hubs_rooms = asyncio.run(
+            resolve_rooms(json_data['rooms'], args.max_connections, host_cache))
 
-        # setup stuffs for each room
-        for room_url in json_data['rooms']:
-            hubs_room = Room(room_url)
-
-            room = {}
-            rooms.append(room)
-
-            # Create an event loop that will run in a background thread.
-            loop = asyncio.new_event_loop()
-            room['loop'] = loop
-
-            # Create a queue of user inputs. There's no need to limit its size.
-            inputs = asyncio.Queue(loop=loop)
-            room['inputs'] = inputs
-            hub_id = hubs_room.get_hub_id()
-            room['hub_id'] = hub_id
-            inputs.put_nowait(get_req_str('phx_join_1.template', hub_id, 1, args.name))
-            inputs.put_nowait(get_req_str('phx_join_2.template', hub_id, 2, args.name))
-
-            # Create a stop condition when receiving SIGINT or SIGTERM.
-            stop = loop.create_future()
-            room['stop'] = stop
-
-            # Schedule the task that will manage the connection.
-            asyncio.ensure_future(run_client(hubs_room, loop, inputs, stop), loop=loop)
-
-            # Start the event loop in a background thread.
-            thread = threading.Thread(target=loop.run_forever)
-            room['thread'] = thread
-            thread.start()
-
-    if len(rooms) == 0:
+    if len(hubs_rooms) == 0:
         print('No valid room is specified. Exit monitoring.')
         return
 
-    # Read from stdin in the main thread in order to receive signals.
+    # All rooms share one event loop in the main thread.
     try:
-        seq_num = 3
-        while True:
-            input_text = input()
-            if len(input_text) == 0:
-                print('bye.')
-                raise KeyboardInterrupt
-
-            for room in rooms:
-                message = get_chat_str(room['hub_id'],
-                                       seq_num,
-                                       input_text)
-                room['loop'].call_soon_threadsafe(room['inputs'].put_nowait, message)
-
-            seq_num += 1
-
-    except (KeyboardInterrupt, EOFError):  # ^C, ^D
-        for room in rooms:
-            room['loop'].call_soon_threadsafe(room['stop'].set_result, None)
-
-    # Wait for the event loop to terminate.
-    for room in rooms:
-        room['thread'].join()
+        asyncio.run(send_messages(hubs_rooms, args.name, multiplex=args.multiplex,
+                                  host_cache=host_cache, policy=args.policy,
+                                  queue_size=args.queue_size, room_rate=args.room_rate,
+                                  room_burst=args.room_burst, global_rate=args.global_rate,
+                                  global_burst=args.global_burst))
+    except KeyboardInterrupt:  # ^C where signal handlers are unavailable
+        pass
 
 if __name__ == "__main__":
     main()
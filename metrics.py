@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+""" Metrics of the monitored hubs rooms served over HTTP in Prometheus text format """
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Upper bounds in seconds of the buckets of processing latency histograms.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 1.0)
+
+METRICS_HOST = '127.0.0.1'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram:
+    """
+    A class represents a Prometheus histogram with fixed buckets.
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        # observations per bucket, not cumulative; the last one is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Records an observation.
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        """
+        Returns the sample lines of the histogram.
+
+        Args:
+            name(str): metric name
+            labels(str): formatted labels without braces, such as 'hub_id="abc"'
+        """
+        lines = []
+        cumulative = 0
+        for bound, num in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += num
+            upper = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{upper}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class RoomMetrics:
+    """
+    A class represents the traffic counters of a hubs room.
+    """
+    __slots__ = ('frames', 'bytes', 'latency', 'first_state')
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.bytes = 0
+        # seconds from receiving a presence frame until its rows are handed to the writer
+        self.latency = Histogram()
+        # seconds from starting the room until its first presence_state
+        self.first_state = None  # type: Optional[float]
+
+    def record_frame(self, message: str) -> None:
+        """
+        Counts a frame received for the room.
+
+        Args:
+            message(str): the frame as received
+        """
+        self.frames += 1
+        self.bytes += len(message) if message.isascii() else len(message.encode())
+
+def format_label(value: str) -> str:
+    """
+    Returns a label value escaped for the Prometheus text format.
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsBuilder:
+    """
+    A class accumulates metric families of the Prometheus text format.
+    """
+
+    def __init__(self) -> None:
+        self.lines = []  # type: List[str]
+
+    def add(self, name: str, kind: str, help_text: str, samples: Dict[str, object]) -> None:
+        """
+        Adds a metric family.
+
+        Args:
+            name(str): metric name
+            kind(str): 'counter', 'gauge' or 'histogram'
+            help_text(str): description
+            samples: value of each formatted label set, or Histogram for histograms
+        """
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples.items():
+            if isinstance(value, Histogram):
+                self.lines.extend(value.render(name, labels))
+            elif labels:
+                self.lines.append(f"{name}{{{labels}}} {value}")
+            else:
+                self.lines.append(f"{name} {value}")
+
+    def get_text(self) -> str:
+        """
+        Returns the exposition text.
+        """
+        return '\n'.join(self.lines) + '\n'
+
+class MetricsServer:
+    """
+    A class serves GET /metrics on the event loop.
+
+    The text is rendered on each scrape from counters kept up to date by the
+    monitor, so a scrape costs one pass over the rooms and nothing otherwise.
+    """
+
+    def __init__(self, render: Callable[[], str], host: str = METRICS_HOST,
+                 port: int = 9100) -> None:
+        """
+        Args:
+            render: returns the metrics in Prometheus text format
+            host(str): address to listen on
+            port(int): port to listen on
+        """
+        self.render = render
+        self.host = host
+        self.port = port
+        self.server = None  # type: asyncio.AbstractServer
+
+    async def start(self) -> None:
+        """
+        Start listening.
+        """
+        self.server = await asyncio.start_server(self.__handle, self.host, self.port)
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics.")
+
+    async def close(self) -> None:
+        """
+        Stop listening.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            # Skip the headers.
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] in ('GET', 'HEAD') and \
+                    parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+                if parts[0] == 'HEAD':
+                    body_sent = b''
+                else:
+                    body_sent = body
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+                body_sent = body
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+                         .encode('latin-1') + body_sent)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
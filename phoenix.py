@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+""" Phoenix v2 frame helpers shared by hubsmon and hubsmsg """
+import functools
+import json
+import re
+from json.encoder import encode_basestring_ascii
+from typing import Dict, List, Optional, Tuple, Union
+from room import Room
+
+# Use a faster JSON decoder when one is installed.
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson
+        loads = ujson.loads
+        JSON_BACKEND = 'ujson'
+    except ImportError:
+        loads = json.loads
+        JSON_BACKEND = 'json'
+
+# Template files of the "ret" and "hub:<hub_id>" channel joins, and the chat message.
+RET_JOIN_TEMPLATE = 'phx_join_1.template'
+HUB_JOIN_TEMPLATE = 'phx_join_2.template'
+CHAT_TEMPLATE = '["2", "{$seq_num}", "hub:{$hub_id}", "message", {"body":"{$msg}", "type":"chat"}]'
+
+# Placeholder such as {$hub_id} in the strings of a template.
+PLACEHOLDER_PATTERN = re.compile(r'\{\$(\w+)\}')
+
+# [join_ref, ref, "topic", "event", ... of a Phoenix v2 frame
+FRAME_PREFIX_PATTERN = re.compile(
+    r'\[\s*(?:null|"[^"]*")\s*,\s*(?:null|"[^"]*")\s*,\s*"([^"]*)"\s*,\s*"([^"]*)"')
+
+def classify(message: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns the topic and event of a Phoenix v2 frame without decoding the whole frame.
+
+    Args:
+        message(str): a message sent from WebSocket server
+
+    Returns:
+        tuple: topic such as "hub:<hub_id>" and event such as "presence_diff",
+            or (None, None) if the frame does not start as expected
+    """
+    match = FRAME_PREFIX_PATTERN.match(message)
+    if match is None:
+        return None, None
+    return match.group(1), match.group(2)
+
+class Template:
+    """
+    A class represents a Phoenix request template compiled once.
+
+    The template is validated as a Phoenix v2 frame and serialized, then split
+    into literal segments and placeholders. Encoding a message only joins the
+    segments with the JSON-escaped field values, without any JSON round trip.
+    The join reference of the frame is itself a placeholder, "join_ref",
+    defaulting to the template's one.
+    """
+
+    def __init__(self, text: str, name: str = '<string>') -> None:
+        """
+        Args:
+            text(str): JSON text of the template
+            name(str): name of the template in error messages
+
+        Raises:
+            ValueError: the template is not a Phoenix v2 frame
+        """
+        try:
+            frame = json.loads(text)
+        except ValueError as error:
+            raise ValueError(f"{name}: invalid JSON: {error}") from error
+        if not isinstance(frame, list) or len(frame) != 5 or \
+                not all(isinstance(item, str) for item in frame[:4]) or \
+                not isinstance(frame[4], dict):
+            raise ValueError(f"{name}: not a [join_ref, ref, topic, event, payload] frame")
+        if PLACEHOLDER_PATTERN.search(frame[0]):
+            raise ValueError(f"{name}: join_ref must not be a placeholder")
+
+        self.name = name
+        self.topic = frame[2]
+        self.event = frame[3]
+        self.defaults = {'join_ref': frame[0]}  # type: Dict[str, str]
+        frame[0] = '{$join_ref}'
+
+        # Even items are literal JSON text, odd items are placeholder names.
+        self.parts = PLACEHOLDER_PATTERN.split(json.dumps(frame))  # type: List[str]
+        self.fields = frozenset(self.parts[1::2])
+
+    def encode(self, **fields: object) -> str:
+        """
+        Returns a Phoenix request string.
+
+        Args:
+            fields: value of each placeholder, converted with str() and escaped
+
+        Returns:
+            str: Phoenix request string
+
+        Raises:
+            KeyError: a placeholder has no value
+        """
+        parts = self.parts[:]
+        for index in range(1, len(parts), 2):
+            name = parts[index]
+            value = fields.get(name)
+            if value is None:
+                value = self.defaults[name] if name in self.defaults else fields[name]
+            parts[index] = encode_basestring_ascii(str(value))[1:-1]
+        return ''.join(parts)
+
+@functools.lru_cache(maxsize=None)
+def load_template(path: str) -> Template:
+    """
+    Returns the template of a file, read and compiled on the first call only.
+
+    Args:
+        path(str): template file
+
+    Returns:
+        Template: compiled template
+    """
+    with open(path) as template_file:
+        return Template(template_file.read(), path)
+
+def get_req_str(template: str, hub_id: str, seq_number: int, monitor_name: str,
+                join_ref: str = None) -> str:
+    """
+    Returns phoenix request string, built from the given template and hub_id.
+
+    Args:
+        template(str): template file
+        hub_id(str): hub_id
+        seq_number(int): message's sequence number starting from 1
+        monitor_name(str): display name of this monitor program
+        join_ref(str): join reference overriding the template's one
+
+    Returns:
+        str: Phoenix request string after replacement
+    """
+    return load_template(template).encode(hub_id=hub_id, seq_num=seq_number,
+                                          monitor_name=monitor_name, join_ref=join_ref)
+
+def get_joins(hubs_rooms: List[Room], monitor_name: str) -> Tuple[List[str], List[str]]:
+    """
+    Returns the phx_join messages of the rooms sharing one connection.
+
+    Phoenix keeps one channel per topic on a socket, so "ret" is joined once
+    per connection while each room joins its own "hub:<hub_id>" topic with a
+    distinct join reference.
+
+    Args:
+        hubs_rooms: rooms sharing the connection
+        monitor_name: display name of this program
+
+    Returns:
+        tuple: phx_join messages, and join reference of each room's hub channel
+    """
+    joins = [get_req_str(RET_JOIN_TEMPLATE, hubs_rooms[0].get_hub_id(), 1, monitor_name)]
+    join_refs = []
+    for index, hubs_room in enumerate(hubs_rooms):
+        join_ref = str(index + 2)
+        joins.append(get_hub_join_str(hubs_room.get_hub_id(), join_ref, monitor_name))
+        join_refs.append(join_ref)
+    return joins, join_refs
+
+def get_hub_join_str(hub_id: str, join_ref: str, monitor_name: str) -> str:
+    """
+    Returns the phx_join request of a hub channel.
+
+    Args:
+        hub_id(str): hub_id
+        join_ref(str): join reference, unique on the connection
+        monitor_name(str): display name of this program
+
+    Returns:
+        str: Phoenix request string
+    """
+    return get_req_str(HUB_JOIN_TEMPLATE, hub_id, join_ref, monitor_name, join_ref)
+
+# Prefix of the refs of phx_leave requests, to recognize their replies.
+LEAVE_REF_PREFIX = 'leave'
+
+def get_leave_str(hub_id: str, join_ref: str) -> str:
+    """
+    Returns the phx_leave request of a hub channel.
+
+    Args:
+        hub_id(str): hub_id
+        join_ref(str): join reference of the channel
+
+    Returns:
+        str: Phoenix request string
+    """
+    return json.dumps([join_ref, LEAVE_REF_PREFIX + join_ref, 'hub:' + hub_id, 'phx_leave', {}])
+
+# Prefix of the refs of chat messages sent by hubsmon, to recognize their replies.
+CHAT_REF_PREFIX = 'chat'
+
+def get_chat_str(hub_id: str, seq_number: Union[int, str], message: str,
+                 join_ref: str = None) -> str:
+    """
+    Returns phoenix chat request string.
+
+    Args:
+        hub_id(str): hub_id
+        seq_number: message's ref, a sequence number starting from 1 or a prefixed one
+        message(str): chat message, any text including quotes and backslashes
+        join_ref(str): join reference of the hub channel overriding the template's one
+
+    Returns:
+        str: Phoenix request string after replacement
+    """
+    return chat_template.encode(hub_id=hub_id, seq_num=seq_number, msg=message,
+                                join_ref=join_ref)
+
+chat_template = Template(CHAT_TEMPLATE, 'CHAT_TEMPLATE')
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+""" Per-stage timing of the frame pipeline and on-demand CPU and heap captures """
+import asyncio
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import signal
+import tracemalloc
+from typing import Dict, Optional
+from metrics import Histogram
+
+# Stages of an incoming frame: handling in the connection (classify, routing,
+# recording), JSON decoding, roster updates, and logging of the presence events.
+STAGES = ('recv', 'decode', 'dispatch', 'sink')
+
+# Upper bounds in seconds of the buckets of stage time histograms.
+STAGE_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                 0.005, 0.01, 0.025, 0.1)
+
+PROFILE_DIR = 'profiles'
+
+# Default seconds of a CPU and heap capture.
+CAPTURE_WINDOW = 30.0
+
+# Frames kept per traceback of a heap capture.
+TRACEMALLOC_FRAMES = 10
+
+# Lines of the text summaries written next to each capture.
+SUMMARY_LINES = 40
+
+class StageTimer:
+    """
+    A class accumulates the time spent in each stage of the frame pipeline.
+    """
+    __slots__ = ('histograms',)
+
+    def __init__(self) -> None:
+        self.histograms = {stage: Histogram(STAGE_BUCKETS)
+                           for stage in STAGES}  # type: Dict[str, Histogram]
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Records the time of one pass through a stage.
+
+        Args:
+            stage(str): one of STAGES
+            seconds(float): time spent
+        """
+        self.histograms[stage].observe(seconds)
+
+    def format(self) -> str:
+        """
+        Returns a human-readable summary: passes, total and mean time, and share of each stage.
+        """
+        total = sum(histogram.total for histogram in self.histograms.values()) or 1e-9
+        lines = [f"{'stage':<10}{'count':>10}{'total s':>10}{'mean us':>10}{'share':>8}"]
+        for stage, histogram in self.histograms.items():
+            mean = histogram.total / histogram.count if histogram.count else 0.0
+            lines.append(f"{stage:<10}{histogram.count:>10}{histogram.total:>10.3f}"
+                         f"{mean * 1e6:>10.1f}{histogram.total / total:>8.1%}")
+        return '\n'.join(lines)
+
+# Stage timing of this process, disabled when None. Read on every frame.
+stage_timer = None  # type: Optional[StageTimer]
+
+def write_capture(path: str, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot) -> None:
+    """
+    Writes a CPU profile and a heap snapshot, each with a text summary.
+
+    Args:
+        path(str): path of the files without extension
+        profile: disabled CPU profile
+        snapshot: heap snapshot
+    """
+    profile.dump_stats(path + '.prof')
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    with open(path + '.prof.txt', 'w') as summary:
+        summary.write(text.getvalue())
+
+    snapshot.dump(path + '.heap')
+    statistics = snapshot.statistics('lineno')
+    with open(path + '.heap.txt', 'w') as summary:
+        summary.write(f"{sum(stat.size for stat in statistics)} bytes in "
+                      f"{sum(stat.count for stat in statistics)} blocks\n")
+        for stat in statistics[:SUMMARY_LINES]:
+            summary.write(f"{stat}\n")
+
+class Profiler:
+    """
+    A class turns stage timing on and off and captures CPU profiles and heap
+    snapshots while monitoring goes on.
+
+    SIGUSR1 toggles stage timing, printing the summary when turned off.
+    SIGUSR2 starts a capture of `window` seconds: the event loop thread is
+    profiled with cProfile and allocations are traced with tracemalloc, then
+    both are written to `directory` from another thread.
+    """
+
+    def __init__(self,
+                 directory: str = PROFILE_DIR,
+                 window: float = CAPTURE_WINDOW,
+                 suffix: str = '',
+                 stage_timing: bool = False,
+                 capture_at_start: bool = False) -> None:
+        """
+        Args:
+            directory(str): directory of the captures, created on the first one
+            window(float): seconds of a capture
+            suffix(str): appended to the names of the captures, e.g. of a worker
+            stage_timing(bool): time the stages from the start
+            capture_at_start(bool): start a capture at once
+        """
+        self.directory = directory
+        self.window = window
+        self.suffix = suffix
+        self.stage_timing = stage_timing
+        self.capture_at_start = capture_at_start
+        self.capture = None  # type: Optional[asyncio.Future]
+        self.stop = None  # type: Optional[asyncio.Future]
+
+    def toggle_stages(self) -> None:
+        """
+        Turns stage timing on, or off and prints what it measured.
+        """
+        global stage_timer  # pylint: disable=global-statement
+        if stage_timer is None:
+            stage_timer = StageTimer()
+            print("Stage timing on.")
+        else:
+            print(f"Stage timing off:\n{stage_timer.format()}")
+            stage_timer = None
+
+    def trigger(self) -> None:
+        """
+        Starts a capture, unless one is running.
+        """
+        if self.capture is not None and not self.capture.done():
+            print("A capture is already running.")
+            return
+        self.capture = asyncio.ensure_future(self.__capture())
+
+    async def run(self, stop: "asyncio.Future[None]") -> None:
+        """
+        Handles the signals until stop, then lets a running capture finish early.
+
+        Args:
+            stop: stop condition
+        """
+        self.stop = stop
+        loop = asyncio.get_event_loop()
+        handlers = [(getattr(signal, name), callback)
+                    for name, callback in (('SIGUSR1', self.toggle_stages),
+                                           ('SIGUSR2', self.trigger))
+                    if hasattr(signal, name)]
+        for signum, callback in handlers:
+            try:
+                loop.add_signal_handler(signum, callback)
+            except (NotImplementedError, RuntimeError):
+                pass
+        if self.stage_timing and stage_timer is None:
+            self.toggle_stages()
+        if self.capture_at_start:
+            self.trigger()
+        try:
+            await stop
+            if self.capture is not None:
+                await self.capture
+            if stage_timer is not None:
+                self.toggle_stages()
+        finally:
+            for signum, _ in handlers:
+                try:
+                    loop.remove_signal_handler(signum)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+    async def __capture(self) -> None:
+        loop = asyncio.get_event_loop()
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f"capture-{stamp}{self.suffix}")
+        print(f"Capturing CPU and heap for {self.window:.0f} seconds to {path}.*")
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.wait([self.stop], timeout=self.window)
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            await loop.run_in_executor(None, write_capture, path, profile, snapshot)
+        except OSError as ex:
+            print(f"Failed to write the capture: {ex}.")
+        else:
+            print(f"Capture written to {path}.*")
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+""" Compressed append-only recording of the frames received from reticulum """
+import gzip
+import queue
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+# Default seconds between two flushes of the compressed stream.
+FLUSH_INTERVAL = 1.0
+# Default number of frames waiting for the recorder thread before record() blocks.
+MAX_PENDING_FRAMES = 100000
+
+class FrameRecorder:
+    """
+    A class appends every received frame to a gzip file from a background thread.
+
+    Each line of the file is the receive time (seconds since the epoch), the
+    hub_id the frame was routed to (empty if none) and the frame, separated
+    by tabs. Every run appends a new gzip member, which gzip readers
+    concatenate, and the stream is flushed every flush_interval seconds so a
+    crash loses at most that much.
+    """
+
+    def __init__(self,
+                 path: str,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 max_pending: int = MAX_PENDING_FRAMES,
+                 compresslevel: int = 6) -> None:
+        """
+        Args:
+            path(str): recording file, usually ending with .gz
+            flush_interval(float): maximum seconds a frame stays buffered
+            max_pending(int): maximum number of frames queued for the recorder thread
+            compresslevel(int): gzip compression level, 1 (fastest) to 9 (smallest)
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.frames = queue.Queue(maxsize=max_pending)  # type: queue.Queue
+        self.file = gzip.open(path, 'at', compresslevel=compresslevel, encoding='utf-8',
+                              newline='\n')
+        self.thread = threading.Thread(target=self.__run, name='frame-recorder', daemon=True)
+        self.thread.start()
+
+    def record(self, hub_id: Optional[str], message: str) -> None:
+        """
+        Queues a frame to be appended to the recording.
+
+        Args:
+            hub_id(str): hub_id the frame is routed to, or None
+            message(str): the frame as received
+        """
+        self.frames.put((time.time(), hub_id, message))
+
+    def close(self) -> None:
+        """
+        Writes all pending frames and closes the file.
+        """
+        self.frames.put(None)
+        self.thread.join()
+
+    def __run(self) -> None:
+        """
+        Recorder thread: writes frames and flushes the stream on a timer.
+        """
+        deadline = None  # type: Optional[float]
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.frames.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item:
+                received_at, hub_id, message = item
+                if '\n' in message:
+                    # Only whitespace between JSON tokens can be a raw newline.
+                    message = message.replace('\r', ' ').replace('\n', ' ')
+                self.file.write(f"{received_at:.6f}\t{hub_id or ''}\t{message}\n")
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if item is None or (deadline is not None and time.monotonic() >= deadline):
+                self.file.flush()
+                deadline = None
+
+            if item is None:
+                break
+
+        self.file.close()
+
+def read_recording(path: str) -> Iterator[Tuple[float, Optional[str], str]]:
+    """
+    Yields the frames of a recording in order.
+
+    Args:
+        path(str): recording file written by FrameRecorder
+
+    Returns:
+        iterator: receive time, hub_id (None if the frame was not routed to a room) and frame
+    """
+    with gzip.open(path, 'rt', encoding='utf-8', newline='\n') as recording:
+        try:
+            for line in recording:
+                received_at, hub_id, message = line.rstrip('\n').split('\t', 2)
+                yield float(received_at), hub_id or None, message
+        except EOFError:
+            # The recorder was killed in the middle of a gzip member.
+            pass
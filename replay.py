@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+""" A program to replay a frame recording of hubsmon through its processing pipeline """
+import argparse
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import hubsmon
+from csvwriter import CsvWriter
+from recorder import read_recording
+
+def replay(path: str, speed: float = 0.0) -> dict:
+    """
+    Feeds the frames of a recording to hubsmon.process_message.
+
+    Args:
+        path(str): recording file written with hubsmon --record
+        speed(float): replay speed relative to the recording, 0 for as fast as possible
+
+    Returns:
+        dict: number of frames and presence events, and elapsed seconds
+    """
+    events_before = sum(hubsmon.event_counts.values())
+    num_frames = 0
+    first_received_at = None
+    start = time.perf_counter()
+    for received_at, hub_id, message in read_recording(path):
+        if speed > 0:
+            if first_received_at is None:
+                first_received_at = received_at
+            delay = (received_at - first_received_at) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        hubsmon.process_message(hub_id, message)
+        num_frames += 1
+    return {
+        'frames': num_frames,
+        'events': sum(hubsmon.event_counts.values()) - events_before,
+        'elapsed': time.perf_counter() - start,
+    }
+
+def main() -> None:
+    """
+    main thread of this program
+    """
+
+    # Parse command line arguments.
+    parser = argparse.ArgumentParser(
+        description="replay - A tool to replay frames recorded by hubsmon --record."
+    )
+    parser.add_argument("recording", help="a recording file written by hubsmon --record.")
+    parser.add_argument("-s", "--speed", type=float, default=0.0,
+                        help="replay speed relative to the recording, 0 for as fast as possible")
+    parser.add_argument("-o", "--output-dir",
+                        help="directory of the csv files, a temporary directory if omitted")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="print every presence event")
+    parser.add_argument("--tracemalloc", action='store_true',
+                        help="also report the peak Python heap (slows the replay down)")
+    args = parser.parse_args()
+
+    hubsmon.verbose = args.verbose
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='hubsmon-replay-')
+    os.makedirs(output_dir, exist_ok=True)
+    hubsmon.csv_writer = CsvWriter(directory=output_dir)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    try:
+        result = replay(args.recording, args.speed)
+    except KeyboardInterrupt:
+        return
+    finally:
+        hubsmon.csv_writer.close()
+
+    elapsed = max(result['elapsed'], 1e-9)
+    print(f"Replayed {result['frames']} frames, {result['events']} presence events "
+          f"in {elapsed:.2f} seconds.")
+    print(f"{result['frames'] / elapsed:.0f} frames/s, {result['events'] / elapsed:.0f} events/s.")
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak RSS: {peak_rss:.1f} MB.")
+    if args.tracemalloc:
+        _, peak_heap = tracemalloc.get_traced_memory()
+        print(f"Peak Python heap: {peak_heap / 1024 / 1024:.1f} MB.")
+    print(f"CSV files written to {output_dir}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+""" Concurrent resolution of the reticulum server of many hubs rooms """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+import requests
+from requests.adapters import HTTPAdapter
+from hostcache import HostCache
+from room import Room, fetch_reticulum_server
+
+# Default number of room pages fetched at the same time.
+MAX_CONNECTIONS = 16
+# Seconds between two checks for rooms to fetch again: answered from the host cache,
+# e.g. by a reload, or whose connection failed.
+REFRESH_INTERVAL = 5.0
+
+def create_session(max_connections: int) -> requests.Session:
+    """
+    Returns a session keeping up to max_connections connections alive per host.
+
+    Args:
+        max_connections(int): connection pool size
+
+    Returns:
+        requests.Session: session to fetch room pages with
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_connections,
+                          pool_maxsize=max_connections,
+                          pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+async def fetch_hosts(urls: List[str], max_connections: int = MAX_CONNECTIONS) -> list:
+    """
+    Fetches all room pages concurrently.
+
+    Args:
+        urls: mozilla hubs room URLs
+        max_connections(int): maximum number of room pages fetched at the same time
+
+    Returns:
+        list: reticulum server name, None or the raised exception, in the order of urls
+    """
+    if not urls:
+        return []
+    loop = asyncio.get_event_loop()
+    with create_session(max_connections) as session, \
+            ThreadPoolExecutor(max_workers=max_connections) as executor:
+        return await asyncio.gather(
+            *[loop.run_in_executor(executor, fetch_reticulum_server, url, session)
+              for url in urls],
+            return_exceptions=True)
+
+async def resolve_rooms(urls: List[str],
+                        max_connections: int = MAX_CONNECTIONS,
+                        host_cache: HostCache = None,
+                        strict: bool = True
+                       ) -> List[Room]:
+    """
+    Returns the resolved rooms. Rooms found in host_cache are used right away,
+    the pages of the others are fetched concurrently and cached.
+
+    Args:
+        urls: mozilla hubs room URLs
+        max_connections(int): maximum number of room pages fetched at the same time
+        host_cache(HostCache): cache of resolved reticulum servers
+        strict(bool): exit if any room cannot be resolved, otherwise skip it
+
+    Returns:
+        list: rooms in the order of urls
+
+    Raises:
+        SystemExit: if strict and any room cannot be resolved, after reporting all failures
+    """
+    hosts = {}
+    if host_cache is not None:
+        for url in urls:
+            host = host_cache.get(url)
+            if host is not None:
+                hosts[url] = host
+
+    misses = [url for url in urls if url not in hosts]
+    hosts.update(zip(misses, await fetch_hosts(misses, max_connections)))
+
+    hubs_rooms = []
+    failures = 0
+    for url in urls:
+        host = hosts[url]
+        if isinstance(host, Exception):
+            print(f"Failed to resolve {url}: {host}")
+            failures += 1
+            continue
+        if host is None:
+            print(f"Failed to resolve {url}: ret:phx_host not found.")
+            failures += 1
+            continue
+        hubs_room = Room(url, host)
+        hubs_rooms.append(hubs_room)
+        if host_cache is not None and url in misses:
+            host_cache.put(url, hubs_room.get_hub_id(), host)
+
+    if host_cache is not None and misses:
+        await asyncio.get_event_loop().run_in_executor(None, host_cache.write,
+                                                       host_cache.pop_changes())
+    if failures > 0 and strict:
+        raise SystemExit(f"{failures} room(s) could not be resolved.")
+    return hubs_rooms
+
+async def refresh_host_cache(host_cache: HostCache,
+                             max_connections: int = MAX_CONNECTIONS,
+                             interval: float = REFRESH_INTERVAL,
+                             on_resolve: Callable[[str, str], None] = None
+                            ) -> None:
+    """
+    Fetches again the rooms answered from the cache, those of the startup
+    first and then those of each reload, and the rooms whose connection
+    failed, and updates the cache until cancelled.
+
+    Args:
+        host_cache(HostCache): cache of resolved reticulum servers
+        max_connections(int): maximum number of room pages fetched at the same time
+        interval(float): seconds between two checks for new hits
+        on_resolve: called with each room URL fetched and its reticulum server, e.g. to
+            move a running room to its new server
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        # Hits made while fetching are left for the next round.
+        urls = sorted(host_cache.hits)
+        host_cache.hits.difference_update(urls)
+        updated = False
+        for url, host in zip(urls, await fetch_hosts(urls, max_connections)):
+            if isinstance(host, Exception) or host is None:
+                continue
+            entry = host_cache.entries.get(url)
+            if entry is not None and entry['host'] != host:
+                print(f"Reticulum server of {url} changed: {entry['host']} -> {host}")
+            host_cache.put(url, Room(url, host).get_hub_id(), host)
+            updated = True
+            if on_resolve is not None:
+                on_resolve(url, host)
+        if updated:
+            await loop.run_in_executor(None, host_cache.write, host_cache.pop_changes())
+        await asyncio.sleep(interval)
+
+def forget_hosts(host_cache: HostCache, hubs_rooms: List[Room]) -> None:
+    """
+    Drops the cached reticulum server of rooms whose connection failed, and
+    has refresh_host_cache() fetch their pages again in case they moved.
+
+    Args:
+        host_cache(HostCache): cache of resolved reticulum servers
+        hubs_rooms: rooms sharing the failed connection
+    """
+    for hubs_room in hubs_rooms:
+        host_cache.invalidate(hubs_room.get_url())
+        host_cache.hits.add(hubs_room.get_url())
+    # Failures of many connections at once are written together, off the event loop.
+    host_cache.save_later()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+""" Incremental time-bucketed occupancy rollups of hubs rooms """
+import csv
+import datetime
+import os
+import time
+from collections import deque
+from typing import Dict, List, Sequence
+from csvwriter import CsvWriter
+
+# Occupancy counters rolled up, as returned by Roster.get_counts().
+FIELDS = ('room', 'lobby', 'hmd', 'mobile', 'desktop')
+# Default bucket widths in seconds and number of buckets kept in memory per hub.
+WIDTHS = (10, 60, 300)
+CAPACITY = 360
+
+class Bucket:
+    """
+    A class represents the occupancy of a hub during one fixed-width interval.
+    """
+    __slots__ = ('start', 'observed', 'area', 'peak')
+
+    def __init__(self, start: float, counts: Sequence[int]) -> None:
+        self.start = start
+        # seconds of the interval during which the occupancy was known
+        self.observed = 0.0
+        # integral of each counter over the observed seconds
+        self.area = [0.0] * len(FIELDS)
+        self.peak = list(counts)
+
+    def get_average(self) -> List[float]:
+        """
+        Returns the time-weighted average of each counter.
+        """
+        if self.observed <= 0:
+            return list(map(float, self.peak))
+        return [area / self.observed for area in self.area]
+
+class Series:
+    """
+    A class rolls up the occupancy of one hub at one bucket width, keeping
+    the last closed buckets in a ring buffer.
+    """
+    __slots__ = ('width', 'bucket', 'history', 'last_time', 'last_counts')
+
+    def __init__(self, width: int, capacity: int, now: float, counts: Sequence[int]) -> None:
+        self.width = width
+        self.bucket = Bucket(now - now % width, counts)
+        self.history = deque(maxlen=capacity)  # type: deque
+        self.last_time = now
+        self.last_counts = list(counts)
+
+    def advance(self, now: float) -> List[Bucket]:
+        """
+        Accounts the current occupancy up to now.
+
+        Returns:
+            list: buckets closed on the way
+        """
+        closed = []
+        while now >= self.bucket.start + self.width:
+            end = self.bucket.start + self.width
+            self.__accumulate(end)
+            closed.append(self.bucket)
+            self.history.append(self.bucket)
+            self.bucket = Bucket(end, self.last_counts)
+        self.__accumulate(now)
+        return closed
+
+    def update(self, now: float, counts: Sequence[int]) -> List[Bucket]:
+        """
+        Records a new occupancy.
+
+        Returns:
+            list: buckets closed on the way
+        """
+        closed = self.advance(now)
+        self.last_counts = list(counts)
+        peak = self.bucket.peak
+        for index, num in enumerate(counts):
+            if num > peak[index]:
+                peak[index] = num
+        return closed
+
+    def __accumulate(self, until: float) -> None:
+        elapsed = until - self.last_time
+        if elapsed > 0:
+            area = self.bucket.area
+            for index, num in enumerate(self.last_counts):
+                area[index] += num * elapsed
+            self.bucket.observed += elapsed
+            self.last_time = until
+
+class Rollup:
+    """
+    A class maintains occupancy rollups of every hub at several bucket widths.
+
+    Each closed bucket (peak and time-weighted average of room, lobby and
+    device counters) is kept in memory and appended to occupancy_<width>s.csv.
+    """
+
+    def __init__(self,
+                 widths: Sequence[int] = WIDTHS,
+                 capacity: int = CAPACITY,
+                 writer: CsvWriter = None,
+                 suffix: str = '') -> None:
+        """
+        Args:
+            widths: bucket widths in seconds
+            capacity(int): number of closed buckets kept in memory per hub and width
+            writer(CsvWriter): writer of the time-series files, None to keep them in memory only
+            suffix(str): appended to the names of the time-series files, e.g. of a worker
+        """
+        self.widths = tuple(widths)
+        self.capacity = capacity
+        self.writer = writer
+        self.suffix = suffix
+        self.series = {}  # type: Dict[str, List[Series]]
+        if writer is not None:
+            for width in self.widths:
+                init_rollup_csv(os.path.join(writer.directory,
+                                             get_series_name(width) + suffix + '.csv'))
+
+    def update(self, hub_id: str, counts: Dict[str, int], now: float = None) -> None:
+        """
+        Records the current occupancy of a hub.
+
+        Args:
+            hub_id(str): hub_id
+            counts: occupancy as returned by Roster.get_counts()
+            now(float): time of the change, current time if omitted
+        """
+        if now is None:
+            now = time.time()
+        values = [counts[field] for field in FIELDS]
+        hub_series = self.series.get(hub_id)
+        if hub_series is None:
+            self.series[hub_id] = [Series(width, self.capacity, now, values)
+                                   for width in self.widths]
+            return
+        for series in hub_series:
+            self.__emit(hub_id, series, series.update(now, values))
+
+    def tick(self, now: float = None) -> None:
+        """
+        Closes the buckets of every hub that ended by now, even without events.
+
+        Args:
+            now(float): current time if omitted
+        """
+        if now is None:
+            now = time.time()
+        for hub_id, hub_series in self.series.items():
+            for series in hub_series:
+                self.__emit(hub_id, series, series.advance(now))
+
+    def remove(self, hub_id: str, now: float = None) -> None:
+        """
+        Stops the rollups of a hub no longer monitored, after closing its buckets ended by now.
+        The bucket in progress is dropped.
+
+        Args:
+            hub_id(str): hub_id
+            now(float): current time if omitted
+        """
+        if now is None:
+            now = time.time()
+        for series in self.series.pop(hub_id, []):
+            self.__emit(hub_id, series, series.advance(now))
+
+    def get_history(self, hub_id: str, width: int) -> List[dict]:
+        """
+        Returns the closed buckets kept in memory, oldest first.
+
+        Args:
+            hub_id(str): hub_id
+            width(int): bucket width in seconds
+
+        Returns:
+            list: start time, peak and average of each counter per bucket
+        """
+        for series in self.series.get(hub_id, []):
+            if series.width == width:
+                return [{'start': bucket.start,
+                         'peak': dict(zip(FIELDS, bucket.peak)),
+                         'average': dict(zip(FIELDS, bucket.get_average()))}
+                        for bucket in series.history]
+        return []
+
+    def __emit(self, hub_id: str, series: Series, closed: List[Bucket]) -> None:
+        if self.writer is None:
+            return
+        for bucket in closed:
+            row = [datetime.datetime.fromtimestamp(bucket.start).strftime('%Y-%m-%d %H:%M:%S'),
+                   hub_id]
+            row.extend(bucket.peak)
+            row.extend(round(average, 2) for average in bucket.get_average())
+            self.writer.write(get_series_name(series.width) + self.suffix, row)
+
+def get_series_name(width: int) -> str:
+    """
+    Returns the file name, without extension, of the time-series of a bucket width.
+    """
+    return f"occupancy_{width}s"
+
+def init_rollup_csv(filename: str) -> None:
+    """
+    Creates new time-series csv file with csv header if not exists.
+
+    Args:
+        filename(str): csv file
+    """
+    if os.path.exists(filename) is False:
+        with open(filename, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+            writer.writerow(['Bucket start', 'hub_id']
+                            + [f"Peak {field}" for field in FIELDS]
+                            + [f"Average {field}" for field in FIELDS])
@@ -1,17 +1,102 @@
 # -*- coding: utf-8 -*-
 """ Mozilla Hubs room """
+import codecs
+from html.parser import HTMLParser
+from typing import Iterable, Optional
+from urllib.parse import urlparse
 import requests
-from bs4 import BeautifulSoup
+
+# Read the room page by chunks of this size until ret:phx_host is found.
+CHUNK_SIZE = 4096
+# Seconds to wait for the server to connect or send data.
+REQUEST_TIMEOUT = 30
+# Drain the rest of a page up to this size so that the connection can be reused.
+DRAIN_LIMIT = 64 * 1024
+
+class MetaScanner(HTMLParser):
+    """
+    Incremental HTML scanner looking for <meta name="ret:phx_host">.
+    Stops handling the document as soon as the tag is seen, without building a DOM.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.host = None
+        self.found = False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if self.found or tag != 'meta':
+            return
+        attrs = dict(attrs)
+        if (attrs.get('name') or '').lower() == 'ret:phx_host':
+            self.host = (attrs.get('value') or '').lower()
+            self.found = True
+
+    handle_startendtag = handle_starttag
+
+def scan_reticulum_server(chunks: Iterable[bytes], encoding: str = None) -> Optional[str]:
+    """
+    Returns reticulum server name from a room page read by chunks.
+    Stops consuming chunks as soon as ret:phx_host is found.
+
+    Args:
+        chunks: room page's body
+        encoding(str): charset of the body, utf-8 if unknown
+
+    Returns:
+        str: reticulum server name, or None if not found
+    """
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    scanner = MetaScanner()
+    for chunk in chunks:
+        scanner.feed(decoder.decode(chunk))
+        if scanner.found:
+            break
+    return scanner.host
+
+def fetch_reticulum_server(url: str, session: requests.Session = None) -> Optional[str]:
+    """
+    Fetches the room page and returns its reticulum server name.
+
+    Args:
+        url(str): mozilla hubs room's URL.
+        session(requests.Session): session to reuse connections from
+
+    Returns:
+        str: reticulum server name, or None if not found
+
+    Raises:
+        requests.exceptions.RequestException: if the page cannot be fetched
+    """
+    http = session if session is not None else requests
+    with http.get(url, stream=True, timeout=REQUEST_TIMEOUT) as resp:
+        resp.raise_for_status()
+        host = scan_reticulum_server(resp.iter_content(CHUNK_SIZE), resp.encoding)
+        # Read a short remainder so that the connection goes back to the pool,
+        # but give up on large pages: closing is cheaper than reading them.
+        content_length = resp.headers.get('Content-Length')
+        if content_length is not None and int(content_length) - resp.raw.tell() <= DRAIN_LIMIT:
+            for _ in resp.iter_content(CHUNK_SIZE):
+                pass
+    return host
 
 class Room:
     """
     A class represents a hubs room.
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, reticulum_server: str = None) -> None:
+        """
+        Args:
+            url(str): mozilla hubs room's URL.
+            reticulum_server(str): reticulum server name if already known.
+                The room page is fetched to find it when omitted.
+        """
         self.url = url
-        self.reticulum_server = self.__get_reticulum_server(url)
         self.hub_id = self.__get_hub_id(url)
+        if reticulum_server is None:
+            reticulum_server = self.__get_reticulum_server(url)
+        self.reticulum_server = reticulum_server
 
     def get_reticulum_server(self) -> str:
         """
@@ -52,20 +137,10 @@ class Room:
             str: reticulum server name
         """
         try:
-            resp = requests.get(url)
-            resp.raise_for_status()
+            return fetch_reticulum_server(url)
         except requests.exceptions.HTTPError as err:
             raise SystemExit(err)
 
-        host = None
-        soup = BeautifulSoup(resp.text, 'lxml')
-        for meta in soup.findAll("meta"):
-            meta_name = meta.get('name', '').lower()
-            if meta_name == 'ret:phx_host':
-                host = meta.get('value', '').lower()
-                break
-        return host
-
     @staticmethod
     def __get_hub_id(url: str) -> str:
         """
@@ -77,11 +152,28 @@ class Room:
         Returns:
             str: hub_id
         """
-        if url.startswith('https://hubs.mozilla.com/') is False:
-            raise ValueError("Incorrect mozilla hubs URL.")
+        return get_hub_id(url)
+
+def get_hub_id(url: str) -> str:
+    """
+    Extracts hub_id from a mozilla hubs URL, without fetching the page.
+
+    Args:
+        url(str): mozilla hubs room's URL.
+
+    Returns:
+        str: hub_id
+
+    Raises:
+        ValueError: if the URL is not a hubs room URL
+    """
+    # Hubs Cloud instances and local stand-ins share the /<hub_id>/<slug> path layout.
+    parsed = urlparse(url)
+    hub_id = parsed.path.lstrip('/').split('/')[0]
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc or not hub_id:
+        raise ValueError("Incorrect mozilla hubs URL.")
 
-        path = url[len('https://hubs.mozilla.com/'):]
-        return path.split("/")[0]
+    return hub_id
 
 if __name__ == '__main__':
     room = Room("https://hubs.mozilla.com/jccsqWd/tec-j-annual-poster-room-1")
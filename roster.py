@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+""" In-memory presence roster of a hubs room, maintained from presence_state and presence_diff """
+import sys
+from typing import Dict, List, Set, Tuple
+
+PLACES = ('room', 'lobby')
+DEVICES = ('hmd', 'mobile', 'desktop')
+
+class Session:
+    """
+    A class represents a session of a presence, reduced to the fields the
+    monitor reads. The permissions, roles and profile maps of the meta are
+    not kept, and the place and display name strings are interned so that
+    equal values are shared among sessions and rooms.
+    """
+    __slots__ = ('key', 'phx_ref', 'presence', 'display_name', 'hmd', 'mobile', 'device')
+
+    def __init__(self, key: str, meta: dict) -> None:
+        """
+        Args:
+            key: presence key
+            meta: meta element
+        """
+        context = meta['context']
+        self.key = key
+        self.phx_ref = meta['phx_ref']
+        self.presence = sys.intern(meta['presence'])
+        self.display_name = sys.intern(meta['profile']['displayName'])
+        self.hmd = context.get('hmd') is True
+        self.mobile = context.get('mobile') is True
+        # 'hmd', 'mobile' or 'desktop' (PC browser, including iPad)
+        self.device = 'hmd' if self.hmd else 'mobile' if self.mobile else 'desktop'
+
+def read_sessions(presences: dict) -> List[Session]:
+    """
+    Returns the sessions of a presence_state payload, or of the joins or
+    leaves of a presence_diff, in payload order.
+
+    Args:
+        presences: metas keyed by presence key
+
+    Returns:
+        list: one Session per meta
+    """
+    return [Session(key, meta) for key, presence in presences.items()
+            for meta in presence['metas']]
+
+class Roster:
+    """
+    A class represents the sessions currently present in a hubs room.
+
+    Sessions are keyed by phx_ref and grouped by presence key. Counters of
+    sessions per place and per device are updated on every change, so the
+    current occupancy is available in O(1).
+    """
+
+    def __init__(self) -> None:
+        # phx_ref -> session
+        self.sessions = {}  # type: Dict[str, Session]
+        # presence key -> phx_refs
+        self.keys = {}  # type: Dict[str, Set[str]]
+        # (place, device) -> number of sessions
+        self.counts = {(place, device): 0 for place in PLACES for device in DEVICES}
+        # True once a presence_state has been applied
+        self.initialized = False
+
+    def join(self, session: Session) -> bool:
+        """
+        Adds a session.
+
+        Args:
+            session: session read from a presence payload
+
+        Returns:
+            bool: False if the session was already present
+        """
+        if session.phx_ref in self.sessions:
+            return False
+        place_device = (session.presence, session.device)
+        self.sessions[session.phx_ref] = session
+        self.keys.setdefault(session.key, set()).add(session.phx_ref)
+        self.counts[place_device] = self.counts.get(place_device, 0) + 1
+        return True
+
+    def leave(self, session: Session) -> bool:
+        """
+        Removes a session.
+
+        Args:
+            session: session read from a presence payload
+
+        Returns:
+            bool: False if the session was not present
+        """
+        present = self.sessions.pop(session.phx_ref, None)
+        if present is None:
+            return False
+        refs = self.keys[present.key]
+        refs.discard(present.phx_ref)
+        if not refs:
+            del self.keys[present.key]
+        self.counts[(present.presence, present.device)] -= 1
+        return True
+
+    def apply_state(self, state: List[Session]) -> None:
+        """
+        Replaces the roster with a presence_state snapshot.
+
+        Args:
+            state: sessions of presence_state, as returned by read_sessions()
+        """
+        self.clear()
+        for session in state:
+            self.join(session)
+        self.initialized = True
+
+    def resync(self, state: List[Session]) -> Tuple[List[Session], List[Session]]:
+        """
+        Brings the roster to a presence_state snapshot received after a
+        reconnect, and returns what changed while disconnected.
+
+        Args:
+            state: sessions of presence_state, as returned by read_sessions()
+
+        Returns:
+            tuple: the sessions that joined, and those that left
+        """
+        joined = []
+        present = set()
+        for session in state:
+            present.add(session.phx_ref)
+            if self.join(session):
+                joined.append(session)
+
+        left = [session for phx_ref, session in self.sessions.items()
+                if phx_ref not in present]
+        for session in left:
+            self.leave(session)
+        self.initialized = True
+        return joined, left
+
+    def apply_diff(self, joins: List[Session], leaves: List[Session]) -> None:
+        """
+        Applies the joins then the leaves of a presence_diff, as the Phoenix
+        client does. A move between lobby and room is a join of the new place
+        and a leave of the old phx_ref.
+
+        Args:
+            joins: sessions of the joins, as returned by read_sessions()
+            leaves: sessions of the leaves, as returned by read_sessions()
+        """
+        for session in joins:
+            self.join(session)
+        for session in leaves:
+            self.leave(session)
+
+    def clear(self) -> None:
+        """
+        Removes all sessions.
+        """
+        self.sessions.clear()
+        self.keys.clear()
+        for place_device in self.counts:
+            self.counts[place_device] = 0
+
+    def count(self, place: str = None, device: str = None) -> int:
+        """
+        Returns the number of sessions in a place and/or on a device.
+
+        Args:
+            place: 'room' or 'lobby', any place if omitted
+            device: 'hmd', 'mobile' or 'desktop', any device if omitted
+
+        Returns:
+            int: number of sessions
+        """
+        return sum(num for (num_place, num_device), num in self.counts.items()
+                   if place in (None, num_place) and device in (None, num_device))
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        Returns the current occupancy.
+
+        Returns:
+            dict: number of sessions in room and lobby, and on each device
+        """
+        counts = {place: 0 for place in PLACES}
+        counts.update({device: 0 for device in DEVICES})
+        for (place, device), num in self.counts.items():
+            counts[place] = counts.get(place, 0) + num
+            counts[device] += num
+        return counts
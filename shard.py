@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+""" Sharding of the monitored rooms across worker processes, supervised by the parent """
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+from connection import BACKOFF_RESET, ConnectionStats, get_backoff_delay
+from dashboard import Dashboard
+from room import Room
+from roster import DEVICES, PLACES
+
+# Seconds between two occupancy summaries sent by a worker.
+SUMMARY_INTERVAL = 1.0
+# Seconds given to workers to close their connections and files on shutdown.
+SHUTDOWN_TIMEOUT = 10.0
+
+# Counters of a summary row, followed by the number of presence events,
+# the connection state and the last heartbeat round-trip time.
+SUMMARY_FIELDS = PLACES + DEVICES
+
+def get_shard(hub_id: str, num_workers: int) -> int:
+    """
+    Returns the worker serving a room. The hash is stable across runs and
+    Python processes, unlike hash() of a str.
+
+    Args:
+        hub_id(str): hub_id
+        num_workers(int): number of worker processes
+
+    Returns:
+        int: worker index from 0 to num_workers - 1
+    """
+    return zlib.crc32(hub_id.encode()) % num_workers
+
+def split_rooms(hubs_rooms: List[Room], num_workers: int) -> List[List[Room]]:
+    """
+    Returns the rooms of each worker.
+
+    Args:
+        hubs_rooms: rooms to be monitored
+        num_workers(int): number of worker processes
+
+    Returns:
+        list: rooms per worker, some of them possibly empty
+    """
+    shards = [[] for _ in range(num_workers)]  # type: List[List[Room]]
+    for hubs_room in hubs_rooms:
+        shards[get_shard(hubs_room.get_hub_id(), num_workers)].append(hubs_room)
+    return shards
+
+def get_worker_path(path: str, index: int) -> str:
+    """
+    Returns the file of a worker derived from a file name, e.g. frames.w0.gz.
+
+    Args:
+        path(str): file name given on the command line
+        index(int): worker index
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+def make_summary(hub_id: str, counts: Dict[str, int], events: int,
+                 stats: Optional[ConnectionStats]) -> Tuple:
+    """
+    Returns the compact summary row of a room sent by a worker to the parent.
+
+    Args:
+        hub_id(str): hub_id
+        counts: occupancy as returned by Roster.get_counts()
+        events(int): number of presence events processed
+        stats: state of the connection serving the room
+
+    Returns:
+        tuple: hub_id, counters, events, connection state and last RTT
+    """
+    return ((hub_id,) + tuple(counts[field] for field in SUMMARY_FIELDS)
+            + (events,
+               stats.state if stats is not None else 'connecting',
+               stats.rtt_last if stats is not None else None))
+
+class RoomSummary:
+    """
+    A class represents the occupancy of a room reported by its worker, in
+    place of its Roster for the combined Dashboard.
+    """
+    __slots__ = ('counts',)
+
+    def __init__(self) -> None:
+        self.counts = dict.fromkeys(SUMMARY_FIELDS, 0)
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        Returns the last reported occupancy.
+        """
+        return self.counts
+
+class Worker:
+    """
+    A class represents a worker process and its restart state.
+    """
+    __slots__ = ('index', 'hubs_rooms', 'process', 'started_at', 'attempt', 'restart_at')
+
+    def __init__(self, index: int, hubs_rooms: List[Room]) -> None:
+        self.index = index
+        self.hubs_rooms = hubs_rooms
+        self.process = None  # type: Optional[multiprocessing.Process]
+        self.started_at = 0.0
+        self.attempt = 0
+        # time.monotonic() of the next start when waiting to restart
+        self.restart_at = None  # type: Optional[float]
+
+class Supervisor:
+    """
+    A class runs a worker process per shard of rooms, restarts workers that
+    exit, and merges their occupancy summaries into one view.
+
+    Workers are started with target(index, hubs_rooms, summaries, **kwargs)
+    and must put (index, rows) on the summaries queue, one row per room as
+    returned by make_summary(). They should ignore SIGINT and stop on SIGTERM,
+    which the parent sends on shutdown.
+
+    SIGUSR1 and SIGUSR2 are forwarded to the workers. With reload, every
+    shard has a worker even without rooms yet, SIGHUP is forwarded too, and
+    the view follows the rooms they report.
+    """
+
+    def __init__(self,
+                 target: Callable,
+                 hubs_rooms: List[Room],
+                 num_workers: int,
+                 kwargs: dict = None,
+                 dashboard_interval: float = None,
+                 reload: bool = False) -> None:
+        """
+        Args:
+            target: worker entry point
+            hubs_rooms: rooms to be monitored, in display order
+            num_workers(int): number of worker processes
+            kwargs: keyword arguments given to every worker
+            dashboard_interval(float): seconds between two redraws of the combined view,
+                disabled if None
+            reload(bool): workers add and remove rooms while running, e.g. on SIGHUP
+        """
+        self.target = target
+        self.kwargs = kwargs or {}
+        self.reload = reload
+        self.workers = [Worker(index, shard)
+                        for index, shard in enumerate(split_rooms(hubs_rooms, num_workers))
+                        if shard or reload]
+        self.summaries = multiprocessing.Queue()  # type: multiprocessing.Queue
+        self.stopping = False
+
+        self.hub_ids = [hubs_room.get_hub_id() for hubs_room in hubs_rooms]
+        self.rooms = {}  # type: Dict[str, RoomSummary]
+        self.connection_stats = {}  # type: Dict[str, ConnectionStats]
+        self.event_counts = {}  # type: Dict[str, int]
+        # presence events counted by previous runs of each room's worker
+        self.event_bases = {}  # type: Dict[str, int]
+        for hub_id in self.hub_ids:
+            self.__add_room(hub_id)
+        # hub_ids last reported by each worker
+        self.worker_rooms = {worker.index: {hubs_room.get_hub_id()
+                                            for hubs_room in worker.hubs_rooms}
+                             for worker in self.workers}
+        self.dashboard = None  # type: Optional[Dashboard]
+        if dashboard_interval is not None:
+            self.dashboard = Dashboard(self.hub_ids, self.rooms, self.connection_stats,
+                                       self.event_counts, dashboard_interval)
+
+    def run(self) -> None:
+        """
+        Supervise the workers until SIGINT or SIGTERM, then stop them.
+        """
+        previous = {signum: signal.signal(signum, self.__request_stop)
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
+        forwarded = ('SIGUSR1', 'SIGUSR2') + (('SIGHUP',) if self.reload else ())
+        for name in forwarded:
+            if hasattr(signal, name):
+                signum = getattr(signal, name)
+                previous[signum] = signal.signal(signum, self.__forward)
+        try:
+            for worker in self.workers:
+                self.__start(worker)
+            next_draw = time.monotonic()
+            while not self.stopping:
+                try:
+                    index, rows = self.summaries.get(timeout=0.2)
+                except queue.Empty:
+                    pass
+                else:
+                    self.__apply(index, rows)
+
+                now = time.monotonic()
+                for worker in self.workers:
+                    self.__check(worker, now)
+                if self.dashboard is not None and now >= next_draw:
+                    self.dashboard.draw()
+                    next_draw = now + self.dashboard.interval
+        finally:
+            self.__shutdown()
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def __request_stop(self, signum, frame) -> None:  # pylint: disable=unused-argument
+        self.stopping = True
+
+    def __forward(self, signum, frame) -> None:  # pylint: disable=unused-argument
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signum)
+
+    def __add_room(self, hub_id: str) -> None:
+        self.rooms[hub_id] = RoomSummary()
+        self.connection_stats[hub_id] = ConnectionStats()
+        self.event_counts[hub_id] = 0
+        self.event_bases[hub_id] = 0
+
+    def __start(self, worker: Worker) -> None:
+        worker.process = multiprocessing.Process(
+            target=self.target, name=f"hubsmon-worker-{worker.index}",
+            args=(worker.index, worker.hubs_rooms, self.summaries), kwargs=self.kwargs)
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        print(f"Worker {worker.index} (pid {worker.process.pid}) monitors "
+              f"{len(worker.hubs_rooms)} rooms.")
+
+    def __check(self, worker: Worker, now: float) -> None:
+        """
+        Restarts a worker that exited, with exponential backoff.
+        """
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                self.__start(worker)
+            return
+        if worker.process.is_alive():
+            return
+
+        # A worker that ran for a while starts a new backoff sequence.
+        if now - worker.started_at >= BACKOFF_RESET:
+            worker.attempt = 0
+        worker.attempt += 1
+        delay = get_backoff_delay(worker.attempt)
+        worker.restart_at = now + delay
+        print(f"Worker {worker.index} exited with code {worker.process.exitcode}, "
+              f"restarting in {delay:.1f} seconds.")
+        for hub_id in self.worker_rooms[worker.index]:
+            self.connection_stats[hub_id].state = 'restarting'
+            self.event_bases[hub_id] = self.event_counts[hub_id]
+
+    def __apply(self, index: int, rows: List[Tuple]) -> None:
+        """
+        Merges the summary rows of a worker into the combined view, adding the
+        rooms it joined and dropping those it left.
+        """
+        num_fields = len(SUMMARY_FIELDS)
+        reported = {row[0] for row in rows}
+        if self.reload:
+            for hub_id in self.worker_rooms[index] - reported:
+                self.hub_ids.remove(hub_id)
+                for states in (self.rooms, self.connection_stats, self.event_counts,
+                               self.event_bases):
+                    del states[hub_id]
+            for hub_id in reported - self.worker_rooms[index]:
+                self.hub_ids.append(hub_id)
+                self.__add_room(hub_id)
+            self.worker_rooms[index] = reported
+        for row in rows:
+            hub_id = row[0]
+            room = self.rooms.get(hub_id)
+            if room is None:
+                continue
+            room.counts = dict(zip(SUMMARY_FIELDS, row[1:num_fields + 1]))
+            events, state, rtt = row[num_fields + 1:]
+            self.event_counts[hub_id] = self.event_bases[hub_id] + events
+            stats = self.connection_stats[hub_id]
+            stats.state = state
+            stats.rtt_last = rtt
+
+    def __shutdown(self) -> None:
+        """
+        Asks the workers to stop, and kills those that do not in time.
+        """
+        workers = [worker for worker in self.workers
+                   if worker.process is not None and worker.process.is_alive()]
+        for worker in workers:
+            worker.process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker in workers:
+            # Keep the queue drained so that workers can flush it and exit.
+            while worker.process.is_alive() and time.monotonic() < deadline:
+                try:
+                    self.summaries.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if worker.process.is_alive():
+                print(f"Worker {worker.index} did not stop in time, killing it.")
+                worker.process.kill()
+            worker.process.join()
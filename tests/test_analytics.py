@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+""" Tests of the pairing of event log rows into sessions by analytics.py """
+import csv
+import datetime
+import os
+import random
+import sys
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from analytics import IN, JOINS, LEAVES, LOG_HEADER, EventLog, load_logs, pair_sessions
+from roster import PLACES
+
+START = datetime.datetime(2020, 11, 13, 10, 0, 0)
+
+def write_log(path: str, rows: list) -> None:
+    """
+    Writes an event log of (seconds from START, display name, event type, place) rows.
+    """
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(LOG_HEADER)
+        for seconds, name, event, place in rows:
+            timestamp = (START + datetime.timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+            writer.writerow([timestamp, name, event, place, 'False', 'False'])
+
+def get_sessions(log: EventLog) -> list:
+    """
+    Returns the sessions of a log as sorted (name, place, start, end, left
+    censored, right censored) tuples, times in seconds from START.
+    """
+    sessions = pair_sessions(log)
+    origin = int(np.datetime64(START, 's').astype(np.int64))
+    return sorted((log.names[sessions.name[index]], PLACES[sessions.place[index]],
+                   int(sessions.start[index]) - origin, int(sessions.end[index]) - origin,
+                   bool(sessions.left_censored[index]), bool(sessions.right_censored[index]))
+                  for index in range(len(sessions)))
+
+def test_pair_sessions(tmp_path):
+    """
+    A hand-built log of two monitor runs, with coalesced events.
+    """
+    path = os.path.join(str(tmp_path), 'hub1.csv')
+    write_log(path, [
+        # First run: Alice is there when the monitor starts.
+        (0, 'Monitor', 'in', 'lobby'),
+        (0, 'Alice', 'in', 'room'),
+        (10, 'Bob', 'joins', 'lobby'),
+        # Leaves the lobby and joins the room at once.
+        (20, 'Bob', 'moves', 'room'),
+        # Left without having joined: dropped.
+        (25, 'Carol', 'leaves', 'lobby'),
+        (30, 'Alice', 'leaves', 'room'),
+        # Reconnected: the session goes on.
+        (40, 'Bob', 'rejoin', 'room'),
+        (50, 'Dave', 'joins', 'room'),
+        # Second run, after a restart: sessions of the first run end with it.
+        (100, 'Monitor', 'in', 'lobby'),
+        (100, 'Bob', 'in', 'room'),
+        (120, 'Bob', 'leaves', 'room'),
+        # Joined in the first run: not paired across the restart.
+        (130, 'Dave', 'leaves', 'room'),
+        (140, 'Eve', 'joins', 'lobby'),
+        (150, 'Eve', 'leaves', 'lobby'),
+    ])
+    assert get_sessions(load_logs([path])) == sorted([
+        ('Monitor', 'lobby', 0, 50, True, True),
+        ('Alice', 'room', 0, 30, True, False),
+        ('Bob', 'lobby', 10, 20, False, False),
+        ('Bob', 'room', 20, 50, False, True),
+        ('Dave', 'room', 50, 50, False, True),
+        ('Monitor', 'lobby', 100, 150, True, True),
+        ('Bob', 'room', 100, 120, True, False),
+        ('Eve', 'lobby', 140, 150, False, False),
+    ])
+
+def pair_rows(rows: list) -> list:
+    """
+    Pairs (seconds, name, event, place) rows of one hub, one row at a time.
+    """
+    runs = []
+    for index, row in enumerate(rows):
+        if not runs or (row[2] == IN and rows[index - 1][2] != IN):
+            runs.append([])
+        runs[-1].append(row)
+
+    sessions = []
+    for run in runs:
+        run_end = max(row[0] for row in run)
+        opened = {}
+        for seconds, name, event, place in sorted(run, key=lambda row: row[0]):
+            starts = opened.setdefault((name, place), [])
+            if event == LEAVES:
+                if starts:
+                    start, left_censored = starts.pop(0)
+                    sessions.append((name, PLACES[place], start, seconds, left_censored, False))
+            else:
+                starts.append((seconds, event == IN))
+        for (name, place), starts in opened.items():
+            sessions.extend((name, PLACES[place], start, run_end, left_censored, True)
+                            for start, left_censored in starts)
+    return sorted(sessions)
+
+def test_pair_sessions_random():
+    """
+    Random logs paired as one row at a time.
+    """
+    generator = random.Random(1)
+    for _ in range(50):
+        rows = []
+        seconds = 0
+        for _ in range(generator.randint(1, 60)):
+            seconds += generator.randint(0, 3)
+            event = generator.choice((IN, JOINS, LEAVES, LEAVES))
+            rows.append((seconds, generator.choice('ABC'), event, generator.randint(0, 1)))
+        names = sorted({row[1] for row in rows})
+        origin = int(np.datetime64(START, 's').astype(np.int64))
+        log = EventLog(['hub1'], names, {
+            'hub': np.zeros(len(rows), dtype=np.int32),
+            'time': np.array([origin + row[0] for row in rows], dtype=np.int64),
+            'name': np.array([names.index(row[1]) for row in rows], dtype=np.int32),
+            'place': np.array([row[3] for row in rows], dtype=np.int8),
+            'event': np.array([row[2] for row in rows], dtype=np.int8),
+        })
+        assert get_sessions(log) == pair_rows(rows)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+""" Tests of the pairing of leaves and joins into move and rejoin events by coalescer.py """
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from coalescer import Coalescer
+from roster import Session
+
+def make_session(key: str, phx_ref: str, presence: str) -> Session:
+    """
+    Returns a session of a presence key in a place.
+    """
+    return Session(key, {'phx_ref': phx_ref, 'presence': presence, 'context': {},
+                         'profile': {'displayName': key.upper()}})
+
+def get_events(events: list) -> list:
+    """
+    Returns (phx_ref, event type, time) of the events returned by coalesce().
+    """
+    return [(session.phx_ref, event_type, at) for session, event_type, at in events]
+
+def test_leave_then_join():
+    """
+    A leave paired with a join of the same call, then with one of a later call.
+    """
+    coalescer = Coalescer(window=5.0)
+    # Entering the room from the lobby in one diff.
+    assert get_events(coalescer.coalesce(
+        'hub1', [make_session('a', 'a2', 'room')], [make_session('a', 'a1', 'lobby')],
+        10.0)) == [('a2', 'moves', 10.0)]
+    assert coalescer.coalesce('hub1', [], [make_session('b', 'b1', 'room')], 11.0) == []
+    assert get_events(coalescer.coalesce(
+        'hub1', [make_session('b', 'b2', 'room')], [], 13.0)) == [('b2', 'rejoin', 13.0)]
+    assert len(coalescer) == 0
+
+def test_join_then_leave():
+    """
+    A join paired with a leave of a later call, at the time of the join.
+    """
+    coalescer = Coalescer(window=5.0)
+    # A reconnecting client: the new session joins before the old one leaves.
+    assert coalescer.coalesce('hub1', [make_session('a', 'a2', 'room')], [], 10.0) == []
+    assert get_events(coalescer.coalesce(
+        'hub1', [], [make_session('a', 'a1', 'room')], 12.0)) == [('a2', 'rejoin', 10.0)]
+    assert coalescer.coalesce('hub1', [make_session('b', 'b2', 'room')], [], 13.0) == []
+    assert get_events(coalescer.coalesce(
+        'hub1', [], [make_session('b', 'b1', 'lobby')], 14.0)) == [('b2', 'moves', 13.0)]
+    assert len(coalescer) == 0
+
+def test_unpaired():
+    """
+    Joins and leaves of other keys, hubs or of the same session are not
+    paired, and are released once the window has passed.
+    """
+    coalescer = Coalescer(window=5.0)
+    assert coalescer.coalesce('hub1', [make_session('a', 'a1', 'room')], [], 10.0) == []
+    assert coalescer.coalesce('hub2', [], [make_session('a', 'a0', 'room')], 11.0) == []
+    assert coalescer.coalesce('hub1', [], [make_session('b', 'b0', 'room')], 12.0) == []
+    # A short visit: the join is released by the leave of its session, which is held.
+    assert get_events(coalescer.coalesce(
+        'hub1', [], [make_session('a', 'a1', 'room')], 13.0)) == [('a1', 'joins', 10.0)]
+    assert [(hub_id, at, session.phx_ref, event_type) for hub_id, at, session, event_type
+            in coalescer.expire(16.5)] == [('hub2', 11.0, 'a0', 'leaves')]
+    assert [(hub_id, at, session.phx_ref, event_type) for hub_id, at, session, event_type
+            in coalescer.expire(float('inf'))] == [('hub1', 12.0, 'b0', 'leaves'),
+                                                   ('hub1', 13.0, 'a1', 'leaves')]
+    assert len(coalescer) == 0 and not coalescer.keys
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+""" Tests of the rotation, indexing and time-range reading of csv files by csvwriter.py """
+import csv
+import datetime
+import gzip
+import io
+import os
+import sys
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+import csvwriter
+from csvwriter import INDEX_HEADER, INDEX_SUFFIX, CsvWriter, close_segment, read_rows
+
+START = datetime.datetime(2020, 11, 13, 10, 0, 0)
+HEADER = '"Timestamp","Display name","Event type","Room or lobby"\r\n'
+
+def make_rows(count: int) -> list:
+    """
+    Returns rows one second apart, except every fourth one, logged ten seconds
+    late as a leave released by coalescing.
+    """
+    rows = []
+    for index in range(count):
+        seconds = index - 10 if index % 4 == 3 else index
+        timestamp = (START + datetime.timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append([timestamp, f'User {index}', 'leaves' if index % 4 == 3 else 'joins', 'room'])
+    return rows
+
+def write_csv(path: str, rows: list, header: str = HEADER) -> None:
+    """
+    Writes a csv file as CsvWriter does, after a header line.
+    """
+    with open(path, 'w', newline='') as csv_file:
+        csv_file.write(header)
+        csv.writer(csv_file, quoting=csv.QUOTE_ALL).writerows(rows)
+
+def read_chunk(path: str, offset: int, chunk_end: int = None) -> list:
+    """
+    Returns the rows of a segment chunk.
+    """
+    with open(path, 'rb') as segment_file:
+        segment_file.seek(offset)
+        data = segment_file.read(-1 if chunk_end is None else chunk_end - offset)
+    if path.endswith('.gz'):
+        data = gzip.decompress(data)
+    return [row for row in csv.reader(io.StringIO(data.decode(), newline='')) if row]
+
+@pytest.mark.parametrize('compress', [True, False])
+@pytest.mark.parametrize('count', [6, 7])
+def test_close_segment(tmp_path, monkeypatch, compress, count):
+    """
+    Chunks of CHUNK_ROWS rows, the last one possibly shorter, each indexed
+    with its earliest and latest timestamps and readable from its offset.
+    """
+    monkeypatch.setattr(csvwriter, 'CHUNK_ROWS', 3)
+    path = os.path.join(str(tmp_path), 'hub1.csv')
+    rows = make_rows(count)
+    write_csv(path, rows)
+
+    entries = close_segment(path, HEADER, compress)
+    suffix = '.csv.gz' if compress else '.csv'
+    assert [entry[0] for entry in entries] == ['hub1.20201113-100000' + suffix] * (
+        (count + 2) // 3)
+    segment_path = os.path.join(str(tmp_path), entries[0][0])
+    chunks = [rows[index:index + 3] for index in range(0, count, 3)]
+    for number, (entry, chunk) in enumerate(zip(entries, chunks)):
+        timestamps = [row[0] for row in chunk]
+        assert entry[1:3] == [min(timestamps), max(timestamps)]
+        chunk_end = entries[number + 1][3] if number + 1 < len(entries) else None
+        assert read_chunk(segment_path, entry[3], chunk_end) == chunk
+    # The header comes first, and the file is left to the caller.
+    with open(segment_path, 'rb') as segment_file:
+        data = segment_file.read(entries[0][3])
+    assert (gzip.decompress(data) if compress else data).decode() == HEADER
+    assert os.path.exists(path)
+
+def test_close_segment_empty(tmp_path):
+    """
+    A file without rows gives no segment.
+    """
+    path = os.path.join(str(tmp_path), 'hub1.csv')
+    write_csv(path, [])
+    assert close_segment(path, HEADER, True) == []
+    assert os.listdir(str(tmp_path)) == ['hub1.csv']
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_rotation_by_size(tmp_path, monkeypatch, compress):
+    """
+    Rows written through rotations by size, out of time order, read back by
+    time range across the segments and the live file.
+    """
+    monkeypatch.setattr(csvwriter, 'CHUNK_ROWS', 3)
+    directory = str(tmp_path)
+    write_csv(os.path.join(directory, 'hub1.csv'), [])
+    rows = make_rows(40)
+    writer = CsvWriter(flush_rows=1, flush_interval=60.0, directory=directory,
+                       rotate_bytes=600, compress=compress)
+    for row in rows:
+        writer.write('hub1', row)
+    writer.close()
+
+    suffix = '.csv.gz' if compress else '.csv'
+    segments = sorted(file_name for file_name in os.listdir(directory)
+                      if csvwriter.SEGMENT_PATTERN.search(file_name))
+    assert len(segments) >= 3
+    assert all(file_name.endswith(suffix) for file_name in segments)
+    assert not [file_name for file_name in os.listdir(directory)
+                if file_name.endswith('.pending')]
+    with open(os.path.join(directory, 'hub1' + INDEX_SUFFIX), newline='') as index_file:
+        index = list(csv.reader(index_file))
+    assert index[0] == INDEX_HEADER
+    assert sorted({entry[0] for entry in index[1:]}) == segments
+    # Rotated once over the limit: the live file keeps the header and the last rows.
+    with open(os.path.join(directory, 'hub1.csv'), newline='') as csv_file:
+        assert csv_file.readline() == HEADER
+        assert 0 < len([row for row in csv.reader(csv_file) if row]) < len(rows)
+
+    assert list(read_rows(directory, 'hub1')) == rows
+    timestamps = sorted({row[0] for row in rows})
+    for start in timestamps[::3]:
+        for end in timestamps[::5]:
+            assert list(read_rows(directory, 'hub1', start, end)) == \
+                [row for row in rows if start <= row[0] <= end], (start, end)
+    assert list(read_rows(directory, 'hub1', start=timestamps[-1])) == \
+        [row for row in rows if row[0] == timestamps[-1]]
+    assert list(read_rows(directory, 'hub1', end=timestamps[0])) == \
+        [row for row in rows if row[0] == timestamps[0]]
+
+def test_pending_files(tmp_path, monkeypatch):
+    """
+    A rotated file not yet closed as a segment is read, and closed at the next start.
+    """
+    monkeypatch.setattr(csvwriter, 'CHUNK_ROWS', 3)
+    directory = str(tmp_path)
+    rows = make_rows(12)
+    write_csv(os.path.join(directory, 'hub1.csv.2.pending'), rows[4:8])
+    write_csv(os.path.join(directory, 'hub1.csv.1.pending'), rows[:4])
+    write_csv(os.path.join(directory, 'hub1.csv'), rows[8:])
+    assert list(read_rows(directory, 'hub1')) == rows
+
+    CsvWriter(directory=directory).close()
+    assert sorted(os.listdir(directory)) == ['hub1.20201113-100000.csv.gz',
+                                             'hub1.20201113-100004.csv.gz', 'hub1.csv',
+                                             'hub1.index.csv']
+    assert list(read_rows(directory, 'hub1')) == rows
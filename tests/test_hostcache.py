@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+""" Tests of the host cache file shared by worker processes """
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from hostcache import HostCache
+
+def test_writes_merge(tmp_path):
+    """
+    Caches sharing a file, as workers do, keep the changes of each other.
+    """
+    path = os.path.join(str(tmp_path), 'hosts_cache.json')
+    first = HostCache(path)
+    first.put('https://hubs.example/room1', 'room1', 'host1')
+    first.put('https://hubs.example/room2', 'room2', 'host1')
+    first.save()
+
+    second = HostCache(path)
+    first.put('https://hubs.example/room3', 'room3', 'host1')
+    second.invalidate('https://hubs.example/room2')
+    second.put('https://hubs.example/room4', 'room4', 'host2')
+    second.save()
+    first.save()
+    assert first.changes == {}
+
+    entries = HostCache(path).entries
+    assert {url: entry['host'] for url, entry in entries.items()} == {
+        'https://hubs.example/room1': 'host1',
+        'https://hubs.example/room3': 'host1',
+        'https://hubs.example/room4': 'host2',
+    }
+    assert sorted(os.listdir(str(tmp_path))) == ['hosts_cache.json', 'hosts_cache.json.lock']
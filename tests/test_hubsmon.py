@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" Tests of hubsmon monitoring rooms of the local stand-in server """
+import asyncio
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import time
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+# pylint: disable=wrong-import-position
+import connection
+import hubsmon
+from room import Room
+from standin import run_server
+
+# Seconds given to the monitor to report its startup.
+TIMEOUT = 15.0
+
+def start_standin(**simulation) -> tuple:
+    """
+    Starts a stand-in server process on a free port, and waits until it accepts connections.
+
+    Args:
+        simulation: keyword arguments of run_server
+
+    Returns:
+        tuple: server process and its port
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = multiprocessing.Process(target=run_server, args=('127.0.0.1', port),
+                                     kwargs=simulation, daemon=True)
+    server.start()
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, port
+        except OSError:
+            if time.monotonic() >= deadline:
+                server.terminate()
+                raise
+            time.sleep(0.05)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs the test in a temporary directory holding the join templates, for the csv files.
+    """
+    for template in ('phx_join_1.template', 'phx_join_2.template'):
+        shutil.copy(os.path.join(ROOT_DIR, template), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(connection, 'RETICULUM_IO_URL', "ws://{host}/socket/websocket?vsn=2.0.0")
+    return tmp_path
+
+def test_startup_report_with_rooms_given_up(workdir, monkeypatch, capsys):
+    """
+    Rooms whose joins the stand-in rejects for good are given up, their
+    connections closed, and the startup report still appears.
+    """
+    # A rejected join is sent again right away, and given up when rejected again,
+    # well before the stand-in accepts another join a second later.
+    monkeypatch.setattr(connection, 'JOIN_RETRIES', 1)
+    monkeypatch.setattr(connection, 'get_backoff_delay', lambda attempt: 0.0)
+    server, port = start_standin(churn=0.0, users=2, join_rate=1.0)
+    hubs_rooms = [Room(f"http://127.0.0.1/room{index}/test-room", f"127.0.0.1:{port}")
+                  for index in range(4)]
+    output = []
+
+    async def watch(stop: "asyncio.Future[None]") -> None:
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.wait([stop], timeout=0.05)
+            output.append(capsys.readouterr().out)
+            text = ''.join(output)
+            if hubsmon.startup_at is None and \
+                    text.count("Connection closed") >= len(hubsmon.given_up_hub_ids):
+                break
+        connection.request_stop(stop)
+
+    async def run() -> None:
+        stop = asyncio.get_event_loop().create_future()
+        watcher = asyncio.ensure_future(watch(stop))
+        await hubsmon.monitor(hubs_rooms, 'Test', stop)
+        await watcher
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.terminate()
+        server.join()
+    output.append(capsys.readouterr().out)
+    text = ''.join(output)
+
+    monitored = list(hubsmon.monitored_hub_ids)
+    given_up = list(hubsmon.given_up_hub_ids)
+    assert given_up
+    assert sorted(monitored + given_up) == [f"room{index}" for index in range(4)]
+    assert not hubsmon.awaiting_state
+    assert f"All {len(monitored)} rooms monitored after " in text
+    assert f", {len(given_up)} given up" in text
+    assert text.count("giving up the room") == len(given_up)
+    metrics = hubsmon.render_metrics(monitored)
+    for hub_id in given_up:
+        assert f'hubsmon_room_given_up{{hub_id="{hub_id}"}} 1' in metrics